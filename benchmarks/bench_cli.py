@@ -0,0 +1,127 @@
+"""Start-up benchmark for the shrpi command line tool.
+
+Runs a simulated daemon and times complete `shrpi` invocations as separate
+processes, the way shell scripts call them:
+
+    python benchmarks/bench_cli.py --output bench-cli.json
+"""
+
+import argparse
+import grp
+import json
+import os
+import pathlib
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from bench_utils import percentile
+
+SRC = pathlib.Path(__file__).resolve().parent.parent / "src"
+
+COMMANDS = (
+    ("print",),
+    ("set", "watchdog", "10"),
+)
+
+
+def python_command(code: str) -> List[str]:
+    return [sys.executable, "-c", code]
+
+
+def import_time(env: Dict[str, str]) -> float:
+    """Cumulative import time of shrpi.cli in milliseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import shrpi.cli"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    match = re.search(r"\|\s*(\d+) \| shrpi\.cli$", result.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1000 if match else float("nan")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", "-o", type=pathlib.Path, default=None)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=str(SRC))
+    socket_path = os.path.join(tempfile.mkdtemp(), "shrpid.sock")
+    daemon = subprocess.Popen(
+        python_command("from shrpi.__main__ import daemon; daemon()")
+        + ["--simulate", "2", "-n", "--socket", socket_path]
+        + ["--socket-group", grp.getgrgid(os.getgid()).gr_name]
+        + ["--history-length", "0"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(socket_path):
+            if time.monotonic() > deadline or daemon.poll() is not None:
+                sys.exit("shrpid didn't start")
+            time.sleep(0.05)
+
+        results: Dict[str, Dict[str, float]] = {}
+        cli = python_command("from shrpi.__main__ import cli; cli()")
+        for command in COMMANDS:
+            durations = []
+            for _ in range(args.runs):
+                t0 = time.perf_counter()
+                subprocess.run(
+                    cli + ["--socket", socket_path, *command],
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    check=True,
+                )
+                durations.append(1000 * (time.perf_counter() - t0))
+            name = " ".join(command)
+            results[name] = {
+                "min_ms": min(durations),
+                "median_ms": statistics.median(durations),
+                "p90_ms": percentile(durations, 0.9),
+            }
+            print(
+                f"shrpi {name:<20} min {min(durations):6.1f} ms  "
+                f"median {statistics.median(durations):6.1f} ms",
+                file=sys.stderr,
+            )
+    finally:
+        daemon.terminate()
+        daemon.wait(10)
+
+    # baseline: the interpreter alone
+    t0 = time.perf_counter()
+    for _ in range(args.runs):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    interpreter_ms = 1000 * (time.perf_counter() - t0) / args.runs
+
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.time(),
+            "runs": args.runs,
+        },
+        "interpreter_ms": interpreter_ms,
+        "import_ms": import_time(env),
+        "commands": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Benchmarks for the shrpid hot paths.
+
+The real HTTP server, sampler and state machine run in a child process
+against the simulated SH-RPi register map (shrpi.simulator) with a
+configurable bus latency. The parent process drives HTTP load over the
+UNIX socket and collects the results as JSON:
+
+    python benchmarks/bench_daemon.py --output bench.json
+    python benchmarks/bench_daemon.py --compare old.json --output new.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Sequence
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "src"))
+
+from bench_utils import percentile  # noqa: E402
+
+from shrpi.const import VERSION  # noqa: E402
+
+ENDPOINTS = ("/values", "/values?fresh=1", "/state", "/config", "/version")
+CONCURRENCY = (1, 4, 16, 64)
+
+
+def serve(socket_path: str, latency: float, interval: float, conn: Connection) -> None:
+    """Run the daemon components in a child process.
+
+    Replies to "stats" messages on `conn` with the bus transaction count and
+    the sampler tick intervals observed since the previous request.
+    """
+    from loguru import logger
+
+    from shrpi.async_device import AsyncSHRPiDevice
+    from shrpi.i2c import SHRPiDevice
+    from shrpi.sampler import Sampler
+    from shrpi.server import run_http_server
+    from shrpi.simulator import SimulatedSHRPi
+    from shrpi.state_machine import run_state_machine
+
+    logger.remove()
+
+    async def main() -> None:
+        sim = SimulatedSHRPi(version=2, latency=latency)
+        device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+        async_device = AsyncSHRPiDevice(device)
+        sampler = Sampler(async_device, interval=interval)
+        ticks: List[float] = []
+
+        async def record_ticks() -> None:
+            seq = 0
+            last = None
+            while True:
+                sample = await sampler.wait_for_sample(seq)
+                seq = sample.seq
+                now = time.monotonic()
+                if last is not None:
+                    ticks.append(now - last)
+                last = now
+
+        await run_http_server(
+            async_device,
+            sampler,
+            pathlib.PosixPath(socket_path),
+            os.getgid(),
+            poweroff="true",
+        )
+        tasks = [
+            asyncio.ensure_future(sampler.run()),
+            asyncio.ensure_future(
+                run_state_machine(
+                    async_device,
+                    sampler,
+                    blackout_time_limit=3.0,
+                    blackout_voltage_limit=9.0,
+                    dry_run=True,
+                    fast_interval=interval,
+                    slow_interval=interval,
+                )
+            ),
+            asyncio.ensure_future(record_ticks()),
+        ]
+
+        loop = asyncio.get_running_loop()
+        conn.send("ready")
+        while True:
+            msg = await loop.run_in_executor(None, conn.recv)
+            if msg == "stats":
+                conn.send({"transactions": sim.transactions, "ticks": ticks[:]})
+                ticks.clear()
+            else:
+                break
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(main())
+
+
+async def load(
+    socket_path: str, path: str, concurrency: int, duration: float
+) -> List[float]:
+    """Hammer an endpoint with `concurrency` clients and return the latencies."""
+    from aiohttp import ClientSession, UnixConnector
+
+    latencies: List[float] = []
+    connector = UnixConnector(path=socket_path, limit=concurrency)
+    async with ClientSession(connector=connector) as session:
+        end = time.perf_counter() + duration
+
+        async def client() -> None:
+            while time.perf_counter() < end:
+                t0 = time.perf_counter()
+                async with session.get(f"http://localhost{path}") as resp:
+                    await resp.read()
+                latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies
+
+
+def tick_stats(ticks: Sequence[float], interval: float) -> Dict[str, float]:
+    jitter = [abs(t - interval) for t in ticks]
+    return {
+        "ticks": len(ticks),
+        "interval_mean_ms": 1000 * statistics.mean(ticks) if ticks else 0.0,
+        "jitter_p50_ms": 1000 * percentile(jitter, 0.5),
+        "jitter_p99_ms": 1000 * percentile(jitter, 0.99),
+        "jitter_max_ms": 1000 * max(jitter, default=0.0),
+    }
+
+
+def bench_http(args: argparse.Namespace) -> Dict[str, Any]:
+    socket_path = os.path.join(tempfile.mkdtemp(), "shrpid.sock")
+    parent_conn, child_conn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(
+        target=serve,
+        args=(socket_path, args.latency, args.interval, child_conn),
+        daemon=True,
+    )
+    proc.start()
+    parent_conn.recv()  # wait until the server is listening
+
+    def stats() -> Dict[str, Any]:
+        parent_conn.send("stats")
+        return parent_conn.recv()
+
+    results: Dict[str, Any] = {"endpoints": [], "idle": {}}
+    try:
+        # baseline without any HTTP load
+        start = stats()
+        time.sleep(args.duration)
+        idle = stats()
+        results["idle"] = {
+            "bus_transactions_per_s": (idle["transactions"] - start["transactions"])
+            / args.duration,
+            **tick_stats(idle["ticks"], args.interval),
+        }
+
+        for path in args.endpoints:
+            for concurrency in args.concurrency:
+                before = stats()
+                t0 = time.perf_counter()
+                latencies = asyncio.run(
+                    load(socket_path, path, concurrency, args.duration)
+                )
+                elapsed = time.perf_counter() - t0
+                after = stats()
+                entry = {
+                    "endpoint": path,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "requests_per_s": len(latencies) / elapsed,
+                    "p50_ms": 1000 * percentile(latencies, 0.5),
+                    "p99_ms": 1000 * percentile(latencies, 0.99),
+                    "bus_transactions_per_s": (
+                        after["transactions"] - before["transactions"]
+                    )
+                    / elapsed,
+                    **tick_stats(after["ticks"], args.interval),
+                }
+                results["endpoints"].append(entry)
+                print(
+                    f"{path:<18} c={concurrency:<3} "
+                    f"{entry['requests_per_s']:8.0f} req/s  "
+                    f"p50 {entry['p50_ms']:6.2f} ms  p99 {entry['p99_ms']:6.2f} ms  "
+                    f"bus {entry['bus_transactions_per_s']:7.1f} tx/s  "
+                    f"tick jitter p99 {entry['jitter_p99_ms']:6.2f} ms",
+                    file=sys.stderr,
+                )
+    finally:
+        parent_conn.send("quit")
+        proc.join(5)
+        if proc.is_alive():
+            proc.terminate()
+    return results
+
+
+def bench_bus_overhead(number: int) -> Dict[str, float]:
+    """Measure the Python overhead of device calls on a zero-latency bus."""
+    from shrpi.async_device import AsyncSHRPiDevice
+    from shrpi.i2c import SHRPiDevice
+    from shrpi.simulator import SimulatedSHRPi
+
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    results = {
+        "dcin_voltage_us": device.dcin_voltage,
+        "read_measurements_us": device.read_measurements,
+        "watchdog_timeout_cached_us": device.watchdog_timeout,
+    }
+    out = {
+        name: 1e6 * min(timeit.repeat(func, number=number, repeat=3)) / number
+        for name, func in results.items()
+    }
+
+    async def async_reads() -> float:
+        async_device = AsyncSHRPiDevice(device)
+        t0 = time.perf_counter()
+        for _ in range(number):
+            await async_device.read_measurements()
+        return (time.perf_counter() - t0) / number
+
+    out["async_read_measurements_us"] = 1e6 * asyncio.run(async_reads())
+    return out
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Print the relative change of throughput and latency per endpoint."""
+    old_entries = {
+        (e["endpoint"], e["concurrency"]): e for e in old["http"]["endpoints"]
+    }
+    print(f"Comparing with {old['meta']['daemon_version']}:", file=sys.stderr)
+    for e in new["http"]["endpoints"]:
+        o = old_entries.get((e["endpoint"], e["concurrency"]))
+        if o is None:
+            continue
+        print(
+            f"{e['endpoint']:<18} c={e['concurrency']:<3} "
+            f"req/s {100 * (e['requests_per_s'] / o['requests_per_s'] - 1):+6.1f}%  "
+            f"p99 {100 * (e['p99_ms'] / max(o['p99_ms'], 1e-9) - 1):+6.1f}%",
+            file=sys.stderr,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", "-o", type=pathlib.Path, default=None)
+    parser.add_argument("--compare", type=pathlib.Path, default=None)
+    parser.add_argument(
+        "--latency", type=float, default=0.0005, help="Simulated bus latency in s"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.1, help="Sampling interval in s"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=3.0, help="Duration of each run in s"
+    )
+    parser.add_argument(
+        "--endpoints", nargs="+", default=list(ENDPOINTS), help="Endpoints to load"
+    )
+    parser.add_argument("--concurrency", nargs="+", type=int, default=list(CONCURRENCY))
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "daemon_version": VERSION,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.time(),
+            "latency_s": args.latency,
+            "interval_s": args.interval,
+            "duration_s": args.duration,
+        },
+        "bus": bench_bus_overhead(args.number),
+        "http": bench_http(args),
+    }
+
+    if args.compare is not None:
+        compare(json.loads(args.compare.read_text()), results)
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
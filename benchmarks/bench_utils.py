@@ -0,0 +1,19 @@
+"""Helpers shared by the benchmark scripts."""
+
+from typing import Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Return the q-quantile (0..1) using the nearest-rank method.
+
+    Examples:
+        >>> percentile([1.0, 2.0, 3.0, 4.0], 0.5)
+        2.0
+        >>> percentile([1.0, 2.0, 3.0, 4.0], 0.99)
+        4.0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(q * len(ordered) + 0.999999) - 1))
+    return ordered[rank]
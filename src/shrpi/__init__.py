@@ -2,14 +2,21 @@
 It communicates with the SH-RPi device, providing the "smart"
 aspects of the operation."""
 
-from importlib import metadata as importlib_metadata
+from typing import Any
 
 
 def get_version() -> str:
+    from importlib import metadata as importlib_metadata
+
     try:
         return importlib_metadata.version(__name__)
     except importlib_metadata.PackageNotFoundError:  # pragma: no cover
         return "unknown"
 
 
-version: str = get_version()
+def __getattr__(name: str) -> Any:
+    # importlib.metadata is slow to import, so only look the version up when
+    # it's actually used
+    if name == "version":
+        return get_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,10 +1,14 @@
-import shrpi.cli
-import shrpi.daemon
+import time
 
 
 def daemon():
-    shrpi.daemon.main()
+    t0 = time.perf_counter()
+    import shrpi.daemon
+
+    shrpi.daemon.main(import_time=time.perf_counter() - t0)
 
 
 def cli():
+    import shrpi.cli
+
     shrpi.cli.main()
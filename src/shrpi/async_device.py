@@ -0,0 +1,112 @@
+"""Awaitable facade for the synchronous SH-RPi device interface."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from shrpi.i2c import Measurements, SHRPiDevice
+
+T = TypeVar("T")
+
+
+class AsyncSHRPiDevice:
+    """Run all SHRPiDevice bus I/O on a dedicated single-worker executor.
+
+    Slow or clock-stretched I2C transactions then block only the worker
+    thread, never the event loop. Devices on the same bus can share the
+    executor, so that their requests are served in order by one thread.
+    """
+
+    def __init__(
+        self, device: SHRPiDevice, executor: Optional[ThreadPoolExecutor] = None
+    ):
+        self.device = device
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"shrpi-i2c-{device.bus}"
+            )
+        self._executor = executor
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Run a blocking device call on the bus worker thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.device.close()
+
+    async def hardware_version(self) -> str:
+        return await self.run(self.device.hardware_version)
+
+    async def firmware_version(self) -> str:
+        return await self.run(self.device.firmware_version)
+
+    async def en5v_state(self) -> bool:
+        return await self.run(self.device.en5v_state)
+
+    async def watchdog_timeout(self) -> float:
+        return await self.run(self.device.watchdog_timeout)
+
+    async def set_watchdog_timeout(self, timeout: float) -> None:
+        await self.run(self.device.set_watchdog_timeout, timeout)
+
+    async def power_on_threshold(self) -> float:
+        return await self.run(self.device.power_on_threshold)
+
+    async def set_power_on_threshold(self, threshold: float) -> None:
+        await self.run(self.device.set_power_on_threshold, threshold)
+
+    async def power_off_threshold(self) -> float:
+        return await self.run(self.device.power_off_threshold)
+
+    async def set_power_off_threshold(self, threshold: float) -> None:
+        await self.run(self.device.set_power_off_threshold, threshold)
+
+    async def state(self) -> str:
+        return await self.run(self.device.state)
+
+    async def read_status(self) -> Dict[str, Any]:
+        return await self.run(self.device.read_status)
+
+    async def read_config(self) -> Dict[str, Optional[float]]:
+        return await self.run(self.device.read_config)
+
+    async def config_ranges(self) -> Dict[str, Tuple[float, float]]:
+        return await self.run(self.device.config_ranges)
+
+    async def write_config(self, config: Dict[str, float]) -> None:
+        await self.run(self.device.write_config, config)
+
+    async def dcin_voltage(self) -> float:
+        return await self.run(self.device.dcin_voltage)
+
+    async def supercap_voltage(self) -> float:
+        return await self.run(self.device.supercap_voltage)
+
+    async def read_measurements(self) -> Measurements:
+        return await self.run(self.device.read_measurements)
+
+    async def request_shutdown(self) -> None:
+        await self.run(self.device.request_shutdown)
+
+    async def request_sleep(self) -> None:
+        await self.run(self.device.request_sleep)
+
+    async def watchdog_elapsed(self) -> float:
+        return await self.run(self.device.watchdog_elapsed)
+
+    async def led_brightness(self) -> Optional[int]:
+        return await self.run(self.device.led_brightness)
+
+    async def set_led_brightness(self, brightness: int) -> None:
+        await self.run(self.device.set_led_brightness, brightness)
+
+    async def input_current(self) -> Optional[float]:
+        return await self.run(self.device.input_current)
+
+    async def temperature(self) -> Optional[float]:
+        return await self.run(self.device.temperature)
@@ -1,10 +1,14 @@
-import asyncio
 import pathlib
+import sys
 from enum import Enum
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 
 import typer
-from aiohttp import ClientSession, UnixConnector
+
+from shrpi.const import DEFAULT_TELEMETRY_LOG_DIR
+
+if TYPE_CHECKING:
+    from shrpi.client import ShrpidClient
 
 """SH-RPi command line interface communicates with the shrpid daemon and
 allows the user to observe and control the device."""
@@ -38,101 +42,250 @@ def print_colored(*text: str, color: Ansi = Ansi.WHITE) -> None:
     print(color, *text, "\x1b[0m")
 
 
-async def get_json(session: ClientSession, url: str) -> Any:
-    """Get JSON data from the given URL."""
-    async with session.get(url) as resp:
-        return await resp.json()
-
+def connect() -> "ShrpidClient":
+    """Open a client for the daemon socket."""
+    # imported here to keep the start-up time of the other commands low
+    from shrpi.client import ShrpidClient
 
-async def post_json(session: ClientSession, url: str, data: Dict[Any, Any]) -> int:
-    """Post JSON data to the given URL."""
-    async with session.post(url, json=data) as resp:
-        return resp.status
+    return ShrpidClient(state["socket"])
 
 
-async def put_json(session: ClientSession, url: str, data: Any) -> int:
-    """Put JSON data to the given URL."""
-    async with session.put(url, json=data) as resp:
-        return resp.status
+def report_status(status: int, expected: int = 204) -> None:
+    if status != expected:
+        print_colored(f"Error: Received HTTP status {status}", color=Ansi.RED)
 
 
-async def async_print_all(socket_path: pathlib.Path) -> None:
-    """Print all data from the device."""
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        coro1 = get_json(session, "http://localhost:8080/version")
-        coro2 = get_json(session, "http://localhost:8080/state")
-        coro3 = get_json(session, "http://localhost:8080/config")
-        coro4 = get_json(session, "http://localhost:8080/values")
-        version, state, config, values = await asyncio.gather(
-            coro1, coro2, coro3, coro4
-        )
-
-        # Print all gathered data in a neat table
+def snapshot_table(snapshot: Dict[str, Any]) -> List[Tuple[str, str, str]]:
+    """Build (name, value, unit) rows from a /snapshot response."""
+    version = snapshot["version"]
+    state = snapshot["state"]
+    config = snapshot["config"]
+    values = snapshot["values"]
 
-        table = []
+    table = []
 
-        table.append(("Hardware version", str(version["hardware_version"]), ""))
-        table.append(("Firmware version", str(version["firmware_version"]), ""))
-        table.append(("Daemon version", str(version["daemon_version"]), ""))
+    table.append(("Hardware version", str(version["hardware_version"]), ""))
+    table.append(("Firmware version", str(version["firmware_version"]), ""))
+    table.append(("Daemon version", str(version["daemon_version"]), ""))
 
-        table.append(("State", str(state["state"]), ""))
-        table.append(("5V output", str(state["5v_output_enabled"]), ""))
-        table.append(("Watchdog enabled", str(state["watchdog_enabled"]), ""))
+    table.append(("State", str(state["state"]), ""))
+    table.append(("5V output", str(state["5v_output_enabled"]), ""))
+    table.append(("Watchdog enabled", str(state["watchdog_enabled"]), ""))
 
-        table.append(("Watchdog timeout", f"{config['watchdog_timeout']:.1f}", "s"))
-        table.append(("Power-on threshold", f"{config['power_on_threshold']:.1f}", "V"))
+    table.append(("Watchdog timeout", f"{config['watchdog_timeout']:.1f}", "s"))
+    table.append(("Power-on threshold", f"{config['power_on_threshold']:.1f}", "V"))
+    table.append(("Power-off threshold", f"{config['power_off_threshold']:.1f}", "V"))
+    if config["led_brightness"] is not None:
         table.append(
-            ("Power-off threshold", f"{config['power_off_threshold']:.1f}", "V")
+            ("LED brightness", f"{100 * config['led_brightness'] / 255:.1f}", "%")
         )
-        if config["led_brightness"] is not None:
-            table.append(
-                ("LED brightness", f"{100 * config['led_brightness'] / 255:.1f}", "%")
-            )
 
-        table.append(("Voltage in", f"{values['V_in']:.1f}", "V"))
-        if values["I_in"] is not None:
-            table.append(("Current in", f"{values['I_in']:.2f}", "A"))
-        table.append(("Supercap voltage", f"{values['V_supercap']:.2f}", "V"))
-        if values["T_mcu"] is not None:
-            table.append(("MCU temperature", f"{values['T_mcu'] - 273.15:.1f}", "°C"))
+    table.append(("Voltage in", f"{values['V_in']:.1f}", "V"))
+    if values["I_in"] is not None:
+        table.append(("Current in", f"{values['I_in']:.2f}", "A"))
+    table.append(("Supercap voltage", f"{values['V_supercap']:.2f}", "V"))
+    if values["T_mcu"] is not None:
+        table.append(("MCU temperature", f"{values['T_mcu'] - 273.15:.1f}", "°C"))
+
+    return table
+
 
-        keys, values, _ = zip(*table)
-        klen = len(max(keys, key=len))
-        vlen = len(max(values, key=len))
-        for key, val, unit in table:
-            print(f"{key:<{klen}}  {val:>{vlen}}  {unit}")
+def format_table(table: List[Tuple[str, str, str]]) -> str:
+    """Align the rows of a table.
+
+    Examples:
+        >>> print(format_table([("Voltage in", "12.0", "V"), ("State", "OK", "")]))
+        Voltage in  12.0  V
+        State         OK
+    """
+    keys, values, _ = zip(*table)
+    klen = len(max(keys, key=len))
+    vlen = len(max(values, key=len))
+    return "\n".join(
+        f"{key:<{klen}}  {val:>{vlen}}  {unit}".rstrip() for key, val, unit in table
+    )
 
 
 @app.command("print")
 def print_all() -> None:
     """Print all data from the device."""
-    asyncio.run(async_print_all(state["socket"]))
+    with connect() as client:
+        snapshot = client.get_json("/snapshot")
+    print(format_table(snapshot_table(snapshot)))
 
 
-async def async_shutdown(socket_path: pathlib.Path) -> None:
-    """Tell the device to wait for shutdown."""
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await post_json(session, "http://localhost:8080/shutdown", {})
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+class OutputFormat(str, Enum):
+    TABLE = "table"
+    CSV = "csv"
+    NDJSON = "ndjson"
 
 
-@app.command("shutdown")
-def shutdown() -> None:
-    """Tell the device to shutdown."""
-    asyncio.run(async_shutdown(state["socket"]))
+def flatten_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the sections of a /snapshot response into one flat record.
 
+    Examples:
+        >>> flatten_snapshot({
+        ...     "timestamp": 1.0,
+        ...     "version": {"daemon_version": "2.2.6"},
+        ...     "state": {"state": "OK"},
+        ...     "config": {"watchdog_timeout": 10.0},
+        ...     "values": {"V_in": 12.0},
+        ... })
+        {'timestamp': 1.0, 'V_in': 12.0, 'state': 'OK', 'watchdog_timeout': 10.0}
+    """
+    return {
+        "timestamp": snapshot["timestamp"],
+        **snapshot["values"],
+        **snapshot["state"],
+        **snapshot["config"],
+    }
+
+
+@app.command("watch")
+def watch(
+    interval: float = typer.Option(
+        1.0, "--interval", "-n", help="Seconds between updates"
+    ),
+    fields: str = typer.Option(
+        "",
+        "--fields",
+        help="Comma-separated fields to show, e.g. V_in,V_supercap,state",
+    ),
+    fmt: OutputFormat = typer.Option(OutputFormat.TABLE, "--format", "-f"),
+) -> None:
+    """Continuously print the device data over one connection."""
+    import datetime
+    import json
+    import time
+
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    header_printed = False
+    last_timestamp = None
+    redraw = fmt == OutputFormat.TABLE and sys.stdout.isatty()
+
+    with connect() as client:
+        next_update = time.monotonic()
+        try:
+            while True:
+                snapshot = client.get_json("/snapshot")
+                record = flatten_snapshot(snapshot)
+                if selected:
+                    unknown = [f for f in selected if f not in record]
+                    if unknown:
+                        print_colored(
+                            f"Error: Unknown fields: {', '.join(unknown)}",
+                            color=Ansi.RED,
+                        )
+                        raise typer.Exit(1)
+                    record = {key: record[key] for key in ["timestamp"] + selected}
+
+                if fmt == OutputFormat.TABLE:
+                    if selected:
+                        table = [(key, str(record[key]), "") for key in selected]
+                    else:
+                        table = snapshot_table(snapshot)
+                    dt = datetime.datetime.fromtimestamp(snapshot["timestamp"])
+                    # move the cursor home and clear the screen to redraw in place
+                    print(
+                        ("\x1b[H\x1b[J" if redraw else "")
+                        + f"{dt:%Y-%m-%d %H:%M:%S}\n"
+                        + format_table(table)
+                        + ("" if redraw else "\n"),
+                        flush=True,
+                    )
+                elif record["timestamp"] != last_timestamp:
+                    # only output new samples when piping
+                    if fmt == OutputFormat.NDJSON:
+                        print(json.dumps(record), flush=True)
+                    else:
+                        if not header_printed:
+                            print(",".join(record), flush=True)
+                            header_printed = True
+                        print(
+                            ",".join(
+                                "" if v is None else str(v) for v in record.values()
+                            ),
+                            flush=True,
+                        )
+
+                last_timestamp = record["timestamp"]
+                next_update += interval
+                delay = next_update - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind; don't try to catch up with a burst
+                    next_update = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+
+
+@app.command("history")
+def history(
+    log_dir: pathlib.Path = typer.Option(
+        pathlib.Path(DEFAULT_TELEMETRY_LOG_DIR),
+        "--dir",
+        "-d",
+        help="Telemetry log directory, if not the recommended one",
+    ),
+    since: float = typer.Option(
+        -3600.0,
+        help="Start time as a UNIX timestamp; negative values are relative to now",
+    ),
+    until: float = typer.Option(
+        0.0,
+        help="End time as a UNIX timestamp; values <= 0 are relative to now",
+    ),
+    fmt: OutputFormat = typer.Option(OutputFormat.TABLE, "--format", "-f"),
+) -> None:
+    """Print measurements from the persistent telemetry log."""
+    import datetime
+    import json
+    import time
+
+    from shrpi.telemetry_log import read_log
+
+    if not log_dir.is_dir():
+        print_colored(f"Error: Telemetry log {log_dir} not found", color=Ansi.RED)
+        raise typer.Exit(1)
+
+    now = time.time()
+    if since < 0:
+        since += now
+    if until <= 0:
+        until += now
+
+    keys = ("V_in", "V_supercap", "I_in", "T_mcu")
+    if fmt == OutputFormat.CSV:
+        print(",".join(("timestamp",) + keys))
+    elif fmt == OutputFormat.TABLE:
+        print(f"{'Time':<19}  " + "  ".join(f"{key:>10}" for key in keys))
+
+    for timestamp, *values in read_log(log_dir, since, until):
+        if fmt == OutputFormat.NDJSON:
+            print(json.dumps({"timestamp": timestamp, **dict(zip(keys, values))}))
+        elif fmt == OutputFormat.CSV:
+            print(
+                ",".join(
+                    [f"{timestamp:.3f}"]
+                    + ["" if v is None else f"{v:.4f}" for v in values]
+                )
+            )
+        else:
+            dt = datetime.datetime.fromtimestamp(timestamp)
+            print(
+                f"{dt:%Y-%m-%d %H:%M:%S}  "
+                + "  ".join(
+                    f"{'-':>10}" if v is None else f"{v:>10.3f}" for v in values
+                )
+            )
 
-async def async_sleep(socket_path: pathlib.Path, time: Dict[str, str]) -> None:
-    """Tell the device to sleep."""
 
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await post_json(session, "http://localhost:8080/sleep", time)
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+@app.command("shutdown")
+def shutdown() -> None:
+    """Tell the device to shutdown."""
+    with connect() as client:
+        report_status(client.send_json("POST", "/shutdown", {}))
 
 
 @app.command("sleep")
@@ -153,21 +306,16 @@ def sleep(
         # assume time is an absolute time
         time_dict = {"datetime": time}
 
-    asyncio.run(async_sleep(state["socket"], time_dict))
+    with connect() as client:
+        report_status(client.send_json("POST", "/sleep", time_dict))
 
 
 set_app = typer.Typer(help="Set configuration values.")
 
 
-async def async_set_watchdog(socket_path: pathlib.Path, timeout: float) -> None:
-    """Set watchdog timeout in seconds. Value 0 disables the watchdog."""
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await put_json(
-            session, "http://localhost:8080/config/watchdog_timeout", timeout
-        )
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+def set_config(key: str, value: float) -> None:
+    with connect() as client:
+        report_status(client.send_json("PUT", f"/config/{key}", value))
 
 
 @set_app.command("watchdog")
@@ -175,20 +323,7 @@ def set_watchdog(timeout: float) -> None:
     """
     Set watchdog timeout in seconds. Value 0 disables the watchdog.
     """
-    asyncio.run(async_set_watchdog(state["socket"], timeout))
-
-
-async def async_set_power_on_threshold(
-    socket_path: pathlib.Path, threshold: float
-) -> None:
-    """Set power-on threshold in volts."""
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await put_json(
-            session, "http://localhost:8080/config/power_on_threshold", threshold
-        )
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+    set_config("watchdog_timeout", timeout)
 
 
 @set_app.command("power-on-threshold")
@@ -196,20 +331,7 @@ def set_power_on_threshold(threshold: float) -> None:
     """
     Set power-on threshold in volts.
     """
-    asyncio.run(async_set_power_on_threshold(state["socket"], threshold))
-
-
-async def async_set_power_off_threshold(
-    socket_path: pathlib.Path, threshold: float
-) -> None:
-    """Set power-off threshold in volts."""
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await put_json(
-            session, "http://localhost:8080/config/power_off_threshold", threshold
-        )
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+    set_config("power_on_threshold", threshold)
 
 
 @set_app.command("power-off-threshold")
@@ -217,21 +339,7 @@ def set_power_off_threshold(threshold: float) -> None:
     """
     Set power-off threshold in volts.
     """
-    asyncio.run(async_set_power_off_threshold(state["socket"], threshold))
-
-
-async def async_set_led_brightness(
-    socket_path: pathlib.Path, brightness: float
-) -> None:
-    """Set LED brightness in percent."""
-    brightness_byte = int(brightness * 255 / 100)
-    connector = UnixConnector(path=str(socket_path))
-    async with ClientSession(connector=connector) as session:
-        response = await put_json(
-            session, "http://localhost:8080/config/led_brightness", brightness_byte
-        )
-        if response != 204:
-            print_colored(f"Error: Received HTTP status {response}", color=Ansi.RED)
+    set_config("power_off_threshold", threshold)
 
 
 @set_app.command("led")
@@ -239,7 +347,7 @@ def set_led_brightness(brightness: float) -> None:
     """
     Set LED brightness in percent.
     """
-    asyncio.run(async_set_led_brightness(state["socket"], brightness))
+    set_config("led_brightness", int(brightness * 255 / 100))
 
 
 @app.callback()
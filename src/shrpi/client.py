@@ -0,0 +1,92 @@
+"""Minimal synchronous HTTP client for the shrpid UNIX socket.
+
+The command line tool only sends a few small requests per invocation, so it
+talks to the daemon with the standard library instead of an asyncio client
+stack, which keeps the start-up time low on small boards.
+"""
+
+import http.client
+import json
+import pathlib
+import socket
+from typing import Any, Optional, Tuple
+
+# Default timeout for socket operations, in seconds
+DEFAULT_CLIENT_TIMEOUT = 10.0
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a UNIX domain socket."""
+
+    def __init__(self, socket_path: str, timeout: float = DEFAULT_CLIENT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class ClientError(Exception):
+    """The daemon answered with an unexpected HTTP status."""
+
+    def __init__(self, status: int, text: str):
+        super().__init__(f"HTTP status {status}: {text}" if text else f"{status}")
+        self.status = status
+        self.text = text
+
+
+class ShrpidClient:
+    """Client for the shrpid API.
+
+    The connection is kept open between requests, so repeated requests
+    (e.g. in watch mode) don't reconnect.
+    """
+
+    def __init__(
+        self, socket_path: pathlib.Path, timeout: float = DEFAULT_CLIENT_TIMEOUT
+    ):
+        self.connection = UnixHTTPConnection(str(socket_path), timeout=timeout)
+
+    def __enter__(self) -> "ShrpidClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def request(self, method: str, path: str, data: Any = None) -> Tuple[int, bytes]:
+        """Send a request and return the status and the response body."""
+        body: Optional[bytes] = None
+        headers = {}
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError):
+            # the daemon closed an idle keep-alive connection; retry once
+            self.connection.close()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def get_json(self, path: str) -> Any:
+        status, body = self.request("GET", path)
+        if status != 200:
+            raise ClientError(status, body.decode(errors="replace"))
+        return json.loads(body)
+
+    def send_json(self, method: str, path: str, data: Any) -> int:
+        """Send JSON data and return the response status."""
+        status, _ = self.request(method, path, data)
+        return status
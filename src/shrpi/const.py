@@ -13,6 +13,91 @@ DEFAULT_BLACKOUT_TIME_LIMIT = 3.0
 # This is the input voltage limit that counts as a blackout
 DEFAULT_BLACKOUT_VOLTAGE_LIMIT = 9.0
 
+# How often the measurements are polled from the device when the input
+# voltage is near the blackout limit or during a blackout, in seconds
+DEFAULT_SAMPLE_INTERVAL = 0.1
+
+# How often the measurements are polled while the input voltage is well above
+# the blackout limit, in seconds
+DEFAULT_SLOW_SAMPLE_INTERVAL = 1.0
+
+# Above blackout limit plus this margin (in volts), the slow interval is used
+DEFAULT_ADAPTIVE_MARGIN = 2.0
+
+# The input voltage is smoothed with this filter (median or ema) over this
+# many samples before it is compared with the blackout limits
+DEFAULT_BLACKOUT_FILTER = "median"
+DEFAULT_BLACKOUT_FILTER_WINDOW = 3
+
+# Power is only considered resumed when the filtered input voltage rises this
+# many volts above the blackout limit
+DEFAULT_BLACKOUT_HYSTERESIS = 0.5
+
+# The filtered input voltage must stay beyond the limits for this many
+# seconds before a blackout is detected or the power is considered resumed
+DEFAULT_BLACKOUT_ENTER_DWELL = 0.0
+DEFAULT_BLACKOUT_EXIT_DWELL = 1.0
+
+# Length of the in-memory measurement history, in seconds
+DEFAULT_HISTORY_LENGTH = 24 * 3600.0
+
+# Interval between samples stored in the history, in seconds
+DEFAULT_HISTORY_INTERVAL = 1.0
+
+# Recommended directory of the persistent telemetry log. The daemon only keeps
+# the log if telemetry-log-dir is set; `shrpi history` reads from here unless
+# told otherwise.
+DEFAULT_TELEMETRY_LOG_DIR = "/var/lib/shrpid/telemetry"
+
+# Interval between records in the telemetry log, in seconds
+DEFAULT_TELEMETRY_LOG_INTERVAL = 1.0
+
+# Interval between telemetry log writes to disk, in seconds
+DEFAULT_TELEMETRY_LOG_FLUSH_INTERVAL = 60.0
+
+# Watchdog timeout set on the device at startup, in seconds
+DEFAULT_WATCHDOG_TIMEOUT = 10.0
+
+# Interval between explicit watchdog feeds, in seconds
+DEFAULT_WATCHDOG_FEED_INTERVAL = 1.0
+
+# Warn if the watchdog is fed less than this many seconds before it would fire
+DEFAULT_WATCHDOG_WARN_SLACK = 5.0
+
+# The watchdog is only fed while the state machine has ticked within this many
+# seconds; it ticks at least every slow sample interval
+DEFAULT_WATCHDOG_HEARTBEAT_TIMEOUT = 5.0
+
+# Time limit for each pre-shutdown hook, in seconds
+DEFAULT_SHUTDOWN_HOOK_TIMEOUT = 5.0
+
+# Supercap runtime kept in reserve for powering off after the pre-shutdown
+# hooks, in seconds
+DEFAULT_SHUTDOWN_RESERVE = 5.0
+
+# Time constant of the supercap discharge fit, in seconds; older samples
+# carry exponentially less weight
+DEFAULT_DISCHARGE_TIME_CONSTANT = 2.0
+
+# Time to wait for the poweroff command to finish, in seconds
+DEFAULT_POWEROFF_TIMEOUT = 30.0
+
+# Default port of the optional TCP listener
+DEFAULT_TCP_PORT = 8589
+
+# Idle keep-alive connections on the TCP listener are closed after this many
+# seconds
+DEFAULT_TCP_KEEPALIVE_TIMEOUT = 15.0
+
+# Maximum number of concurrent connections on the TCP listener
+DEFAULT_TCP_MAX_CONNECTIONS = 32
+
+# Sustained requests per second allowed per TCP client
+DEFAULT_TCP_RATE_LIMIT = 5.0
+
+# Number of requests a TCP client may burst above the sustained rate
+DEFAULT_TCP_RATE_BURST = 20.0
+
 # Daemon version
 
 VERSION = "2.2.6"
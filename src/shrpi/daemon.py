@@ -5,48 +5,197 @@ import os
 import pathlib
 import signal
 import sys
-from typing import Any, Dict, List
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NoReturn,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
 
 import yaml
 from loguru import logger
+from smbus2 import SMBus
 
 from shrpi.const import (
     CONFIG_FILE_LOCATION,
+    DEFAULT_ADAPTIVE_MARGIN,
+    DEFAULT_BLACKOUT_ENTER_DWELL,
+    DEFAULT_BLACKOUT_EXIT_DWELL,
+    DEFAULT_BLACKOUT_FILTER,
+    DEFAULT_BLACKOUT_FILTER_WINDOW,
+    DEFAULT_BLACKOUT_HYSTERESIS,
     DEFAULT_BLACKOUT_TIME_LIMIT,
     DEFAULT_BLACKOUT_VOLTAGE_LIMIT,
+    DEFAULT_HISTORY_INTERVAL,
+    DEFAULT_HISTORY_LENGTH,
+    DEFAULT_POWEROFF_TIMEOUT,
+    DEFAULT_SAMPLE_INTERVAL,
+    DEFAULT_SHUTDOWN_HOOK_TIMEOUT,
+    DEFAULT_SHUTDOWN_RESERVE,
+    DEFAULT_SLOW_SAMPLE_INTERVAL,
+    DEFAULT_TCP_KEEPALIVE_TIMEOUT,
+    DEFAULT_TCP_MAX_CONNECTIONS,
+    DEFAULT_TCP_PORT,
+    DEFAULT_TCP_RATE_BURST,
+    DEFAULT_TCP_RATE_LIMIT,
+    DEFAULT_TELEMETRY_LOG_DIR,
+    DEFAULT_TELEMETRY_LOG_FLUSH_INTERVAL,
+    DEFAULT_TELEMETRY_LOG_INTERVAL,
+    DEFAULT_WATCHDOG_FEED_INTERVAL,
+    DEFAULT_WATCHDOG_HEARTBEAT_TIMEOUT,
+    DEFAULT_WATCHDOG_TIMEOUT,
+    DEFAULT_WATCHDOG_WARN_SLACK,
     I2C_ADDR,
     I2C_BUS,
     VERSION,
 )
-from shrpi.i2c import DeviceNotFoundError, SHRPiDevice
-from shrpi.state_machine import run_state_machine
+from shrpi.devices import ManagedDevice, open_devices, parse_devices
+from shrpi.history import TelemetryHistory, record_history, record_telemetry_log
+from shrpi.i2c import DEFAULT_REGISTER_CACHE_TTL, DeviceNotFoundError
+from shrpi.metrics import (
+    LOOP_LAG_BUCKETS,
+    Histogram,
+    StartupTimer,
+    monitor_loop_lag,
+)
+from shrpi.sampler import Sampler
+from shrpi.shutdown import ShutdownOrchestrator, add_command_hooks
+from shrpi.state_machine import (
+    BLACKOUT_POLICIES,
+    StateMachineSettings,
+    run_state_machine,
+)
+from shrpi.telemetry_log import TelemetryLog
+from shrpi.voltage_filter import FILTER_KINDS, VoltageFilter
+from shrpi.watchdog import WatchdogFeeder
+
+if TYPE_CHECKING:
+    from shrpi.server import TCPGuard
+
+
+# Settings that are applied without a restart when the daemon gets SIGHUP
+RELOADABLE_SETTINGS = frozenset(
+    {
+        "blackout_time_limit",
+        "blackout_voltage_limit",
+        "sample_interval",
+        "slow_sample_interval",
+        "adaptive_margin",
+        "shutdown_budget",
+        "blackout_filter",
+        "blackout_filter_window",
+        "blackout_hysteresis",
+        "blackout_enter_dwell",
+        "blackout_exit_dwell",
+        "blackout_policy",
+        "register_cache_ttl",
+        "watchdog_timeout",
+        "watchdog_feed_interval",
+        "watchdog_warn_slack",
+        "watchdog_heartbeat_timeout",
+        "n",
+        "poweroff",
+        "shutdown_hook_timeout",
+        "shutdown_reserve",
+        "poweroff_timeout",
+        "tcp_max_connections",
+        "tcp_rate_limit",
+        "tcp_rate_burst",
+    }
+)
+
+
+def load_config_files(parser: argparse.ArgumentParser, paths: List[str]) -> None:
+    """Read the config files into the parser defaults.
+
+    Raises OSError if a file can't be read and yaml.YAMLError if it can't be
+    parsed.
+    """
+
+    for path in paths:
+        with open(path) as f:
+            config: Dict[str, Any] = yaml.safe_load(f) or {}
+
+        # Replace dashes with underscores in config keys
+        config_: Dict[str, Any] = {}
+        for key, value in config.items():
+            config_[key.replace("-", "_")] = value
+        parser.set_defaults(**config_)
 
 
 def read_config_files(parser: argparse.ArgumentParser, paths: List[str]) -> None:
     """Read the config file."""
 
-    for path in paths:
-        try:
-            with open(path) as f:
-                config: Dict[str, Any] = yaml.safe_load(f)
-
-                # Replace dashes with underscores in config keys
-                config_: Dict[str, Any] = {}
-                for key, value in config.items():
-                    config_[key.replace("-", "_")] = value
-                parser.set_defaults(**config_)
-        except FileNotFoundError:
-            logger.error(f"Config file not found: {path}")
-            sys.exit(1)
-        except yaml.YAMLError as e:
-            logger.error(f"Error parsing config file: {e!s}")
-            sys.exit(1)
+    try:
+        load_config_files(parser, paths)
+    except FileNotFoundError as e:
+        logger.error(f"Config file not found: {e.filename}")
+        sys.exit(1)
+    except yaml.YAMLError as e:
+        logger.error(f"Error parsing config file: {e!s}")
+        sys.exit(1)
 
 
-def parse_arguments():
-    parser = argparse.ArgumentParser()
+def config_paths(args: argparse.Namespace) -> List[str]:
+    if args.conf is not None:
+        return list(args.conf)
+    if os.path.exists(CONFIG_FILE_LOCATION):
+        return [CONFIG_FILE_LOCATION]
+    return []
+
+
+def config_changes(
+    old: argparse.Namespace, new: argparse.Namespace
+) -> Dict[str, Tuple[Any, Any]]:
+    """Return the settings that differ, as (old, new) value pairs.
+
+    Examples:
+        >>> old = argparse.Namespace(blackout_time_limit=3.0, poweroff="poweroff")
+        >>> new = argparse.Namespace(blackout_time_limit=10.0, poweroff="poweroff")
+        >>> config_changes(old, new)
+        {'blackout_time_limit': (3.0, 10.0)}
+    """
+    old_values = vars(old)
+    return {
+        key: (old_values.get(key), value)
+        for key, value in vars(new).items()
+        if old_values.get(key) != value
+    }
+
+
+class ReloadArgumentParser(argparse.ArgumentParser):
+    """Argument parser that raises ValueError instead of exiting on errors."""
+
+    def error(self, message: str) -> NoReturn:
+        raise ValueError(message)
+
+
+def build_parser(
+    parser_class: Type[argparse.ArgumentParser] = argparse.ArgumentParser,
+) -> argparse.ArgumentParser:
+    parser = parser_class()
     parser.add_argument("--i2c-bus", type=int, default=I2C_BUS, help="I2C bus number")
     parser.add_argument("--i2c-addr", type=int, default=I2C_ADDR, help="I2C address")
+    parser.add_argument(
+        "--device",
+        dest="devices",
+        action="append",
+        default=None,
+        help=(
+            "Manage the SH-RPi at BUS:ADDR, optionally named ID=BUS:ADDR; can be "
+            "given several times. Overrides --i2c-bus and --i2c-addr. In the "
+            "configuration file, `devices` is a list of such strings or of "
+            "mappings with the keys id, bus and addr. See --blackout-policy for "
+            "when a blackout on one of several devices shuts the system down"
+        ),
+    )
     parser.add_argument(
         "--blackout-time-limit",
         type=float,
@@ -62,6 +211,143 @@ def parse_arguments():
             "voltage drops below this value"
         ),
     )
+    parser.add_argument(
+        "--blackout-filter",
+        choices=FILTER_KINDS,
+        default=DEFAULT_BLACKOUT_FILTER,
+        help="Filter that smooths the input voltage for the blackout detection",
+    )
+    parser.add_argument(
+        "--blackout-filter-window",
+        type=int,
+        default=DEFAULT_BLACKOUT_FILTER_WINDOW,
+        help="Number of samples the input voltage filter spans (1 disables it)",
+    )
+    parser.add_argument(
+        "--blackout-hysteresis",
+        type=float,
+        default=DEFAULT_BLACKOUT_HYSTERESIS,
+        help=(
+            "After a blackout, the power is considered resumed when the input "
+            "voltage rises this many volts above the blackout voltage limit"
+        ),
+    )
+    parser.add_argument(
+        "--blackout-enter-dwell",
+        type=float,
+        default=DEFAULT_BLACKOUT_ENTER_DWELL,
+        help=(
+            "Seconds the input voltage must stay below the blackout voltage "
+            "limit before a blackout is detected"
+        ),
+    )
+    parser.add_argument(
+        "--blackout-exit-dwell",
+        type=float,
+        default=DEFAULT_BLACKOUT_EXIT_DWELL,
+        help=(
+            "Seconds the input voltage must stay above the resume limit before "
+            "the power is considered resumed"
+        ),
+    )
+    parser.add_argument(
+        "--blackout-policy",
+        choices=BLACKOUT_POLICIES,
+        default=None,
+        help=(
+            "With several devices, shut down after a blackout on any of them, or "
+            "only when all of them are blacked out (redundant supplies). Defaults "
+            "to any with one device and all with several"
+        ),
+    )
+    parser.add_argument(
+        "--shutdown-budget",
+        type=float,
+        default=None,
+        help=(
+            "Shut down when the projected supercap runtime during a blackout "
+            "drops below this many seconds, instead of after the blackout "
+            "time limit"
+        ),
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=DEFAULT_SAMPLE_INTERVAL,
+        help=(
+            "Interval in seconds between measurement reads from the device "
+            "when the input voltage is near the blackout limit"
+        ),
+    )
+    parser.add_argument(
+        "--slow-sample-interval",
+        type=float,
+        default=DEFAULT_SLOW_SAMPLE_INTERVAL,
+        help=(
+            "Interval in seconds between measurement reads from the device "
+            "when the input voltage is well above the blackout limit"
+        ),
+    )
+    parser.add_argument(
+        "--adaptive-margin",
+        type=float,
+        default=DEFAULT_ADAPTIVE_MARGIN,
+        help=(
+            "The slow sample interval is used when the input voltage is "
+            "more than this many volts above the blackout limit"
+        ),
+    )
+    parser.add_argument(
+        "--blackout-gpio",
+        type=int,
+        default=None,
+        help="GPIO line that changes state on power loss, for faster detection",
+    )
+    parser.add_argument(
+        "--gpio-chip",
+        type=str,
+        default="/dev/gpiochip0",
+        help="GPIO chip of the blackout GPIO line",
+    )
+    parser.add_argument(
+        "--history-length",
+        type=float,
+        default=DEFAULT_HISTORY_LENGTH,
+        help="Length of the in-memory measurement history in seconds (0 disables)",
+    )
+    parser.add_argument(
+        "--history-interval",
+        type=float,
+        default=DEFAULT_HISTORY_INTERVAL,
+        help="Interval in seconds between samples stored in the history",
+    )
+    parser.add_argument(
+        "--telemetry-log-dir",
+        type=pathlib.Path,
+        default=None,
+        help=(
+            "Directory of the persistent telemetry log, e.g. "
+            f"{DEFAULT_TELEMETRY_LOG_DIR}. The log is disabled if not set."
+        ),
+    )
+    parser.add_argument(
+        "--telemetry-log-interval",
+        type=float,
+        default=DEFAULT_TELEMETRY_LOG_INTERVAL,
+        help="Interval in seconds between telemetry log records",
+    )
+    parser.add_argument(
+        "--telemetry-log-flush-interval",
+        type=float,
+        default=DEFAULT_TELEMETRY_LOG_FLUSH_INTERVAL,
+        help="Interval in seconds between telemetry log writes to disk",
+    )
+    parser.add_argument(
+        "--register-cache-ttl",
+        type=float,
+        default=DEFAULT_REGISTER_CACHE_TTL,
+        help="Time in seconds to cache the device state registers",
+    )
     parser.add_argument(
         "--socket",
         "-s",
@@ -76,6 +362,54 @@ def parse_arguments():
         default="adm",
         help="Group to set on the UNIX socket",
     )
+    parser.add_argument(
+        "--tcp-host",
+        type=str,
+        default=None,
+        help="Also serve the read-only API on this TCP address (disabled if not set)",
+    )
+    parser.add_argument(
+        "--tcp-port",
+        type=int,
+        default=DEFAULT_TCP_PORT,
+        help="TCP port of the read-only API",
+    )
+    parser.add_argument(
+        "--tls-cert",
+        type=str,
+        default=None,
+        help="Certificate file for serving the TCP API over TLS",
+    )
+    parser.add_argument(
+        "--tls-key",
+        type=str,
+        default=None,
+        help="Private key file of the TLS certificate",
+    )
+    parser.add_argument(
+        "--tcp-keepalive-timeout",
+        type=float,
+        default=DEFAULT_TCP_KEEPALIVE_TIMEOUT,
+        help="Seconds before idle keep-alive TCP connections are closed",
+    )
+    parser.add_argument(
+        "--tcp-max-connections",
+        type=int,
+        default=DEFAULT_TCP_MAX_CONNECTIONS,
+        help="Maximum number of concurrent TCP connections (0 for no limit)",
+    )
+    parser.add_argument(
+        "--tcp-rate-limit",
+        type=float,
+        default=DEFAULT_TCP_RATE_LIMIT,
+        help="Requests per second allowed per TCP client (0 for no limit)",
+    )
+    parser.add_argument(
+        "--tcp-rate-burst",
+        type=float,
+        default=DEFAULT_TCP_RATE_BURST,
+        help="Number of requests a TCP client may burst above the rate limit",
+    )
     parser.add_argument(
         "-n", default=False, action="store_true", help="Dry run (no shutdown)"
     )
@@ -85,49 +419,279 @@ def parse_arguments():
         default="/sbin/poweroff",
         help="Command to call to power off the system",
     )
+    parser.add_argument(
+        "--watchdog-timeout",
+        type=float,
+        default=DEFAULT_WATCHDOG_TIMEOUT,
+        help="Watchdog timeout in seconds set on the device (0 disables)",
+    )
+    parser.add_argument(
+        "--watchdog-feed-interval",
+        type=float,
+        default=DEFAULT_WATCHDOG_FEED_INTERVAL,
+        help="Interval in seconds between explicit watchdog feeds",
+    )
+    parser.add_argument(
+        "--watchdog-warn-slack",
+        type=float,
+        default=DEFAULT_WATCHDOG_WARN_SLACK,
+        help=(
+            "Warn if the watchdog is fed less than this many seconds before "
+            "it would fire"
+        ),
+    )
+    parser.add_argument(
+        "--watchdog-heartbeat-timeout",
+        type=float,
+        default=DEFAULT_WATCHDOG_HEARTBEAT_TIMEOUT,
+        help=(
+            "Stop feeding the watchdog if the state machine hasn't run for "
+            "this many seconds; must be longer than --slow-sample-interval"
+        ),
+    )
+    parser.add_argument(
+        "--shutdown-hook-timeout",
+        type=float,
+        default=DEFAULT_SHUTDOWN_HOOK_TIMEOUT,
+        help="Time limit in seconds for each pre-shutdown task",
+    )
+    parser.add_argument(
+        "--shutdown-hook",
+        dest="shutdown_hooks",
+        action="append",
+        default=None,
+        help=(
+            "Command to run before powering off; can be given several times. "
+            "In the configuration file, `shutdown-hooks` is a list of commands "
+            "or of mappings with the keys command, name, timeout and after"
+        ),
+    )
+    parser.add_argument(
+        "--shutdown-reserve",
+        type=float,
+        default=DEFAULT_SHUTDOWN_RESERVE,
+        help=(
+            "Pre-shutdown tasks are aborted when the projected supercap "
+            "runtime drops below this many seconds"
+        ),
+    )
+    parser.add_argument(
+        "--poweroff-timeout",
+        type=float,
+        default=DEFAULT_POWEROFF_TIMEOUT,
+        help="Time in seconds to wait for the poweroff command to finish",
+    )
+    parser.add_argument(
+        "--simulate",
+        type=int,
+        choices=[1, 2],
+        default=None,
+        help="Use a simulated SH-RPi of the given version instead of the hardware",
+    )
     parser.add_argument("--conf", action="append", help="Configuration file location")
+    return parser
+
+
+def check_arguments(args: argparse.Namespace) -> None:
+    """Check the settings that argparse can't validate when they come from a
+    config file. Raises ValueError."""
+    VoltageFilter(args.blackout_filter, args.blackout_filter_window)
+    if args.blackout_policy not in (None, *BLACKOUT_POLICIES):
+        raise ValueError(
+            f"Unknown blackout policy '{args.blackout_policy}', "
+            f"expected one of {', '.join(BLACKOUT_POLICIES)}"
+        )
+    # the state machine runs once per sample, so a slower sampling would stop
+    # the watchdog feeds while the power is good
+    if args.slow_sample_interval >= args.watchdog_heartbeat_timeout:
+        raise ValueError(
+            f"slow-sample-interval ({args.slow_sample_interval} s) must be "
+            "shorter than watchdog-heartbeat-timeout "
+            f"({args.watchdog_heartbeat_timeout} s)"
+        )
+
+
+def blackout_policy(args: argparse.Namespace, n_devices: int) -> str:
+    """Return the blackout policy, defaulting on the number of devices.
+
+    Examples:
+        >>> args = argparse.Namespace(blackout_policy=None)
+        >>> blackout_policy(args, 1), blackout_policy(args, 2)
+        ('any', 'all')
+    """
+    policy: Optional[str] = args.blackout_policy
+    if policy is not None:
+        return policy
+    return "any" if n_devices == 1 else "all"
+
 
+def parse_arguments():
+    parser = build_parser()
     args = parser.parse_args()
 
-    if args.conf is not None:
-        read_config_files(parser, args.conf)
-    elif os.path.exists(CONFIG_FILE_LOCATION):
-        read_config_files(parser, [CONFIG_FILE_LOCATION])
+    read_config_files(parser, config_paths(args))
 
     # Reload arguments to override config file values with command line values
     args = parser.parse_args()
+    try:
+        check_arguments(args)
+    except ValueError as e:
+        parser.error(str(e))
 
     logger.debug("args: {}", args)
 
     return args
 
 
+def reparse_arguments() -> argparse.Namespace:
+    """Parse the command line and the config files again for a reload.
+
+    Raises OSError or yaml.YAMLError if the config files can't be read, and
+    ValueError if the resulting settings are invalid.
+    """
+    parser = build_parser(ReloadArgumentParser)
+    args = parser.parse_args()
+    load_config_files(parser, config_paths(args))
+    args = parser.parse_args()
+    check_arguments(args)
+    return args
+
+
+async def reload_config(
+    args: argparse.Namespace,
+    settings: StateMachineSettings,
+    devices: Sequence[ManagedDevice],
+    shutdown: ShutdownOrchestrator,
+    tcp_guard: Optional["TCPGuard"] = None,
+) -> argparse.Namespace:
+    """Read the configuration again and apply the reloadable settings.
+
+    Changes to other settings are logged and ignored. Returns the settings
+    now in effect.
+    """
+    try:
+        new_args = reparse_arguments()
+    except (OSError, yaml.YAMLError) as e:
+        logger.error(f"Not reloading, can't read the configuration: {e!s}")
+        return args
+    except ValueError as e:
+        logger.error(f"Not reloading, the configuration is invalid: {e!s}")
+        return args
+
+    changes = config_changes(args, new_args)
+    if not changes:
+        logger.info("Configuration reloaded, nothing changed")
+        return args
+    for key in sorted(set(changes) - RELOADABLE_SETTINGS):
+        logger.warning(f"Changing {key} requires a restart, ignoring")
+        setattr(new_args, key, getattr(args, key))
+    for key in sorted(set(changes) & RELOADABLE_SETTINGS):
+        old, new = changes[key]
+        logger.info(f"Changing {key} from {old!r} to {new!r}")
+
+    settings.blackout_time_limit = new_args.blackout_time_limit
+    settings.blackout_voltage_limit = new_args.blackout_voltage_limit
+    settings.fast_interval = new_args.sample_interval
+    settings.slow_interval = new_args.slow_sample_interval
+    settings.adaptive_margin = new_args.adaptive_margin
+    settings.shutdown_budget = new_args.shutdown_budget
+    settings.filter_kind = new_args.blackout_filter
+    settings.filter_window = new_args.blackout_filter_window
+    settings.hysteresis = new_args.blackout_hysteresis
+    settings.enter_dwell = new_args.blackout_enter_dwell
+    settings.exit_dwell = new_args.blackout_exit_dwell
+    settings.blackout_policy = blackout_policy(new_args, len(devices))
+    for managed in devices:
+        managed.device.cache.ttl = new_args.register_cache_ttl
+        managed.watchdog.interval = new_args.watchdog_feed_interval
+        managed.watchdog.warn_slack = new_args.watchdog_warn_slack
+        managed.watchdog.heartbeat_timeout = new_args.watchdog_heartbeat_timeout
+        if "watchdog_timeout" in changes:
+            await managed.async_device.set_watchdog_timeout(new_args.watchdog_timeout)
+    shutdown.dry_run = new_args.n
+    shutdown.poweroff = new_args.poweroff
+    shutdown.hook_timeout = new_args.shutdown_hook_timeout
+    shutdown.reserve = new_args.shutdown_reserve
+    shutdown.poweroff_timeout = new_args.poweroff_timeout
+    if tcp_guard is not None:
+        tcp_guard.configure(
+            new_args.tcp_max_connections,
+            new_args.tcp_rate_limit,
+            new_args.tcp_rate_burst,
+        )
+    return new_args
+
+
 async def wait_forever():
     while True:
         await asyncio.sleep(1)
 
 
-async def async_main():
+async def async_main(import_time: float = 0.0) -> None:
+    timer = StartupTimer()
+    timer.add("import", import_time)
+
     args = parse_arguments()
+    timer.lap("config parse")
 
-    i2c_bus = args.i2c_bus
-    i2c_addr = args.i2c_addr
+    try:
+        device_configs = parse_devices(
+            args.devices or [f"{args.i2c_bus}:{args.i2c_addr}"]
+        )
+    except ValueError as e:
+        logger.error(f"Error in device configuration: {e!s}")
+        sys.exit(1)
+
+    bus_factory: Callable[[int], SMBus] = SMBus
+    if args.simulate is not None:
+        from shrpi.simulator import SimulatedBus, SimulatedSHRPi
+
+        logger.warning(f"Using simulated SH-RPi v{args.simulate} devices")
+        simulated_buses = {
+            bus: SimulatedBus(
+                [
+                    SimulatedSHRPi(version=args.simulate, addr=config.addr)
+                    for config in device_configs
+                    if config.bus == bus
+                ]
+            )
+            for bus in {config.bus for config in device_configs}
+        }
+
+        def bus_factory(bus: int) -> SMBus:
+            return simulated_buses[bus].bus_factory(bus)
 
     try:
-        shrpi_device = SHRPiDevice.factory(i2c_bus, i2c_addr)
+        async_devices = open_devices(device_configs, bus_factory)
     except DeviceNotFoundError as e:
         logger.error(f"Error: {e}")
         sys.exit(1)
-
-    hw_version = shrpi_device.hardware_version()
-    fw_version = shrpi_device.firmware_version()
-    logger.info(
-        f"SH-RPi device detected; HW version {hw_version}, FW version {fw_version}"
+    timer.lap("probe")
+
+    for config, async_device in zip(device_configs, async_devices):
+        async_device.device.cache.ttl = args.register_cache_ttl
+        hw_version = async_device.device.hardware_version()
+        fw_version = async_device.device.firmware_version()
+        logger.info(
+            f"SH-RPi device {config.id} detected on bus {config.bus} at "
+            f"{config.addr:#04x}; HW version {hw_version}, FW version {fw_version}"
+        )
+
+    settings = StateMachineSettings(
+        args.blackout_time_limit,
+        args.blackout_voltage_limit,
+        fast_interval=args.sample_interval,
+        slow_interval=args.slow_sample_interval,
+        adaptive_margin=args.adaptive_margin,
+        shutdown_budget=args.shutdown_budget,
+        filter_kind=args.blackout_filter,
+        filter_window=args.blackout_filter_window,
+        hysteresis=args.blackout_hysteresis,
+        enter_dwell=args.blackout_enter_dwell,
+        exit_dwell=args.blackout_exit_dwell,
+        blackout_policy=blackout_policy(args, len(device_configs)),
     )
 
-    blackout_time_limit = args.blackout_time_limit
-    blackout_voltage_limit = args.blackout_voltage_limit
-
     socket_path: pathlib.PosixPath
     if args.socket is None:
         # if we're root user, we should be able to write to /var/run/shrpid.sock
@@ -166,9 +730,34 @@ async def async_main():
         # if no group is specified, use the current user's primary group
         socket_group = pathlib.PosixPath.home().stat().st_gid
 
+    telemetry_log = None
+    if args.telemetry_log_dir is not None:
+        telemetry_log = TelemetryLog(pathlib.Path(args.telemetry_log_dir))
+
+    # created before the signal handlers below, which use them
+    devices = [
+        ManagedDevice(
+            config,
+            async_device,
+            Sampler(async_device, interval=args.sample_interval),
+            WatchdogFeeder(
+                async_device.device,
+                interval=args.watchdog_feed_interval,
+                warn_slack=args.watchdog_warn_slack,
+                heartbeat_timeout=args.watchdog_heartbeat_timeout,
+            ),
+        )
+        for config, async_device in zip(device_configs, async_devices)
+    ]
+
     def cleanup(signum, frame):
+        if telemetry_log is not None:
+            telemetry_log.flush()
+        for managed in devices:
+            managed.watchdog.stop()
         logger.info("Disabling SH-RPi watchdog")
-        shrpi_device.set_watchdog_timeout(0)
+        for managed in devices:
+            managed.device.set_watchdog_timeout(0)
         # delete the socket file
         if socket_path.exists():
             socket_path.unlink()
@@ -180,27 +769,157 @@ async def async_main():
 
     logger.info(f"Starting shrpid version {VERSION} on {socket_path}")
 
-    # run these with asyncio:
-
-    coro1 = run_state_machine(
-        shrpi_device,
-        blackout_time_limit,
-        blackout_voltage_limit,
-        poweroff=args.poweroff,
+    # the top level API, history, telemetry log and the energy budget of the
+    # shutdown hooks use the first device
+    primary = devices[0]
+    async_device = primary.async_device
+    sampler = primary.sampler
+    status = primary.status
+    loop_lag = Histogram(LOOP_LAG_BUCKETS)
+    shutdown = ShutdownOrchestrator(
+        async_device,
+        args.poweroff,
         dry_run=args.n,
+        hook_timeout=args.shutdown_hook_timeout,
+        poweroff_timeout=args.poweroff_timeout,
+        estimator=primary.estimator,
+        reserve=args.shutdown_reserve,
+        other_devices=[managed.async_device for managed in devices[1:]],
     )
+    if telemetry_log is not None:
+
+        async def flush_telemetry_log() -> None:
+            assert telemetry_log is not None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, telemetry_log.flush)
+
+        shutdown.add_hook("flush telemetry log", flush_telemetry_log)
+
+    try:
+        add_command_hooks(shutdown, args.shutdown_hooks or [])
+    except ValueError as e:
+        logger.error(f"Error in shutdown hooks: {e!s}")
+        sys.exit(1)
+
+    for managed in devices:
+        managed.watchdog.start()
+
+    history = None
+    if args.history_length > 0:
+        history = TelemetryHistory(
+            max(1, int(args.history_length / args.history_interval))
+        )
+
     from shrpi.server import run_http_server
 
-    coro2 = run_http_server(
-        shrpi_device, socket_path, socket_group, poweroff=args.poweroff
+    timer.lap("server import")
+
+    await run_http_server(
+        async_device,
+        sampler,
+        socket_path,
+        socket_group,
+        poweroff=args.poweroff,
+        history=history,
+        status=status,
+        loop_lag=loop_lag,
+        shutdown=shutdown,
+        watchdog=primary.watchdog,
+        estimator=primary.estimator,
+        devices=devices,
+    )
+    timer.lap("socket bind")
+
+    tcp_guard: Optional["TCPGuard"] = None
+    if args.tcp_host is not None:
+        from shrpi.server import TCPGuard, run_tcp_server
+
+        ssl_context = None
+        if args.tls_cert is not None:
+            import ssl
+
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(args.tls_cert, args.tls_key)
+
+        tcp_guard = TCPGuard(
+            args.tcp_max_connections, args.tcp_rate_limit, args.tcp_rate_burst
+        )
+        await run_tcp_server(
+            async_device,
+            sampler,
+            args.tcp_host,
+            args.tcp_port,
+            ssl_context=ssl_context,
+            keepalive_timeout=args.tcp_keepalive_timeout,
+            max_connections=args.tcp_max_connections,
+            rate_limit=args.tcp_rate_limit,
+            rate_burst=args.tcp_rate_burst,
+            history=history,
+            status=status,
+            loop_lag=loop_lag,
+            shutdown=shutdown,
+            watchdog=primary.watchdog,
+            estimator=primary.estimator,
+            devices=devices,
+            guard=tcp_guard,
+        )
+        timer.lap("TCP bind")
+    logger.info(f"Startup timings: {timer.summary()}")
+
+    async def on_sighup() -> None:
+        nonlocal args
+        args = await reload_config(args, settings, devices, shutdown, tcp_guard)
+
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, lambda: asyncio.ensure_future(on_sighup())
     )
-    coro3 = wait_forever()
 
-    await asyncio.gather(coro1, coro2, coro3)
+    # run these with asyncio:
+
+    coros: List[Awaitable[Any]] = [
+        run_state_machine(
+            managed.async_device,
+            managed.sampler,
+            settings.blackout_time_limit,
+            settings.blackout_voltage_limit,
+            status=managed.status,
+            shutdown=shutdown,
+            watchdog_timeout=args.watchdog_timeout,
+            name=managed.id if len(devices) > 1 else "",
+            settings=settings,
+            estimator=managed.estimator,
+            heartbeat=managed.watchdog.heartbeat,
+            others=[other.status for other in devices if other is not managed],
+        )
+        for managed in devices
+    ]
+    if args.blackout_gpio is not None:
+        from shrpi.gpio import watch_gpio_line
+
+        watch_gpio_line(args.gpio_chip, args.blackout_gpio, sampler)
+
+    coros += [managed.sampler.run() for managed in devices]
+    coros += [
+        wait_forever(),
+        monitor_loop_lag(loop_lag),
+    ]
+    if history is not None:
+        coros.append(record_history(sampler, history, args.history_interval))
+    if telemetry_log is not None:
+        coros.append(
+            record_telemetry_log(
+                sampler,
+                telemetry_log,
+                args.telemetry_log_interval,
+                args.telemetry_log_flush_interval,
+            )
+        )
+
+    await asyncio.gather(*coros)
 
 
-def main():
-    asyncio.run(async_main())
+def main(import_time: float = 0.0) -> None:
+    asyncio.run(async_main(import_time))
 
 
 if __name__ == "__main__":
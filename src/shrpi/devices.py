@@ -0,0 +1,121 @@
+"""Several SH-RPi devices managed by one daemon."""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence
+
+from smbus2 import SMBus
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.energy import SupercapEstimator
+from shrpi.i2c import I2CBus, SHRPiDevice
+from shrpi.sampler import Sampler
+from shrpi.state_machine import StateMachineStatus
+from shrpi.watchdog import WatchdogFeeder
+
+
+class DeviceConfig(NamedTuple):
+    """Identifier and location of a device on the I2C buses."""
+
+    id: str
+    bus: int
+    addr: int
+
+
+def parse_device(entry: Any, index: int) -> DeviceConfig:
+    """Parse a device entry of the configuration.
+
+    An entry is either a `bus:addr` string, optionally prefixed with `id=`,
+    or a mapping with the keys `bus`, `addr` and optionally `id`. Devices
+    without an id are identified by their position in the list.
+
+    Examples:
+        >>> parse_device("1:0x6d", 0)
+        DeviceConfig(id='0', bus=1, addr=109)
+        >>> parse_device("aux=1:0x6e", 1)
+        DeviceConfig(id='aux', bus=1, addr=110)
+        >>> parse_device({"id": "main", "bus": 1, "addr": 0x6D}, 0)
+        DeviceConfig(id='main', bus=1, addr=109)
+    """
+    if isinstance(entry, str):
+        device_id, _, location = entry.rpartition("=")
+        bus, sep, addr = location.partition(":")
+        if not sep:
+            raise ValueError(f"Invalid device {entry!r}, expected bus:addr")
+        entry = {"bus": bus, "addr": addr}
+        if device_id:
+            entry["id"] = device_id
+    if not isinstance(entry, dict) or "bus" not in entry or "addr" not in entry:
+        raise ValueError(f"Invalid device: {entry!r}")
+
+    def to_int(value: Any) -> int:
+        return value if isinstance(value, int) else int(str(value), 0)
+
+    device_id = str(entry.get("id", index))
+    if not device_id or "/" in device_id:
+        raise ValueError(f"Invalid device id: {device_id!r}")
+    return DeviceConfig(device_id, to_int(entry["bus"]), to_int(entry["addr"]))
+
+
+def parse_devices(entries: Sequence[Any]) -> List[DeviceConfig]:
+    """Parse the device list and check that ids and addresses are unique."""
+    configs = [parse_device(entry, i) for i, entry in enumerate(entries)]
+    ids = [config.id for config in configs]
+    locations = [(config.bus, config.addr) for config in configs]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Duplicate device ids: {', '.join(ids)}")
+    if len(set(locations)) != len(locations):
+        raise ValueError("Several devices at the same bus and address")
+    return configs
+
+
+def open_devices(
+    configs: Sequence[DeviceConfig],
+    bus_factory: Callable[[int], SMBus] = SMBus,
+) -> List[AsyncSHRPiDevice]:
+    """Detect the devices and wrap them for use from the event loop.
+
+    Devices on the same bus share one bus handle and one worker thread, so
+    their transactions are serialized and served in the order they were
+    requested. Raises DeviceNotFoundError if a device doesn't respond.
+    """
+    buses: Dict[int, I2CBus] = {}
+    executors: Dict[int, ThreadPoolExecutor] = {}
+    devices = []
+    for config in configs:
+        if config.bus not in buses:
+            buses[config.bus] = I2CBus(config.bus, bus_factory)
+            executors[config.bus] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"shrpi-i2c-{config.bus}"
+            )
+        device = SHRPiDevice.factory(
+            config.bus, config.addr, bus_factory=bus_factory, i2c=buses[config.bus]
+        )
+        devices.append(AsyncSHRPiDevice(device, executors[config.bus]))
+    return devices
+
+
+class ManagedDevice:
+    """A device with its own sampler, state machine status, watchdog feeder and
+    supercap estimator."""
+
+    def __init__(
+        self,
+        config: DeviceConfig,
+        async_device: AsyncSHRPiDevice,
+        sampler: Sampler,
+        watchdog: WatchdogFeeder,
+    ):
+        self.config = config
+        self.async_device = async_device
+        self.sampler = sampler
+        self.watchdog = watchdog
+        self.status = StateMachineStatus()
+        self.estimator = SupercapEstimator()
+
+    @property
+    def id(self) -> str:
+        return self.config.id
+
+    @property
+    def device(self) -> SHRPiDevice:
+        return self.async_device.device
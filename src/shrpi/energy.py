@@ -0,0 +1,121 @@
+"""Online estimate of the energy left in the supercap during a blackout."""
+
+import math
+from typing import Optional
+
+from shrpi.const import DEFAULT_DISCHARGE_TIME_CONSTANT
+from shrpi.i2c import Measurements
+
+# Time constant of the load power average taken while the input power is
+# good, in seconds
+LOAD_POWER_TIME_CONSTANT = 10.0
+
+
+class SupercapEstimator:
+    """Fit the supercap discharge curve and project the time to brownout.
+
+    With a roughly constant power load, the energy in the supercap, and so
+    the square of its voltage, falls linearly. During a blackout, the
+    estimator fits V² against time with exponentially weighted least
+    squares, which takes constant work per sample and follows changes in
+    the load within a few `time_constant`s. The load power is averaged from
+    the input voltage and current (v2 devices) while the power is good; the
+    remaining energy is that power times the projected runtime.
+
+    Examples:
+        >>> estimator = SupercapEstimator()
+        >>> for t in range(5):  # a 1 F supercap feeding a 1 W load
+        ...     estimator.observe_discharge(float(t), math.sqrt(64.0 - 2.0 * t))
+        >>> round(estimator.discharge_rate(), 6)
+        -2.0
+        >>> round(estimator.time_remaining(5.5), 3)
+        12.875
+    """
+
+    def __init__(self, time_constant: float = DEFAULT_DISCHARGE_TIME_CONSTANT):
+        self.time_constant = time_constant
+        self.voltage: Optional[float] = None
+        self.load_power: Optional[float] = None
+        self._load_updated: Optional[float] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the discharge fit, e.g. when the power comes back."""
+        self._t0: Optional[float] = None
+        self._last_t = 0.0
+        self._samples = 0
+        # exponentially weighted sums of 1, t, y, t² and t*y, where y = V²
+        self._w = self._st = self._sy = self._stt = self._sty = 0.0
+
+    def observe(
+        self, timestamp: float, measurements: Measurements, blackout: bool
+    ) -> None:
+        """Update the estimate with a sample."""
+        self.voltage = measurements.supercap_voltage
+        if blackout:
+            self.observe_discharge(timestamp, measurements.supercap_voltage)
+            return
+        self.reset()
+        if measurements.input_current is not None:
+            self.observe_load(
+                timestamp, measurements.dcin_voltage * measurements.input_current
+            )
+
+    def observe_load(self, timestamp: float, power: float) -> None:
+        if self.load_power is None or self._load_updated is None:
+            self.load_power = power
+        else:
+            dt = max(0.0, timestamp - self._load_updated)
+            alpha = 1.0 - math.exp(-dt / LOAD_POWER_TIME_CONSTANT)
+            self.load_power += alpha * (power - self.load_power)
+        self._load_updated = timestamp
+
+    def observe_discharge(self, timestamp: float, voltage: float) -> None:
+        if self._t0 is None:
+            self._t0 = timestamp
+        # time relative to the start of the discharge keeps the sums precise
+        t = timestamp - self._t0
+        decay = math.exp(-max(0.0, t - self._last_t) / self.time_constant)
+        y = voltage * voltage
+        self._w = self._w * decay + 1.0
+        self._st = self._st * decay + t
+        self._sy = self._sy * decay + y
+        self._stt = self._stt * decay + t * t
+        self._sty = self._sty * decay + t * y
+        self._last_t = t
+        self._samples += 1
+
+    def discharge_rate(self) -> Optional[float]:
+        """Rate of change of V² in V²/s, or None before there are two samples."""
+        if self._samples < 2:
+            return None
+        denominator = self._w * self._stt - self._st * self._st
+        if denominator <= 1e-12 * self._w * self._w:
+            return None
+        return (self._w * self._sty - self._st * self._sy) / denominator
+
+    def time_remaining(self, cutoff: float) -> Optional[float]:
+        """Projected seconds until the supercap voltage drops to `cutoff`.
+
+        None if the supercap isn't discharging.
+        """
+        rate = self.discharge_rate()
+        if rate is None or rate >= 0:
+            return None
+        # the fitted V² at the latest sample
+        y = self._sy / self._w + rate * (self._last_t - self._st / self._w)
+        return max(0.0, (y - cutoff * cutoff) / -rate)
+
+    def energy_remaining(self, cutoff: float) -> Optional[float]:
+        """Projected usable energy in joules, if the load power is known."""
+        remaining = self.time_remaining(cutoff)
+        if remaining is None or self.load_power is None:
+            return None
+        return self.load_power * remaining
+
+    def capacitance(self) -> Optional[float]:
+        """Supercap capacitance in farads implied by the fit and the load."""
+        rate = self.discharge_rate()
+        if rate is None or rate >= 0 or self.load_power is None:
+            return None
+        return -2.0 * self.load_power / rate
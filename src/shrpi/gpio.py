@@ -0,0 +1,43 @@
+"""Optional GPIO edge notifications for faster blackout detection."""
+
+import asyncio
+import threading
+
+from loguru import logger
+
+from shrpi.sampler import Sampler
+
+
+def watch_gpio_line(chip: str, line: int, sampler: Sampler) -> None:
+    """Trigger an immediate sample on every edge of a GPIO line.
+
+    The edges are waited for in a daemon thread. This requires the libgpiod
+    v2 Python bindings (the `gpiod` package); if they are missing, a warning
+    is logged and the sampler keeps polling on its own.
+    """
+    try:
+        import gpiod
+        from gpiod.line import Edge
+    except ImportError:
+        logger.warning("gpiod is not installed; GPIO blackout detection disabled")
+        return
+
+    loop = asyncio.get_running_loop()
+
+    def wait_for_edges() -> None:
+        try:
+            with gpiod.request_lines(
+                chip,
+                consumer="shrpid",
+                config={line: gpiod.LineSettings(edge_detection=Edge.BOTH)},
+            ) as request:
+                while True:
+                    if request.wait_edge_events(None):
+                        request.read_edge_events()
+                        loop.call_soon_threadsafe(sampler.trigger)
+        except OSError as e:
+            logger.error(f"GPIO blackout detection failed: {e!s}")
+
+    thread = threading.Thread(target=wait_for_edges, name="shrpi-gpio", daemon=True)
+    thread.start()
+    logger.info(f"Watching GPIO line {line} on {chip} for power changes")
@@ -0,0 +1,230 @@
+"""In-memory history of the measurements."""
+
+import asyncio
+import math
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from shrpi.i2c import Measurements
+from shrpi.sampler import Sampler
+from shrpi.telemetry_log import TelemetryLog
+
+# Measurement channels stored in the history, in Measurements field order
+CHANNELS = ("V_in", "V_supercap", "I_in", "T_mcu")
+
+# Queries returning more points than this are downsampled automatically
+MAX_HISTORY_POINTS = 3600
+
+
+class TelemetryHistory:
+    """A fixed-size ring buffer of timestamped measurements.
+
+    The buffer is preallocated as flat arrays of doubles (timestamps) and
+    floats (values), so the memory use stays constant: 24 bytes per sample.
+    Missing values are stored as NaN.
+
+    Examples:
+        >>> history = TelemetryHistory(capacity=3)
+        >>> for t in range(5):
+        ...     history.append(float(t), Measurements(12.0 + t, 5.0, None, None))
+        >>> len(history)
+        3
+        >>> [s["V_in"] for s in history.query()]
+        [14.0, 15.0, 16.0]
+        >>> history.query(step=10.0)[0]["V_in"]
+        {'min': 14.0, 'max': 16.0, 'mean': 15.0}
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError("History capacity must be positive")
+        self.capacity = capacity
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._values = [array("f", bytes(4 * capacity)) for _ in CHANNELS]
+        self._next = 0  # physical index of the next write
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, measurements: Measurements) -> None:
+        i = self._next
+        self._timestamps[i] = timestamp
+        for channel, value in zip(self._values, measurements):
+            channel[i] = math.nan if value is None else value
+        self._next = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def _physical(self, n: int) -> int:
+        """Map the n'th oldest sample to its index in the arrays."""
+        return (self._next - self._size + n) % self.capacity
+
+    def _bisect(self, timestamp: float, inclusive: bool = False) -> int:
+        """Return the number of samples older than `timestamp`.
+
+        If `inclusive` is set, samples at `timestamp` are counted as well.
+        """
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self._timestamps[self._physical(mid)]
+            if t < timestamp or (inclusive and t == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def time_range(self) -> Optional[Tuple[float, float]]:
+        if self._size == 0:
+            return None
+        return (
+            self._timestamps[self._physical(0)],
+            self._timestamps[self._physical(self._size - 1)],
+        )
+
+    def snapshot(
+        self, since: float = -math.inf, until: float = math.inf
+    ) -> "TelemetryHistory":
+        """Copy the samples with since <= timestamp <= until to a new history.
+
+        The copy is cheap, so take it on the event loop and query the copy
+        elsewhere while new samples keep coming in.
+
+        Examples:
+            >>> history = TelemetryHistory(capacity=3)
+            >>> for t in range(5):
+            ...     history.append(float(t), Measurements(12.0 + t, 5.0, None, None))
+            >>> copy, part = history.snapshot(), history.snapshot(since=3.0)
+            >>> history.append(5.0, Measurements(17.0, 5.0, None, None))
+            >>> [s["V_in"] for s in copy.query()]
+            [14.0, 15.0, 16.0]
+            >>> [s["V_in"] for s in part.query()]
+            [15.0, 16.0]
+        """
+        start = self._bisect(since)
+        n = max(0, self._bisect(until, inclusive=True) - start)
+        copy = TelemetryHistory(max(1, n))
+        if n == 0:
+            return copy
+        first = self._physical(start)
+        last = first + n
+        wrapped = max(0, last - self.capacity)
+        copy._timestamps = (
+            self._timestamps[first : last - wrapped] + self._timestamps[:wrapped]
+        )
+        copy._values = [
+            channel[first : last - wrapped] + channel[:wrapped]
+            for channel in self._values
+        ]
+        copy._size = n
+        return copy
+
+    def query(
+        self,
+        since: float = -math.inf,
+        until: float = math.inf,
+        step: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return the samples with since <= timestamp <= until.
+
+        If `step` is given, the samples are aggregated into buckets of
+        `step` seconds, and each value is reported as its min, max and mean
+        within the bucket.
+        """
+        start = self._bisect(since)
+        end = self._bisect(until, inclusive=True)
+
+        if step is None:
+            return [self._sample(self._physical(n)) for n in range(start, end)]
+
+        result: List[Dict[str, Any]] = []
+        bucket_start = math.nan
+        stats: List[List[float]] = []
+        for n in range(start, end):
+            i = self._physical(n)
+            t = self._timestamps[i]
+            bucket = math.floor(t / step) * step
+            if bucket != bucket_start:
+                if stats:
+                    result.append(self._bucket(bucket_start, stats))
+                bucket_start = bucket
+                # per channel: min, max, sum, count
+                stats = [[math.inf, -math.inf, 0.0, 0] for _ in CHANNELS]
+            for channel_stats, channel in zip(stats, self._values):
+                value = channel[i]
+                if math.isnan(value):
+                    continue
+                if value < channel_stats[0]:
+                    channel_stats[0] = value
+                if value > channel_stats[1]:
+                    channel_stats[1] = value
+                channel_stats[2] += value
+                channel_stats[3] += 1
+        if stats:
+            result.append(self._bucket(bucket_start, stats))
+        return result
+
+    def count(self, since: float = -math.inf, until: float = math.inf) -> int:
+        return self._bisect(until, inclusive=True) - self._bisect(since)
+
+    def _sample(self, i: int) -> Dict[str, Any]:
+        sample: Dict[str, Any] = {"timestamp": self._timestamps[i]}
+        for name, channel in zip(CHANNELS, self._values):
+            value = channel[i]
+            sample[name] = None if math.isnan(value) else round(value, 4)
+        return sample
+
+    @staticmethod
+    def _bucket(timestamp: float, stats: List[List[float]]) -> Dict[str, Any]:
+        bucket: Dict[str, Any] = {"timestamp": timestamp}
+        for name, (vmin, vmax, vsum, count) in zip(CHANNELS, stats):
+            bucket[name] = (
+                {
+                    "min": round(vmin, 4),
+                    "max": round(vmax, 4),
+                    "mean": round(vsum / count, 4),
+                }
+                if count
+                else None
+            )
+        return bucket
+
+
+async def record_history(
+    sampler: Sampler, history: TelemetryHistory, interval: float
+) -> None:
+    """Append a shared sample to the history every `interval` seconds."""
+    seq = 0
+    next_due = -math.inf
+    while True:
+        sample = await sampler.wait_for_sample(seq)
+        seq = sample.seq
+        if sample.timestamp >= next_due:
+            history.append(sample.timestamp, sample.measurements)
+            # keep the recorded samples on a fixed grid despite sampling jitter
+            next_due = sample.timestamp - sample.timestamp % interval + interval
+
+
+async def record_telemetry_log(
+    sampler: Sampler,
+    telemetry_log: TelemetryLog,
+    interval: float,
+    flush_interval: float,
+) -> None:
+    """Append a shared sample to the telemetry log every `interval` seconds.
+
+    The log is flushed to disk every `flush_interval` seconds.
+    """
+    loop = asyncio.get_running_loop()
+    seq = 0
+    next_due = -math.inf
+    next_flush = loop.time() + flush_interval
+    while True:
+        sample = await sampler.wait_for_sample(seq)
+        seq = sample.seq
+        if sample.timestamp >= next_due:
+            telemetry_log.append(sample.timestamp, sample.measurements)
+            next_due = sample.timestamp - sample.timestamp % interval + interval
+        if loop.time() >= next_flush:
+            await loop.run_in_executor(None, telemetry_log.flush)
+            next_flush = loop.time() + flush_interval
@@ -1,8 +1,22 @@
+import errno
+import threading
+import time
 from collections.abc import Sequence
 from enum import Enum
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
 
+from loguru import logger
 from smbus2 import SMBus
 
+from shrpi.metrics import BUS_LATENCY_BUCKETS, Histogram
+
+T = TypeVar("T")
+
+# Errors after which the bus handle is reopened and the transaction retried
+RECOVERABLE_ERRNOS = frozenset(
+    {errno.EIO, errno.ETIMEDOUT, getattr(errno, "EREMOTEIO", errno.EIO)}
+)
+
 
 class States(Enum):
     BEGIN = 0
@@ -25,19 +39,211 @@ class States(Enum):
     SLEEP = 17
 
 
+class CachePolicy(Enum):
+    STATIC = 0  # never changes while the daemon runs
+    WRITE_THROUGH = 1  # only changes when the daemon writes it
+    TTL = 2  # changes on its own; cached for a short time
+
+
+REGISTER_CACHE_POLICIES: Dict[int, CachePolicy] = {
+    0x01: CachePolicy.STATIC,  # legacy hardware version
+    0x02: CachePolicy.STATIC,  # legacy firmware version
+    0x03: CachePolicy.STATIC,  # hardware version
+    0x04: CachePolicy.STATIC,  # firmware version
+    0x10: CachePolicy.TTL,  # 5V output state
+    0x12: CachePolicy.WRITE_THROUGH,  # watchdog timeout
+    0x13: CachePolicy.WRITE_THROUGH,  # power-on threshold
+    0x14: CachePolicy.WRITE_THROUGH,  # power-off threshold
+    0x15: CachePolicy.TTL,  # device state
+    0x17: CachePolicy.WRITE_THROUGH,  # LED brightness
+}
+
+# Configuration keys accepted by SHRPiDevice.write_config
+CONFIG_KEYS = (
+    "watchdog_timeout",
+    "power_on_threshold",
+    "power_off_threshold",
+    "led_brightness",
+)
+
+# Default time to live of TTL cached registers, in seconds
+DEFAULT_REGISTER_CACHE_TTL = 1.0
+
+
+class RegisterCache:
+    """Cache of raw register contents with a per-register policy."""
+
+    def __init__(
+        self,
+        policies: Dict[int, CachePolicy],
+        ttl: float = DEFAULT_REGISTER_CACHE_TTL,
+    ):
+        self.policies = policies
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # register -> (time stored, raw bytes)
+        self._entries: Dict[int, Tuple[float, Tuple[int, ...]]] = {}
+
+    def get(self, reg: int, n: int) -> Optional[Tuple[int, ...]]:
+        policy = self.policies.get(reg)
+        if policy is None:
+            return None
+        entry = self._entries.get(reg)
+        if (
+            entry is None
+            or len(entry[1]) != n
+            or (policy is CachePolicy.TTL and time.monotonic() - entry[0] > self.ttl)
+        ):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, reg: int) -> Optional[Tuple[int, ...]]:
+        """Return the cached contents regardless of their age."""
+        entry = self._entries.get(reg)
+        return None if entry is None else entry[1]
+
+    def put(self, reg: int, vals: Sequence[int]) -> None:
+        if reg in self.policies:
+            self._entries[reg] = (time.monotonic(), tuple(vals))
+
+    def write(self, reg: int, vals: Sequence[int]) -> None:
+        """Update the cache after a register write."""
+        policy = self.policies.get(reg)
+        if policy is CachePolicy.WRITE_THROUGH:
+            # the device keeps only the low byte of each value written
+            self.put(reg, [val & 0xFF for val in vals])
+        elif policy is None:
+            # commands such as shutdown requests may change the volatile state
+            for r, p in self.policies.items():
+                if p is CachePolicy.TTL:
+                    self._entries.pop(r, None)
+        else:
+            self._entries.pop(reg, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
 class DeviceNotFoundError(Exception):
     pass
 
 
+class ConfigWriteError(OSError):
+    """A configuration write failed after some of the values were written."""
+
+    def __init__(self, applied: Sequence[str], failed: str, error: OSError):
+        super().__init__(error.errno, f"writing {failed} failed: {error}")
+        self.applied = list(applied)
+        self.failed = failed
+
+
+class Measurements(NamedTuple):
+    """A consistent snapshot of the analog measurements of the device."""
+
+    dcin_voltage: float
+    supercap_voltage: float
+    input_current: Optional[float]
+    temperature: Optional[float]
+
+    def as_dict(self) -> Dict[str, Optional[float]]:
+        """Return the measurements keyed by their API names."""
+        return {
+            "V_in": self.dcin_voltage,
+            "V_supercap": self.supercap_voltage,
+            "I_in": self.input_current,
+            "T_mcu": self.temperature,
+        }
+
+
+class I2CBus:
+    """A long-lived SMBus handle shared by all transactions on one bus.
+
+    Transactions are serialized with a lock, so concurrent callers never
+    interleave on the bus. If a transaction fails with a recoverable error,
+    the handle is reopened and the transaction is retried once.
+    """
+
+    def __init__(self, bus: int, bus_factory: Callable[[int], SMBus] = SMBus):
+        self.bus = bus
+        self._bus_factory = bus_factory
+        self._handle: Optional[SMBus] = None
+        self.lock = threading.RLock()
+        # statistics, updated while holding the lock
+        self.transactions = 0
+        self.errors = 0
+        self.reopens = 0
+        self.latency = Histogram(BUS_LATENCY_BUCKETS)
+
+    def _open(self) -> SMBus:
+        if self._handle is None:
+            self._handle = self._bus_factory(self.bus)
+        return self._handle
+
+    def _close(self) -> None:
+        if self._handle is not None:
+            try:
+                self._handle.close()
+            except OSError:
+                pass
+            self._handle = None
+
+    def _timed(self, func: Callable[[SMBus], T]) -> T:
+        handle = self._open()
+        self.transactions += 1
+        t0 = time.perf_counter()
+        try:
+            return func(handle)
+        except OSError:
+            self.errors += 1
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - t0)
+
+    def transaction(self, func: Callable[[SMBus], T]) -> T:
+        """Run a single bus transaction while holding the bus lock."""
+        with self.lock:
+            try:
+                return self._timed(func)
+            except OSError as e:
+                if e.errno not in RECOVERABLE_ERRNOS:
+                    raise
+                logger.warning(f"I2C bus {self.bus} error ({e!s}), reopening")
+                self._close()
+                self.reopens += 1
+            return self._timed(func)
+
+    def close(self) -> None:
+        with self.lock:
+            self._close()
+
+
 class SHRPiDevice:
-    def __init__(self, bus: int, addr: int):
+    def __init__(
+        self,
+        bus: int,
+        addr: int,
+        i2c: Optional[I2CBus] = None,
+        hardware_version: Optional[str] = None,
+        firmware_version: Optional[str] = None,
+    ):
         self.bus = bus
         self.addr = addr
+        self.i2c = I2CBus(bus) if i2c is None else i2c
+        self.cache = RegisterCache(REGISTER_CACHE_POLICIES)
         self._hardware_version = "Unknown"
         self._firmware_version = "Unknown"
         self.read_analog = self.read_analog_byte  # default to v1 protocol
         self.write_analog = self.write_analog_byte  # default to v1 protocol
 
+        # Versions that are already known don't need to be probed again
+        if hardware_version is not None:
+            self._set_hardware_version(hardware_version)
+        if firmware_version is not None:
+            self._set_firmware_version(firmware_version)
+
         self.hardware_version()  # force hardware version detection
         self.firmware_version()  # force firmware version detection
 
@@ -47,51 +253,77 @@ class SHRPiDevice:
         self.temp_max = 0.0
 
     @classmethod
-    def factory(cls, bus: int, addr: int) -> "SHRPiDevice":
-        temp_device = cls(bus, addr)
-        hw_ver = temp_device.hardware_version()
-
-        device: SHRPiDevice
+    def factory(
+        cls,
+        bus: int,
+        addr: int,
+        bus_factory: Callable[[int], SMBus] = SMBus,
+        i2c: Optional[I2CBus] = None,
+    ) -> "SHRPiDevice":
+        """Detect the device version and return a matching device object.
+
+        `bus_factory` opens the bus; pass a simulated bus to run without
+        hardware (see shrpi.simulator). Devices on the same bus can share
+        an `i2c` bus handle, which also serializes their transactions.
+        """
+        if i2c is None:
+            i2c = I2CBus(bus, bus_factory)
+        # Probe the versions once and hand them, along with the open bus
+        # handle, to the version specific device
         try:
-            if hw_ver.startswith("1."):
-                device = SHRPiV1Device(bus, addr)
-            else:
-                device = SHRPiV2Device(bus, addr)
-            return device
+            probe = cls(bus, addr, i2c=i2c)
         except OSError:
             raise DeviceNotFoundError("SH-RPi not found at I2C address %s" % addr)
+        hw_ver = probe.hardware_version()
+        fw_ver = probe.firmware_version()
+
+        device_cls = SHRPiV1Device if hw_ver.startswith("1.") else SHRPiV2Device
+        return device_cls(
+            bus,
+            addr,
+            i2c=probe.i2c,
+            hardware_version=hw_ver,
+            firmware_version=fw_ver,
+        )
+
+    def close(self) -> None:
+        self.i2c.close()
 
     def i2c_query_byte(self, reg: int) -> int:
-        with SMBus(self.bus) as bus:
-            # bus.write_byte(self.addr, reg)
-            b = bus.read_byte_data(self.addr, reg)
-        return b
+        return self.i2c_query_bytes(reg, 1)[0]
 
     def i2c_query_bytes(self, reg: int, n: int) -> Sequence[int]:
-        with SMBus(self.bus) as bus:
-            # bus.write_byte(self.addr, reg)
-            b = bus.read_i2c_block_data(self.addr, reg, n)
+        with self.i2c.lock:
+            cached = self.cache.get(reg, n)
+            if cached is not None:
+                return cached
+            b = self.i2c.transaction(lambda bus: self._read(bus, reg, n))
+            self.cache.put(reg, b)
         return b
 
+    def _read(self, bus: SMBus, reg: int, n: int) -> Sequence[int]:
+        if n == 1:
+            return [bus.read_byte_data(self.addr, reg)]
+        return bus.read_i2c_block_data(self.addr, reg, n)
+
     def i2c_query_word(self, reg: int) -> int:
-        with SMBus(self.bus) as bus:
-            # bus.write_byte(self.addr, reg)
-            buf = bus.read_i2c_block_data(self.addr, reg, 2)
-            w = buf[0] << 8 | buf[1]
-        return w
+        buf = self.i2c_query_bytes(reg, 2)
+        return buf[0] << 8 | buf[1]
 
     def i2c_write_byte(self, reg: int, val: int) -> None:
-        with SMBus(self.bus) as bus:
-            bus.write_byte_data(self.addr, reg, val)
+        with self.i2c.lock:
+            self.i2c.transaction(lambda bus: bus.write_byte_data(self.addr, reg, val))
+            self.cache.write(reg, [val])
 
     def i2c_write_word(self, reg: int, val: int) -> None:
-        with SMBus(self.bus) as bus:
-            buf = [(val >> 8), val & 0xFF]
-            bus.write_i2c_block_data(self.addr, reg, buf)
+        self.i2c_write_bytes(reg, [(val >> 8), val & 0xFF])
 
     def i2c_write_bytes(self, reg: int, vals: Sequence[int]) -> None:
-        with SMBus(self.bus) as bus:
-            bus.write_i2c_block_data(self.addr, reg, vals)
+        with self.i2c.lock:
+            self.i2c.transaction(
+                lambda bus: bus.write_i2c_block_data(self.addr, reg, list(vals))
+            )
+            self.cache.write(reg, vals)
 
     def _set_hardware_version(self, version: str) -> None:
         self._hardware_version = version
@@ -176,12 +408,83 @@ class SHRPiDevice:
     def state(self) -> str:
         return States(self.i2c_query_byte(0x15)).name
 
+    def cached_state(self) -> Optional[str]:
+        """Return the last device state read, without touching the bus."""
+        raw = self.cache.peek(0x15)
+        return None if raw is None else States(raw[0]).name
+
+    def read_status(self) -> Dict[str, Any]:
+        """Read the device state in one pass over the bus."""
+        with self.i2c.lock:
+            return {
+                "state": self.state(),
+                "5v_output_enabled": self.en5v_state(),
+                "watchdog_enabled": bool(self.watchdog_timeout()),
+            }
+
+    def read_config(self) -> Dict[str, Optional[float]]:
+        """Read all configuration values in one pass over the bus."""
+        with self.i2c.lock:
+            return {
+                "watchdog_timeout": self.watchdog_timeout(),
+                "power_on_threshold": self.power_on_threshold(),
+                "power_off_threshold": self.power_off_threshold(),
+                "led_brightness": self.led_brightness(),
+            }
+
+    def config_ranges(self) -> Dict[str, Tuple[float, float]]:
+        """Return the (min, max) values that the configuration registers hold.
+
+        Larger values would be truncated to the register width on write.
+        """
+        if self._firmware_version.startswith("2."):
+            watchdog_max, analog_max = 0xFFFF / 1000, 0xFFFF / 65536
+        else:
+            watchdog_max, analog_max = 0xFF / 10, 0xFF / 256
+        return {
+            "watchdog_timeout": (0.0, watchdog_max),
+            "power_on_threshold": (0.0, analog_max * self.vcap_max),
+            "power_off_threshold": (0.0, analog_max * self.vcap_max),
+            "led_brightness": (0, 0xFF),
+        }
+
+    def write_config(self, config: Dict[str, float]) -> None:
+        """Write several configuration values without other bus traffic between.
+
+        The keys are the same as in `read_config` and must be validated by
+        the caller. The writes are not atomic: if one fails, ConfigWriteError
+        tells which values were already written.
+        """
+        setters: Dict[str, Callable[[Any], None]] = {
+            "watchdog_timeout": self.set_watchdog_timeout,
+            "power_on_threshold": self.set_power_on_threshold,
+            "power_off_threshold": self.set_power_off_threshold,
+            "led_brightness": lambda value: self.set_led_brightness(int(value)),
+        }
+        applied: List[str] = []
+        with self.i2c.lock:
+            for key, value in config.items():
+                try:
+                    setters[key](value)
+                except OSError as e:
+                    raise ConfigWriteError(applied, key, e) from e
+                applied.append(key)
+
     def dcin_voltage(self) -> float:
         return self.read_analog(0x20, self.dcin_max)
 
     def supercap_voltage(self) -> float:
         return self.read_analog(0x21, self.vcap_max)
 
+    def read_measurements(self) -> Measurements:
+        """Read all analog measurements."""
+        return Measurements(
+            self.dcin_voltage(),
+            self.supercap_voltage(),
+            self.input_current(),
+            self.temperature(),
+        )
+
     def request_shutdown(self):
         self.i2c_write_byte(0x30, 0x01)
 
@@ -209,8 +512,15 @@ class SHRPiV1Device(SHRPiDevice):
     Device interface for SH-RPi v1 hardware.
     """
 
-    def __init__(self, bus=1, addr=0x6D):
-        super().__init__(bus, addr)
+    def __init__(
+        self,
+        bus: int = 1,
+        addr: int = 0x6D,
+        i2c: Optional[I2CBus] = None,
+        hardware_version: Optional[str] = None,
+        firmware_version: Optional[str] = None,
+    ):
+        super().__init__(bus, addr, i2c, hardware_version, firmware_version)
         self.vcap_max = 2.75
         self.dcin_max = 32.1
 
@@ -232,8 +542,15 @@ class SHRPiV2Device(SHRPiDevice):
     Device interface for SH-RPi v2 hardware.
     """
 
-    def __init__(self, bus=1, addr=0x6D):
-        super().__init__(bus, addr)
+    def __init__(
+        self,
+        bus: int = 1,
+        addr: int = 0x6D,
+        i2c: Optional[I2CBus] = None,
+        hardware_version: Optional[str] = None,
+        firmware_version: Optional[str] = None,
+    ):
+        super().__init__(bus, addr, i2c, hardware_version, firmware_version)
         self.vcap_max = 9.35
         self.dcin_max = 32.1
         self.i_max = 2.5
@@ -256,3 +573,17 @@ class SHRPiV2Device(SHRPiDevice):
 
     def temperature(self) -> float:
         return self.read_analog(0x23, self.temp_max)
+
+    def read_measurements(self) -> Measurements:
+        """Read registers 0x20-0x23 in a single block transaction."""
+        if not self._firmware_version.startswith("2."):
+            return super().read_measurements()
+
+        buf = self.i2c_query_bytes(0x20, 8)
+        words = [buf[i] << 8 | buf[i + 1] for i in range(0, 8, 2)]
+        return Measurements(
+            self.dcin_max * words[0] / 65536,
+            self.vcap_max * words[1] / 65536,
+            self.i_max * words[2] / 65536,
+            self.temp_max * words[3] / 65536,
+        )
@@ -0,0 +1,239 @@
+"""Lightweight instrumentation for the daemon internals."""
+
+import asyncio
+import bisect
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+# Bucket upper bounds (in seconds) for event loop lag measurements
+LOOP_LAG_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# Bucket upper bounds (in seconds) for I2C bus transaction durations
+BUS_LATENCY_BUCKETS = (0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+# How often to sample the event loop lag, in seconds
+LOOP_LAG_SAMPLE_INTERVAL = 0.05
+
+# How often to log a summary of the event loop lag, in seconds
+LOOP_LAG_REPORT_INTERVAL = 600.0
+
+
+class Histogram:
+    """Histogram with fixed bucket upper bounds.
+
+    Examples:
+        >>> h = Histogram([0.1, 1.0])
+        >>> for v in (0.05, 0.5, 0.7, 3.0):
+        ...     h.observe(v)
+        >>> h.cumulative_counts()
+        [(0.1, 1), (1.0, 3), (inf, 4)]
+        >>> h.quantile(0.5)
+        1.0
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        # the last slot counts the values above the largest bucket bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative_counts(self) -> List[Tuple[float, int]]:
+        """Return (upper bound, count of values <= bound) pairs."""
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket containing the q-quantile."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative_counts():
+            if total >= rank:
+                return bound
+        return float("inf")  # pragma: no cover
+
+    def summary(self) -> str:
+        return (
+            f"n={self.count} "
+            f"mean={1000 * self.sum / max(self.count, 1):.2f} ms "
+            f"p50<={1000 * self.quantile(0.5):.0f} ms "
+            f"p99<={1000 * self.quantile(0.99):.0f} ms "
+            f"max={1000 * self.max:.1f} ms"
+        )
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class OpenMetricsWriter:
+    """Build an exposition in the OpenMetrics text format.
+
+    Examples:
+        >>> w = OpenMetricsWriter()
+        >>> w.gauge("shrpi_input_voltage", "Input voltage", 12.0, unit="volts")
+        >>> w.counter("shrpi_blackouts", "Detected blackouts", 2)
+        >>> print(w.render(), end="")
+        # TYPE shrpi_input_voltage_volts gauge
+        # UNIT shrpi_input_voltage_volts volts
+        # HELP shrpi_input_voltage_volts Input voltage
+        shrpi_input_voltage_volts 12.0
+        # TYPE shrpi_blackouts counter
+        # HELP shrpi_blackouts Detected blackouts
+        shrpi_blackouts_total 2
+        # EOF
+    """
+
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    def __init__(self) -> None:
+        self._lines: List[str] = []
+
+    def _header(self, name: str, kind: str, help: str, unit: str = "") -> None:
+        self._lines.append(f"# TYPE {name} {kind}")
+        if unit:
+            self._lines.append(f"# UNIT {name} {unit}")
+        self._lines.append(f"# HELP {name} {help}")
+
+    def _sample(
+        self, name: str, value: float, labels: Optional[Dict[str, str]] = None
+    ) -> None:
+        self._lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        value: Optional[float],
+        unit: str = "",
+        labels: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """Add a gauge. Missing (None) values are skipped."""
+        if value is None:
+            return
+        if unit:
+            name = f"{name}_{unit}"
+        self._header(name, "gauge", help, unit)
+        self._sample(name, value, labels)
+
+    def labeled_gauge(
+        self,
+        name: str,
+        help: str,
+        samples: Iterable[Tuple[Dict[str, str], float]],
+        unit: str = "",
+    ) -> None:
+        """Add a gauge with one value per label set."""
+        if unit:
+            name = f"{name}_{unit}"
+        self._header(name, "gauge", help, unit)
+        for labels, value in samples:
+            self._sample(name, value, labels)
+
+    def counter(self, name: str, help: str, value: float, unit: str = "") -> None:
+        if unit:
+            name = f"{name}_{unit}"
+        self._header(name, "counter", help, unit)
+        self._sample(f"{name}_total", value)
+
+    def stateset(
+        self, name: str, help: str, states: Iterable[str], current: str
+    ) -> None:
+        """Add a state set with exactly the `current` state enabled."""
+        self._header(name, "stateset", help)
+        for state in states:
+            self._sample(name, int(state == current), {name: state})
+
+    def histogram(
+        self, name: str, help: str, histogram: "Histogram", unit: str = ""
+    ) -> None:
+        if unit:
+            name = f"{name}_{unit}"
+        self._header(name, "histogram", help, unit)
+        for bound, count in histogram.cumulative_counts():
+            self._sample(f"{name}_bucket", count, {"le": _format_value(bound)})
+        self._sample(f"{name}_count", histogram.count)
+        self._sample(f"{name}_sum", histogram.sum)
+
+    def render(self) -> str:
+        return "\n".join(self._lines + ["# EOF"]) + "\n"
+
+
+class StartupTimer:
+    """Record the duration of consecutive startup phases.
+
+    Examples:
+        >>> timer = StartupTimer()
+        >>> timer.add("import", 0.25)
+        >>> timer.summary()
+        'import 250 ms, total 250 ms'
+    """
+
+    def __init__(self) -> None:
+        self.phases: List[Tuple[str, float]] = []
+        self._t0 = time.perf_counter()
+
+    def add(self, phase: str, duration: float) -> None:
+        """Record a phase that was timed elsewhere."""
+        self.phases.append((phase, duration))
+
+    def lap(self, phase: str) -> None:
+        """Record the time elapsed since the previous lap as `phase`."""
+        now = time.perf_counter()
+        self.add(phase, now - self._t0)
+        self._t0 = now
+
+    def summary(self) -> str:
+        parts = [f"{phase} {1000 * duration:.0f} ms" for phase, duration in self.phases]
+        total = sum(duration for _, duration in self.phases)
+        return ", ".join(parts + [f"total {1000 * total:.0f} ms"])
+
+
+async def monitor_loop_lag(
+    histogram: Histogram,
+    interval: float = LOOP_LAG_SAMPLE_INTERVAL,
+    report_interval: float = LOOP_LAG_REPORT_INTERVAL,
+) -> None:
+    """Measure how late the event loop wakes up from a sleep.
+
+    Any blocking call on the event loop shows up as a stall in the histogram.
+    """
+    last_report = time.monotonic()
+    while True:
+        t0 = time.monotonic()
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        histogram.observe(max(0.0, now - t0 - interval))
+        if now - last_report >= report_interval:
+            logger.debug(f"Event loop lag: {histogram.summary()}")
+            last_report = now
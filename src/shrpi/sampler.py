@@ -0,0 +1,128 @@
+"""Shared polling of the device measurements."""
+
+import asyncio
+import time
+from typing import NamedTuple, Optional
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.const import DEFAULT_SAMPLE_INTERVAL
+from shrpi.i2c import Measurements
+
+
+def adaptive_interval(
+    voltage: float,
+    limit: float,
+    margin: float,
+    fast_interval: float,
+    slow_interval: float,
+) -> float:
+    """Pick a polling interval based on how close the voltage is to the limit.
+
+    The interval ramps linearly from `fast_interval` at the limit to
+    `slow_interval` at `limit + margin`.
+
+    Examples:
+        >>> adaptive_interval(12.0, 9.0, 2.0, 0.1, 1.0)
+        1.0
+        >>> adaptive_interval(10.0, 9.0, 2.0, 0.1, 1.0)
+        0.55
+        >>> adaptive_interval(8.0, 9.0, 2.0, 0.1, 1.0)
+        0.1
+    """
+    if margin <= 0:
+        return fast_interval if voltage <= limit else slow_interval
+    fraction = min(1.0, max(0.0, (voltage - limit) / margin))
+    return round(fast_interval + fraction * (slow_interval - fast_interval), 6)
+
+
+class Sample(NamedTuple):
+    """Measurements tagged with a sequence number and a UNIX timestamp.
+
+    `changed_seq` is the sequence number of the first sample in a row with
+    the same measurements, so it only changes when the values do.
+    """
+
+    seq: int
+    timestamp: float
+    measurements: Measurements
+    changed_seq: int = 0
+
+
+class Sampler:
+    """Poll the device at a fixed rate and publish the latest sample.
+
+    All consumers read the published sample instead of the hardware, so the
+    bus load stays constant no matter how many clients are connected.
+    """
+
+    def __init__(
+        self,
+        shrpi_device: AsyncSHRPiDevice,
+        interval: float = DEFAULT_SAMPLE_INTERVAL,
+    ):
+        self.shrpi_device = shrpi_device
+        self.interval = interval
+        self.latest: Optional[Sample] = None
+        self._seq = 0
+        self._new_sample = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._sample_now = False
+
+    def _publish(self, measurements: Measurements) -> Sample:
+        self._seq += 1
+        changed_seq = self._seq
+        if self.latest is not None and self.latest.measurements == measurements:
+            changed_seq = self.latest.changed_seq
+        sample = Sample(self._seq, time.time(), measurements, changed_seq)
+        self.latest = sample
+        # wake up everyone waiting for this sample and start a new generation
+        self._new_sample.set()
+        self._new_sample = asyncio.Event()
+        return sample
+
+    async def read_fresh(self) -> Sample:
+        """Read the device right now and publish the result."""
+        return self._publish(await self.shrpi_device.read_measurements())
+
+    async def latest_sample(self) -> Sample:
+        """Return the latest sample, reading the device if there is none yet."""
+        if self.latest is None:
+            return await self.read_fresh()
+        return self.latest
+
+    async def wait_for_sample(self, after_seq: int = 0) -> Sample:
+        """Wait until a sample newer than `after_seq` is available."""
+        while self.latest is None or self.latest.seq <= after_seq:
+            await self._new_sample.wait()
+        return self.latest
+
+    def set_interval(self, interval: float) -> None:
+        """Change the polling interval. The next sample is rescheduled."""
+        if interval != self.interval:
+            self.interval = interval
+            self._wakeup.set()
+
+    def trigger(self) -> None:
+        """Take the next sample immediately."""
+        self._sample_now = True
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._sample_now = False
+            self._wakeup.clear()
+            await self.read_fresh()
+            sampled_at = loop.time()
+
+            # sleep until the next sample is due; an interval change or a
+            # trigger wakes us up early
+            while not self._sample_now:
+                remaining = sampled_at + self.interval - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
@@ -3,29 +3,397 @@
 
 import asyncio
 import datetime
-import numbers
+import functools
+import importlib
+import json
+import math
 import os
 import pathlib
+import time
+import zlib
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
 
 from aiohttp import web
 from loguru import logger
 
 import shrpi.const
-import shrpi.i2c
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.devices import ManagedDevice
+from shrpi.energy import SupercapEstimator
+from shrpi.history import MAX_HISTORY_POINTS, TelemetryHistory
+from shrpi.i2c import (
+    CONFIG_KEYS,
+    ConfigWriteError,
+    Measurements,
+    SHRPiDevice,
+    States,
+)
+from shrpi.metrics import Histogram, OpenMetricsWriter
+from shrpi.sampler import Sample, Sampler
+from shrpi.shutdown import ShutdownOrchestrator
+from shrpi.state_machine import STATES, StateMachineStatus
+from shrpi.watchdog import WatchdogFeeder
+
+if TYPE_CHECKING:
+    import ssl
+
+# Default interval between streamed samples, in seconds
+DEFAULT_STREAM_INTERVAL = 1.0
+
+# Routes that rate limited clients may still use: they are served from the
+# shared sample and caches without touching the bus
+CACHED_ROUTES = frozenset(
+    {"/", "/version", "/values", "/values/{key}", "/history", "/metrics", "/energy"}
+)
+
+# Marks the requests of rate limited clients. Older aiohttp versions, which
+# are still needed on Python 3.8, have no typed request keys.
+RATE_LIMITED: Any = (
+    web.RequestKey("rate_limited", bool)
+    if hasattr(web, "RequestKey")
+    else "rate_limited"
+)
+
+# Compact encodings that clients can ask for with the Accept header, and the
+# optional modules and functions that implement them
+COMPACT_ENCODINGS = {
+    "application/cbor": ("cbor2", "dumps"),
+    "application/msgpack": ("msgpack", "packb"),
+    "application/x-msgpack": ("msgpack", "packb"),
+}
+
+# Makes the sample based ETags of this process differ from those of earlier
+# runs, whose sequence numbers started from the same values
+ETAG_EPOCH = f"{time.time_ns():x}"
+
+# Number of idle clients after which fully replenished token buckets are dropped
+RATE_LIMITER_MAX_CLIENTS = 1024
+
+
+def route_path(canonical: str) -> str:
+    """Return the route path of a resource without the device prefix.
+
+    Examples:
+        >>> route_path("/devices/aux/values/{key}")
+        '/values/{key}'
+        >>> route_path("/devices/aux/")
+        '/'
+        >>> route_path("/metrics")
+        '/metrics'
+    """
+    if canonical.startswith("/devices/"):
+        parts = canonical.split("/", 3)
+        return "/" + parts[3] if len(parts) == 4 else "/"
+    return canonical
+
+
+@functools.lru_cache(maxsize=None)
+def compact_encoder(media_type: str) -> Optional[Callable[[Any], bytes]]:
+    """Return the encoder of a compact media type, or None if not installed."""
+    module_name, function = COMPACT_ENCODINGS[media_type]
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError:
+        return None
+    encoder: Callable[[Any], bytes] = getattr(module, function)
+    return encoder
+
+
+def negotiate_encoding(accept: str) -> Optional[str]:
+    """Pick the compact media type preferred by the client.
+
+    Returns None if the client prefers JSON or none of the compact encoders
+    it accepts is installed.
+
+    Examples:
+        >>> negotiate_encoding("application/json")
+        >>> negotiate_encoding("text/html, */*;q=0.8")
+    """
+    candidates = []
+    for i, item in enumerate(accept.split(",")):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            candidates.append((-q, i, media_type.lower()))
+    for _, _, media_type in sorted(candidates):
+        if media_type == "application/json":
+            return None
+        if media_type in COMPACT_ENCODINGS and compact_encoder(media_type):
+            return media_type
+    return None
+
+
+def content_etag(data: Any) -> str:
+    """ETag derived from the content.
+
+    Examples:
+        >>> content_etag({"a": 1, "b": 2}) == content_etag({"b": 2, "a": 1})
+        True
+    """
+    return f"{zlib.crc32(json.dumps(data, sort_keys=True).encode()):08x}"
+
+
+def encoded_response(
+    request: web.Request,
+    data: Any,
+    etag: Optional[str] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> web.Response:
+    """Respond with `data` in the encoding negotiated with the client.
+
+    If an ETag is given and the client already has the current version
+    (If-None-Match), the response is 304 Not Modified without a body.
+    """
+    media_type = negotiate_encoding(request.headers.get("Accept", ""))
+    if etag is not None:
+        if media_type is not None:
+            # each representation needs its own tag
+            etag = f"{etag}.{media_type.rsplit('/', 1)[1]}"
+        if_none_match = request.if_none_match or ()
+        if any(tag.value in (etag, "*") for tag in if_none_match):
+            response = web.Response(status=304)
+            response.etag = etag
+            return response
+
+    if media_type is None:
+        response = web.json_response(data, headers=headers)
+    else:
+        encoder = compact_encoder(media_type)
+        assert encoder is not None
+        response = web.Response(
+            body=encoder(data), content_type=media_type, headers=headers
+        )
+    if etag is not None:
+        response.etag = etag
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+def sample_etag(sample: Sample) -> str:
+    return f"{ETAG_EPOCH}-{sample.changed_seq}"
+
+
+def is_truthy(value: Optional[str]) -> bool:
+    """Interpret a query string flag.
+
+    Examples:
+        >>> is_truthy("1"), is_truthy("true"), is_truthy("0"), is_truthy(None)
+        (True, True, False, False)
+    """
+    return value is not None and value.lower() in ("1", "true", "yes")
+
+
+def config_value_error(
+    key: str, value: Any, value_range: Sequence[float]
+) -> Optional[str]:
+    """Check a configuration value against the range of its register.
+
+    Returns a description of the problem, or None if the value is valid.
+
+    Examples:
+        >>> config_value_error("led_brightness", 64, (0, 255))
+        >>> config_value_error("led_brightness", 300, (0, 255))
+        'led_brightness must be between 0 and 255'
+        >>> config_value_error("led_brightness", 6.5, (0, 255))
+        'led_brightness must be an integer'
+        >>> config_value_error("watchdog_timeout", True, (0.0, 65.535))
+        'watchdog_timeout must be a number'
+    """
+    # bool is a subclass of int but never a sensible configuration value
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not math.isfinite(value)
+    ):
+        return f"{key} must be a number"
+    if key == "led_brightness" and value != int(value):
+        return f"{key} must be an integer"
+    low, high = value_range
+    if not low <= value <= high:
+        return f"{key} must be between {low:g} and {high:g}"
+    return None
+
+
+def exceeds_deadband(
+    previous: Measurements, current: Measurements, deadband: float
+) -> bool:
+    """Check whether any measurement has moved by more than `deadband`.
+
+    Examples:
+        >>> a = Measurements(12.0, 5.0, None, None)
+        >>> exceeds_deadband(a, Measurements(12.05, 5.0, None, None), 0.1)
+        False
+        >>> exceeds_deadband(a, Measurements(12.2, 5.0, None, None), 0.1)
+        True
+    """
+    for old, new in zip(previous, current):
+        if old is None or new is None:
+            if old is not new:
+                return True
+        elif abs(new - old) > deadband:
+            return True
+    return False
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Examples:
+        >>> bucket = TokenBucket(rate=1.0, burst=2, now=0.0)
+        >>> [bucket.take(now=0.0) for _ in range(3)]
+        [True, True, False]
+        >>> bucket.take(now=1.0)
+        True
+    """
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: Optional[float] = None) -> bool:
+        """Take a token if one is available."""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class TCPGuard:
+    """Connection cap and per-client rate limiting for the TCP site.
+
+    Requests on connections beyond the first `max_connections` open ones get
+    a 503 and their connection is closed; the older connections keep being
+    served. Clients over their rate get the cached measurements (fresh reads are
+    ignored) and a 429 response for anything that would need the bus.
+    """
+
+    def __init__(self, max_connections: int, rate: float, burst: float):
+        self.max_connections = max_connections
+        self.rate = rate
+        self.burst = burst
+        self.server: Optional[web.Server] = None
+        self.rate_limited = 0
+        self.rejected_connections = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def configure(self, max_connections: int, rate: float, burst: float) -> None:
+        """Change the limits; they also apply to the clients already seen."""
+        self.max_connections = max_connections
+        self.rate = rate
+        self.burst = burst
+        for bucket in self._buckets.values():
+            bucket.rate = rate
+            bucket.burst = burst
+
+    def allow(self, client: str) -> bool:
+        if self.rate <= 0:
+            return True
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= RATE_LIMITER_MAX_CLIENTS:
+                now = time.monotonic()
+                self._buckets = {
+                    k: b for k, b in self._buckets.items() if not b.full(now)
+                }
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    @web.middleware
+    async def middleware(
+        self,
+        request: web.Request,
+        handler: Callable[[web.Request], Awaitable[web.StreamResponse]],
+    ) -> web.StreamResponse:
+        if (
+            self.max_connections > 0
+            and self.server is not None
+            and request.protocol in self.server.connections[self.max_connections :]
+        ):
+            self.rejected_connections += 1
+            response = web.Response(status=503, text="Too many connections")
+            response.force_close()
+            return response
+
+        if not self.allow(request.remote or ""):
+            self.rate_limited += 1
+            resource = request.match_info.route.resource
+            if resource is None or route_path(resource.canonical) not in CACHED_ROUTES:
+                return web.Response(
+                    status=429,
+                    text="Rate limit exceeded",
+                    headers={"Retry-After": f"{math.ceil(1 / self.rate)}"},
+                )
+            request[RATE_LIMITED] = True
+        return await handler(request)
 
 
 class RouteHandlers:
-    def __init__(self, shrpi_device: shrpi.i2c.SHRPiDevice, poweroff_command: str):
+    def __init__(
+        self,
+        shrpi_device: AsyncSHRPiDevice,
+        sampler: Sampler,
+        poweroff_command: str,
+        history: Optional[TelemetryHistory] = None,
+        status: Optional[StateMachineStatus] = None,
+        loop_lag: Optional[Histogram] = None,
+        shutdown: Optional[ShutdownOrchestrator] = None,
+        watchdog: Optional[WatchdogFeeder] = None,
+        estimator: Optional[SupercapEstimator] = None,
+    ):
         self.shrpi_device = shrpi_device
+        self.sampler = sampler
         self.poweroff_command = poweroff_command
+        self.history = history
+        self.status = status
+        self.loop_lag = loop_lag
+        self.watchdog = watchdog
+        self.estimator = estimator
+        if shutdown is None:
+            shutdown = ShutdownOrchestrator(shrpi_device, poweroff_command)
+        self.shutdown = shutdown
+        # open streams and their formats, for the shutdown notification
+        self._streams: Dict[web.StreamResponse, str] = {}
+
+    async def _get_sample(self, request: web.Request) -> Sample:
+        """Get the shared sample, or a live one if requested with ?fresh=1."""
+        if is_truthy(request.query.get("fresh")) and not request.get(RATE_LIMITED):
+            return await self.sampler.read_fresh()
+        return await self.sampler.latest_sample()
 
     async def get_root(self, request: web.Request) -> web.Response:
         return web.Response(text="This is shrpid!\n")
 
     async def get_version(self, request: web.Request) -> web.Response:
         """Get the hardware and firmware version numbers."""
-        hw_version = self.shrpi_device.hardware_version()
-        fw_version = self.shrpi_device.firmware_version()
+        hw_version = await self.shrpi_device.hardware_version()
+        fw_version = await self.shrpi_device.firmware_version()
         daemon_version = shrpi.const.VERSION
 
         response = {
@@ -38,31 +406,33 @@ class RouteHandlers:
 
     async def get_state(self, request: web.Request) -> web.Response:
         """Get the current state of the device."""
-        state = self.shrpi_device.state()
-        en5v_state = self.shrpi_device.en5v_state()
-        watchdog_enabled = bool(self.shrpi_device.watchdog_timeout())
-
-        response = {
-            "state": state,
-            "5v_output_enabled": en5v_state,
-            "watchdog_enabled": watchdog_enabled,
-        }
-
-        return web.json_response(response)
+        status = await self.shrpi_device.read_status()
+        return encoded_response(request, status, content_etag(status))
 
     async def post_shutdown(self, request: web.Request) -> web.Response:
         """Receive a shutdown request from the client."""
-        self.shrpi_device.request_shutdown()  # Inform the device about the shutdown
-        # call the system shutdown command
-        logger.info(f"Executing {self.poweroff_command}")
-        asyncio.create_task(asyncio.create_subprocess_shell(self.poweroff_command))
+        self.shutdown.request("requested over the API")
 
         return web.Response(status=204)
 
+    async def notify_shutdown(self) -> None:
+        """Tell the stream clients that the system is going down."""
+        chunks = {
+            "sse": b"event: shutdown\ndata: {}\n\n",
+            "ndjson": b'{"event": "shutdown"}\n',
+        }
+        await asyncio.gather(
+            *(
+                response.write(chunks[fmt])
+                for response, fmt in list(self._streams.items())
+            ),
+            return_exceptions=True,
+        )
+
     async def post_sleep(self, request: web.Request) -> web.Response:
         """Receive a sleep request from the client."""
 
-        if self.shrpi_device.firmware_version().startswith("1."):
+        if (await self.shrpi_device.firmware_version()).startswith("1."):
             return web.Response(
                 status=400,
                 text="Sleep mode is not supported in firmware version 1.x",
@@ -102,7 +472,7 @@ class RouteHandlers:
             asyncio.create_subprocess_exec("rtcwake", "-m", "no", "-t", str(timestamp))
         )
 
-        self.shrpi_device.request_sleep()
+        await self.shrpi_device.request_sleep()
 
         # From the OS point of view, this is a regular shutdown.
         asyncio.create_task(asyncio.create_subprocess_exec("shutdown", "-h", "now"))
@@ -111,32 +481,66 @@ class RouteHandlers:
 
     async def get_config(self, request: web.Request) -> web.Response:
         """Get the configuration."""
-        watchdog_timeout = self.shrpi_device.watchdog_timeout()
-        power_on_threshold = self.shrpi_device.power_on_threshold()
-        power_off_threshold = self.shrpi_device.power_off_threshold()
-        led_brightness = self.shrpi_device.led_brightness()
-
-        config = {
-            "watchdog_timeout": watchdog_timeout,
-            "power_on_threshold": power_on_threshold,
-            "power_off_threshold": power_off_threshold,
-            "led_brightness": led_brightness,
-        }
+        config = await self.shrpi_device.read_config()
+        return encoded_response(request, config, content_etag(config))
+
+    async def patch_config(self, request: web.Request) -> web.Response:
+        """Set several configuration values at once.
 
-        return web.json_response(config)
+        All values are validated before anything is written, and the writes
+        are done back to back without other bus traffic in between. The
+        batch is not atomic: if a write fails, the values written before it
+        stay applied and are listed in the error response.
+        """
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON")
+        if not isinstance(data, dict) or not data:
+            return web.Response(status=400, text="Expected an object of values")
+
+        unknown = sorted(set(data) - set(CONFIG_KEYS))
+        if unknown:
+            return web.Response(
+                status=400, text=f"Unknown configuration keys: {', '.join(unknown)}"
+            )
+        ranges = await self.shrpi_device.config_ranges()
+        for key, value in data.items():
+            error = config_value_error(key, value, ranges[key])
+            if error is not None:
+                return web.Response(status=400, text=error)
+        if "led_brightness" in data and (
+            await self.shrpi_device.firmware_version()
+        ).startswith("1."):
+            return web.Response(
+                status=400,
+                text="LED brightness is not supported in hardware version 1.x",
+            )
+
+        try:
+            await self.shrpi_device.write_config(data)
+        except ConfigWriteError as e:
+            logger.error(f"Configuration write failed: {e}")
+            return web.json_response(
+                {"error": str(e), "applied": e.applied, "failed": e.failed},
+                status=500,
+            )
+
+        return web.Response(status=204)
 
     async def get_config_key(self, request: web.Request) -> web.Response:
         """Get a configuration value."""
         key = request.match_info["key"]
 
+        value: Optional[float]
         if key == "watchdog_timeout":
-            value = self.shrpi_device.watchdog_timeout()
+            value = await self.shrpi_device.watchdog_timeout()
         elif key == "power_on_threshold":
-            value = self.shrpi_device.power_on_threshold()
+            value = await self.shrpi_device.power_on_threshold()
         elif key == "power_off_threshold":
-            value = self.shrpi_device.power_off_threshold()
+            value = await self.shrpi_device.power_off_threshold()
         elif key == "led_brightness":
-            value = self.shrpi_device.led_brightness()
+            value = await self.shrpi_device.led_brightness()
         else:
             return web.Response(status=404)
 
@@ -145,89 +549,541 @@ class RouteHandlers:
     async def put_config_key(self, request: web.Request) -> web.Response:
         """Set a configuration value."""
         key = request.match_info["key"]
+        if key not in CONFIG_KEYS:
+            return web.Response(status=404)
 
-        data: float = await request.json()
+        try:
+            data: float = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON")
 
-        # check that data is a number
-        if not isinstance(data, numbers.Number):
-            return web.Response(status=400, text="Value must be a number")
+        error = config_value_error(
+            key, data, (await self.shrpi_device.config_ranges())[key]
+        )
+        if error is not None:
+            return web.Response(status=400, text=error)
 
         if key == "watchdog_timeout":
-            self.shrpi_device.set_watchdog_timeout(float(data))
+            await self.shrpi_device.set_watchdog_timeout(float(data))
         elif key == "power_on_threshold":
-            self.shrpi_device.set_power_on_threshold(data)
+            await self.shrpi_device.set_power_on_threshold(data)
         elif key == "power_off_threshold":
-            self.shrpi_device.set_power_off_threshold(data)
+            await self.shrpi_device.set_power_off_threshold(data)
         elif key == "led_brightness":
-            if self.shrpi_device.firmware_version().startswith("1."):
+            if (await self.shrpi_device.firmware_version()).startswith("1."):
                 return web.Response(
                     status=400,
                     text="LED brightness is not supported in hardware version 1.x",
                 )
-            self.shrpi_device.set_led_brightness(int(data))
-        else:
-            return web.Response(status=404)
+            await self.shrpi_device.set_led_brightness(int(data))
 
         return web.Response(status=204)
 
     async def get_values(self, request: web.Request) -> web.Response:
         """Get measured values."""
-        dcin_voltage = self.shrpi_device.dcin_voltage()
-        supercap_voltage = self.shrpi_device.supercap_voltage()
-        input_current = self.shrpi_device.input_current()
-        mcu_temperature = self.shrpi_device.temperature()
-
-        values = {
-            "V_in": dcin_voltage,
-            "V_supercap": supercap_voltage,
-            "I_in": input_current,
-            "T_mcu": mcu_temperature,
-        }
+        sample = await self._get_sample(request)
 
-        return web.json_response(values)
+        return encoded_response(
+            request,
+            sample.measurements.as_dict(),
+            sample_etag(sample),
+            headers={"X-Sample-Timestamp": f"{sample.timestamp:.3f}"},
+        )
 
     async def get_values_key(self, request: web.Request) -> web.Response:
         """Get a measured value."""
         key = request.match_info["key"]
 
-        if key == "V_in":
-            value = self.shrpi_device.dcin_voltage()
-        elif key == "V_supercap":
-            value = self.shrpi_device.supercap_voltage()
-        elif key == "I_in":
-            value = self.shrpi_device.input_current()
-        elif key == "T_mcu":
-            value = self.shrpi_device.temperature()
-        else:
+        sample = await self._get_sample(request)
+        values = sample.measurements.as_dict()
+        if key not in values:
             return web.Response(status=404)
 
-        return web.json_response(value)
+        return encoded_response(
+            request,
+            values[key],
+            sample_etag(sample),
+            headers={"X-Sample-Timestamp": f"{sample.timestamp:.3f}"},
+        )
+
+    async def get_energy(self, request: web.Request) -> web.Response:
+        """Get the supercap energy estimate.
+
+        The projections are null until the supercap has discharged for a
+        couple of samples, and the energy and capacitance also need the load
+        power, which is only measured by v2 devices.
+        """
+        if self.estimator is None:
+            return web.Response(status=404)
+        estimator = self.estimator
+        cutoff = await self.shrpi_device.power_off_threshold()
+        data = {
+            "supercap_voltage": estimator.voltage,
+            "power_off_threshold": cutoff,
+            "discharge_rate": estimator.discharge_rate(),
+            "load_power": estimator.load_power,
+            "time_to_brownout": estimator.time_remaining(cutoff),
+            "energy_remaining": estimator.energy_remaining(cutoff),
+            "capacitance": estimator.capacitance(),
+        }
+        return encoded_response(request, data, content_etag(data))
+
+    async def get_stream(self, request: web.Request) -> web.StreamResponse:
+        """Stream measured values as Server-Sent Events or NDJSON.
+
+        Query parameters:
+            interval: minimum time between pushed samples, in seconds
+            deadband: only push a sample if a value has changed by more than
+                this; without it, every sample is pushed
+            format: "sse" or "ndjson"; defaults to SSE if the client accepts it
+        """
+        deadband: Optional[float] = None
+        try:
+            interval = float(request.query.get("interval", DEFAULT_STREAM_INTERVAL))
+            if "deadband" in request.query:
+                deadband = float(request.query["deadband"])
+        except ValueError:
+            return web.Response(
+                status=400, text="interval and deadband must be numbers"
+            )
+        if interval < 0 or (deadband is not None and deadband < 0):
+            return web.Response(
+                status=400, text="interval and deadband must be non-negative"
+            )
+
+        fmt = request.query.get("format")
+        if fmt is None:
+            accept = request.headers.get("Accept", "")
+            fmt = "sse" if "text/event-stream" in accept else "ndjson"
+        if fmt not in ("sse", "ndjson"):
+            return web.Response(status=400, text="format must be sse or ndjson")
+
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": (
+                    "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+                ),
+                "Cache-Control": "no-cache",
+            }
+        )
+        await response.prepare(request)
+
+        last_sent: Optional[Measurements] = None
+        seq = 0
+        self._streams[response] = fmt
+        try:
+            # a client that went away is only noticed on write, so check the
+            # transport too in case nothing has been written for a while
+            while request.transport is not None and not request.transport.is_closing():
+                sample = await self.sampler.wait_for_sample(seq)
+                seq = sample.seq
+                if (
+                    deadband is None
+                    or last_sent is None
+                    or exceeds_deadband(last_sent, sample.measurements, deadband)
+                ):
+                    data = json.dumps(
+                        {"timestamp": sample.timestamp, **sample.measurements.as_dict()}
+                    )
+                    if fmt == "sse":
+                        chunk = f"id: {sample.seq}\ndata: {data}\n\n"
+                    else:
+                        chunk = data + "\n"
+                    await response.write(chunk.encode())
+                    last_sent = sample.measurements
+                await asyncio.sleep(interval)
+        except ConnectionResetError:
+            pass
+        finally:
+            del self._streams[response]
+
+        return response
+
+    async def get_snapshot(self, request: web.Request) -> web.Response:
+        """Get the versions, state, configuration and values in one document.
+
+        The device registers are read in a single pass over the bus; the
+        values come from the shared sample (or a live read with ?fresh=1).
+        """
+
+        def read_all(device: SHRPiDevice) -> Dict[str, Any]:
+            with device.i2c.lock:
+                return {
+                    "version": {
+                        "hardware_version": device.hardware_version(),
+                        "firmware_version": device.firmware_version(),
+                        "daemon_version": shrpi.const.VERSION,
+                    },
+                    "state": device.read_status(),
+                    "config": device.read_config(),
+                }
+
+        snapshot = await self.shrpi_device.run(read_all, self.shrpi_device.device)
+        sample = await self._get_sample(request)
+        snapshot["values"] = sample.measurements.as_dict()
+        snapshot["timestamp"] = sample.timestamp
+
+        return web.json_response(
+            snapshot, headers={"X-Sample-Timestamp": f"{sample.timestamp:.3f}"}
+        )
+
+    async def get_history(self, request: web.Request) -> web.Response:
+        """Get the measurement history.
+
+        Query parameters:
+            since, until: UNIX timestamps limiting the time range; negative
+                values are relative to the current time
+            step: aggregate the samples into buckets of this many seconds
+        """
+        if self.history is None:
+            return web.Response(status=404, text="History is disabled")
+
+        try:
+            since = float(request.query.get("since", "-inf"))
+            until = float(request.query.get("until", "inf"))
+            step_str = request.query.get("step")
+            step = None if step_str is None else float(step_str)
+        except ValueError:
+            return web.Response(
+                status=400, text="since, until and step must be numbers"
+            )
+        if step is not None and not step > 0:
+            return web.Response(status=400, text="step must be positive")
+
+        now = time.time()
+        if since < 0:
+            since += now
+        if until < 0:
+            until += now
+
+        time_range = self.history.time_range()
+        if (
+            step is None
+            and time_range is not None
+            and self.history.count(since, until) > MAX_HISTORY_POINTS
+        ):
+            # too many points to return raw; downsample automatically
+            span = min(until, time_range[1]) - max(since, time_range[0])
+            step = float(max(1, math.ceil(span / MAX_HISTORY_POINTS)))
+
+        # Aggregating a day of samples takes a while on small boards, so
+        # keep it off the event loop. The history keeps changing on the loop,
+        # so the query runs on a copy.
+        snapshot = self.history.snapshot(since, until)
+        loop = asyncio.get_running_loop()
+        samples = await loop.run_in_executor(
+            None, functools.partial(snapshot.query, step=step)
+        )
+
+        return web.json_response({"step": step, "samples": samples})
+
+    async def get_metrics(self, request: web.Request) -> web.Response:
+        """Export the measurements and daemon internals in OpenMetrics format.
+
+        Everything comes from the shared sample and the register cache, so a
+        scrape doesn't cost any bus transactions once the configuration
+        registers have been cached.
+        """
+
+        device = self.shrpi_device.device
+        config = await self.shrpi_device.read_config()
+
+        w = OpenMetricsWriter()
+        sample = self.sampler.latest
+        if sample is not None:
+            m = sample.measurements
+            w.gauge("shrpi_input_voltage", "Input voltage", m.dcin_voltage, "volts")
+            w.gauge(
+                "shrpi_supercap_voltage",
+                "Supercapacitor voltage",
+                m.supercap_voltage,
+                "volts",
+            )
+            w.gauge("shrpi_input_current", "Input current", m.input_current, "amperes")
+            w.gauge("shrpi_mcu_temperature", "MCU temperature", m.temperature, "kelvin")
+            w.gauge(
+                "shrpi_sample_timestamp",
+                "UNIX time of the latest sample",
+                sample.timestamp,
+                "seconds",
+            )
+            w.counter("shrpi_samples", "Samples taken from the device", sample.seq)
+
+        device_state = device.cached_state()
+        if device_state is not None:
+            w.stateset(
+                "shrpi_device_state",
+                "Last known device state",
+                (s.name for s in States),
+                device_state,
+            )
+        w.gauge(
+            "shrpi_watchdog_timeout",
+            "Device watchdog timeout, 0 if disabled",
+            config["watchdog_timeout"],
+            "seconds",
+        )
+        w.gauge(
+            "shrpi_power_on_threshold",
+            "Supercapacitor power-on threshold",
+            config["power_on_threshold"],
+            "volts",
+        )
+        w.gauge(
+            "shrpi_power_off_threshold",
+            "Supercapacitor power-off threshold",
+            config["power_off_threshold"],
+            "volts",
+        )
+
+        if self.status is not None:
+            w.stateset(
+                "shrpi_daemon_state",
+                "State of the daemon state machine",
+                STATES,
+                self.status.state,
+            )
+            w.counter("shrpi_blackouts", "Detected blackouts", self.status.blackouts)
+            w.counter(
+                "shrpi_power_resumed",
+                "Blackouts that ended before the time limit",
+                self.status.power_resumed,
+            )
+            w.counter(
+                "shrpi_blackout",
+                "Time spent in blackouts",
+                self.status.blackout_seconds + self.status.current_blackout_seconds(),
+                "seconds",
+            )
+            w.counter(
+                "shrpi_suppressed_blackouts",
+                "Input voltage dips shorter than the blackout dwell time",
+                self.status.suppressed_blackouts,
+            )
+            w.counter(
+                "shrpi_suppressed_power_resumed",
+                "Input voltage recoveries shorter than the resume dwell time",
+                self.status.suppressed_resumes,
+            )
+            w.gauge(
+                "shrpi_filtered_input_voltage",
+                "Input voltage after the blackout detection filter",
+                self.status.filtered_voltage,
+                "volts",
+            )
+            w.counter("shrpi_shutdowns", "Initiated shutdowns", self.status.shutdowns)
+
+        i2c = device.i2c
+        w.counter("shrpi_i2c_transactions", "I2C bus transactions", i2c.transactions)
+        w.counter("shrpi_i2c_errors", "Failed I2C bus transactions", i2c.errors)
+        w.counter("shrpi_i2c_reopens", "I2C bus handle reopens", i2c.reopens)
+        w.histogram(
+            "shrpi_i2c_transaction_duration",
+            "I2C bus transaction duration",
+            i2c.latency,
+            "seconds",
+        )
+        w.counter("shrpi_register_cache_hits", "Register cache hits", device.cache.hits)
+        w.counter(
+            "shrpi_register_cache_misses", "Register cache misses", device.cache.misses
+        )
+        if self.shutdown.hook_timings:
+            w.labeled_gauge(
+                "shrpi_shutdown_hook_duration",
+                "Run time of each pre-shutdown hook",
+                (
+                    ({"hook": t.name, "outcome": t.outcome}, t.duration)
+                    for t in self.shutdown.hook_timings
+                ),
+                "seconds",
+            )
+        if self.watchdog is not None:
+            w.gauge(
+                "shrpi_watchdog_elapsed",
+                "Time between the last watchdog feed and the bus transaction before",
+                self.watchdog.last_elapsed,
+                "seconds",
+            )
+            w.gauge(
+                "shrpi_watchdog_min_slack",
+                "Smallest margin to the watchdog timeout seen",
+                self.watchdog.min_slack,
+                "seconds",
+            )
+            w.counter(
+                "shrpi_watchdog_low_slack",
+                "Watchdog feeds with less slack than the warning threshold",
+                self.watchdog.low_slack_events,
+            )
+            w.gauge(
+                "shrpi_watchdog_heartbeat_age",
+                "Time since the state machine last showed the watchdog feeder it runs",
+                self.watchdog.heartbeat_age(),
+                "seconds",
+            )
+            w.counter(
+                "shrpi_watchdog_starved_feeds",
+                "Watchdog feeds skipped because the heartbeat was stale",
+                self.watchdog.starved_feeds,
+            )
+            w.counter(
+                "shrpi_watchdog_feed_errors",
+                "Failed watchdog feeds",
+                self.watchdog.errors,
+            )
+            w.histogram(
+                "shrpi_watchdog_feed_interval",
+                "Interval between watchdog feeds",
+                self.watchdog.feed_intervals,
+                "seconds",
+            )
+            w.histogram(
+                "shrpi_watchdog_elapsed_at_feed",
+                "Watchdog elapsed time read at each feed",
+                self.watchdog.elapsed,
+                "seconds",
+            )
+        cutoff = config["power_off_threshold"]
+        if self.estimator is not None and cutoff is not None:
+            w.gauge(
+                "shrpi_supercap_time_to_brownout",
+                "Projected time until the supercap drops to the power off threshold",
+                self.estimator.time_remaining(cutoff),
+                "seconds",
+            )
+            w.gauge(
+                "shrpi_supercap_energy_remaining",
+                "Projected usable energy in the supercap",
+                self.estimator.energy_remaining(cutoff),
+                "joules",
+            )
+            w.gauge(
+                "shrpi_load_power",
+                "Average power drawn while the input power is good",
+                self.estimator.load_power,
+                "watts",
+            )
+        if self.loop_lag is not None:
+            w.histogram(
+                "shrpi_event_loop_lag",
+                "Event loop wakeup delay",
+                self.loop_lag,
+                "seconds",
+            )
+
+        return web.Response(
+            body=w.render().encode(),
+            headers={"Content-Type": OpenMetricsWriter.CONTENT_TYPE},
+        )
+
+
+def routes(handlers: RouteHandlers, read_only: bool = False) -> List[web.RouteDef]:
+    """Return the route table. Read-only tables leave out all mutations."""
+    table = [
+        web.get("/", handlers.get_root),
+        web.get("/version", handlers.get_version),
+        web.get("/state", handlers.get_state),
+        web.get("/config", handlers.get_config),
+        web.get("/config/{key}", handlers.get_config_key),
+        web.get("/snapshot", handlers.get_snapshot),
+        web.get("/values", handlers.get_values),
+        web.get("/values/{key}", handlers.get_values_key),
+        web.get("/stream", handlers.get_stream),
+        web.get("/history", handlers.get_history),
+        web.get("/energy", handlers.get_energy),
+        web.get("/metrics", handlers.get_metrics),
+    ]
+    if not read_only:
+        table += [
+            web.post("/shutdown", handlers.post_shutdown),
+            web.post("/sleep", handlers.post_sleep),
+            web.patch("/config", handlers.patch_config),
+            web.put("/config/{key}", handlers.put_config_key),
+        ]
+    return table
+
+
+def add_device_apps(
+    app: web.Application,
+    devices: Sequence[ManagedDevice],
+    make_handlers: Callable[[ManagedDevice], RouteHandlers],
+    read_only: bool = False,
+    site: str = "",
+) -> None:
+    """Serve the API of each device at /devices/{id}/ and list them at /devices."""
+
+    async def get_devices(request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "id": managed.id,
+                    "bus": managed.config.bus,
+                    "addr": managed.config.addr,
+                    "state": managed.status.state,
+                }
+                for managed in devices
+            ]
+        )
+
+    app.router.add_get("/devices", get_devices)
+    for managed in devices:
+        handlers = make_handlers(managed)
+        handlers.shutdown.add_hook(
+            f"notify {site}stream clients ({managed.id})", handlers.notify_shutdown
+        )
+        device_app = web.Application()
+        device_app.add_routes(routes(handlers, read_only=read_only))
+        app.add_subapp(f"/devices/{managed.id}", device_app)
 
 
 async def run_http_server(
-    shrpi_device: shrpi.i2c.SHRPiDevice,
+    shrpi_device: AsyncSHRPiDevice,
+    sampler: Sampler,
     socket_path: pathlib.PosixPath,
     socket_group: int,
     poweroff: str,
+    history: Optional[TelemetryHistory] = None,
+    status: Optional[StateMachineStatus] = None,
+    loop_lag: Optional[Histogram] = None,
+    shutdown: Optional[ShutdownOrchestrator] = None,
+    watchdog: Optional[WatchdogFeeder] = None,
+    estimator: Optional[SupercapEstimator] = None,
+    devices: Sequence[ManagedDevice] = (),
 ) -> web.AppRunner:
-    """Run the HTTP server."""
+    """Run the HTTP server.
 
-    handlers = RouteHandlers(shrpi_device, poweroff_command=poweroff)
+    The top level routes serve `shrpi_device`; each of `devices` is also
+    served at /devices/{id}/.
+    """
+
+    handlers = RouteHandlers(
+        shrpi_device,
+        sampler,
+        poweroff_command=poweroff,
+        history=history,
+        status=status,
+        loop_lag=loop_lag,
+        shutdown=shutdown,
+        watchdog=watchdog,
+        estimator=estimator,
+    )
+    handlers.shutdown.add_hook("notify stream clients", handlers.notify_shutdown)
 
     app = web.Application()
-    app.add_routes(
-        [
-            web.get("/", handlers.get_root),
-            web.get("/version", handlers.get_version),
-            web.get("/state", handlers.get_state),
-            web.post("/shutdown", handlers.post_shutdown),
-            web.post("/sleep", handlers.post_sleep),
-            web.get("/config", handlers.get_config),
-            web.get("/config/{key}", handlers.get_config_key),
-            web.put("/config/{key}", handlers.put_config_key),
-            web.get("/values", handlers.get_values),
-            web.get("/values/{key}", handlers.get_values_key),
-        ]
+    app.add_routes(routes(handlers))
+    add_device_apps(
+        app,
+        devices,
+        lambda managed: RouteHandlers(
+            managed.async_device,
+            managed.sampler,
+            poweroff_command=poweroff,
+            status=managed.status,
+            loop_lag=loop_lag,
+            shutdown=handlers.shutdown,
+            watchdog=managed.watchdog,
+            estimator=managed.estimator,
+        ),
     )
 
     runner = web.AppRunner(app)
@@ -240,3 +1096,75 @@ async def run_http_server(
     os.chmod(str(socket_path), 0o660)  # nosec
 
     return runner
+
+
+async def run_tcp_server(
+    shrpi_device: AsyncSHRPiDevice,
+    sampler: Sampler,
+    host: str,
+    port: int,
+    ssl_context: Optional["ssl.SSLContext"] = None,
+    keepalive_timeout: float = shrpi.const.DEFAULT_TCP_KEEPALIVE_TIMEOUT,
+    max_connections: int = shrpi.const.DEFAULT_TCP_MAX_CONNECTIONS,
+    rate_limit: float = shrpi.const.DEFAULT_TCP_RATE_LIMIT,
+    rate_burst: float = shrpi.const.DEFAULT_TCP_RATE_BURST,
+    history: Optional[TelemetryHistory] = None,
+    status: Optional[StateMachineStatus] = None,
+    loop_lag: Optional[Histogram] = None,
+    shutdown: Optional[ShutdownOrchestrator] = None,
+    watchdog: Optional[WatchdogFeeder] = None,
+    estimator: Optional[SupercapEstimator] = None,
+    devices: Sequence[ManagedDevice] = (),
+    guard: Optional[TCPGuard] = None,
+) -> web.AppRunner:
+    """Run a read-only HTTP server on a TCP port for remote monitoring.
+
+    The TCP site has no access control, so it doesn't accept shutdown, sleep
+    or configuration requests; those stay on the UNIX socket. A `guard`
+    given by the caller overrides the connection and rate limits, and can be
+    reconfigured while the server runs.
+    """
+
+    handlers = RouteHandlers(
+        shrpi_device,
+        sampler,
+        poweroff_command="",
+        history=history,
+        status=status,
+        loop_lag=loop_lag,
+        shutdown=shutdown,
+        watchdog=watchdog,
+        estimator=estimator,
+    )
+    handlers.shutdown.add_hook("notify TCP stream clients", handlers.notify_shutdown)
+    if guard is None:
+        guard = TCPGuard(max_connections, rate_limit, rate_burst)
+
+    app = web.Application(middlewares=[guard.middleware])
+    app.add_routes(routes(handlers, read_only=True))
+    add_device_apps(
+        app,
+        devices,
+        lambda managed: RouteHandlers(
+            managed.async_device,
+            managed.sampler,
+            poweroff_command="",
+            status=managed.status,
+            loop_lag=loop_lag,
+            shutdown=handlers.shutdown,
+            watchdog=managed.watchdog,
+            estimator=managed.estimator,
+        ),
+        read_only=True,
+        site="TCP ",
+    )
+
+    runner = web.AppRunner(app, keepalive_timeout=keepalive_timeout)
+    await runner.setup()
+    guard.server = runner.server
+    site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+    await site.start()
+    scheme = "https" if ssl_context is not None else "http"
+    logger.info(f"Serving read-only API on {scheme}://{host}:{port}")
+
+    return runner
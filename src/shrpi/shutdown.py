@@ -0,0 +1,294 @@
+"""Asynchronous system shutdown shared by the state machine and the API."""
+
+import asyncio
+import os
+import shlex
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.const import (
+    DEFAULT_POWEROFF_TIMEOUT,
+    DEFAULT_SHUTDOWN_HOOK_TIMEOUT,
+    DEFAULT_SHUTDOWN_RESERVE,
+)
+from shrpi.energy import SupercapEstimator
+
+ShutdownHook = Callable[[], Awaitable[None]]
+
+# How often the energy budget is re-evaluated while the hooks run, in seconds
+BUDGET_CHECK_INTERVAL = 0.1
+
+
+def poweroff_command(poweroff: str) -> List[str]:
+    """Build the argument list of the poweroff command.
+
+    sudo is only needed if the daemon isn't running as root.
+
+    Examples:
+        >>> poweroff_command("/sbin/poweroff --no-wall")[-2:]
+        ['/sbin/poweroff', '--no-wall']
+    """
+    args = shlex.split(poweroff)
+    if os.geteuid() != 0:
+        args.insert(0, "sudo")
+    return args
+
+
+def command_hook(command: str) -> ShutdownHook:
+    """Make a shutdown hook that runs a shell-style command.
+
+    The command is killed if the hook times out or is aborted.
+    """
+    args = shlex.split(command)
+
+    async def hook() -> None:
+        proc = await asyncio.create_subprocess_exec(*args)
+        try:
+            returncode = await proc.wait()
+        except asyncio.CancelledError:
+            proc.kill()
+            raise
+        if returncode != 0:
+            raise RuntimeError(f"{args[0]} exited with status {returncode}")
+
+    return hook
+
+
+def add_command_hooks(shutdown: "ShutdownOrchestrator", entries: Sequence[Any]) -> None:
+    """Register the command hooks given in the configuration.
+
+    Each entry is either a command or a mapping with the key `command` and
+    optionally `name`, `timeout` and `after`.
+
+    Examples:
+        >>> shutdown = ShutdownOrchestrator(None)
+        >>> add_command_hooks(shutdown, [
+        ...     "docker stop --time 5 signalk",
+        ...     {"name": "sync", "command": "sync", "after": ["docker"]},
+        ... ])
+        >>> [(spec.name, spec.after) for spec in shutdown.hooks]
+        [('docker', ()), ('sync', ('docker',))]
+    """
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"command": entry}
+        if not isinstance(entry, dict) or "command" not in entry:
+            raise ValueError(f"Invalid shutdown hook: {entry!r}")
+        command = str(entry["command"])
+        after = entry.get("after", ())
+        shutdown.add_hook(
+            str(entry.get("name", shlex.split(command)[0])),
+            command_hook(command),
+            timeout=entry.get("timeout"),
+            after=[after] if isinstance(after, str) else after,
+        )
+
+
+class HookSpec(NamedTuple):
+    """A registered pre-shutdown hook."""
+
+    name: str
+    hook: ShutdownHook
+    timeout: Optional[float]
+    after: Tuple[str, ...]
+
+
+class HookTiming(NamedTuple):
+    """Outcome of a pre-shutdown hook: ok, failed, timeout, aborted or skipped."""
+
+    name: str
+    outcome: str
+    start: float
+    duration: float
+
+
+class ShutdownOrchestrator:
+    """Run the pre-shutdown hooks, inform the device and power off the system.
+
+    The shutdown runs at most once no matter how many times it is requested,
+    and nothing in it blocks the event loop, so the HTTP server and the
+    watchdog keep running until the power goes away.
+
+    All the devices are told about the shutdown, so that each of them cuts
+    its power. Hooks run concurrently unless they are ordered with `after`. If a
+    supercap estimator is given, the hooks that are still running are aborted
+    when the projected supercap runtime drops below `reserve` seconds, so
+    that there is energy left to power off cleanly.
+    """
+
+    def __init__(
+        self,
+        shrpi_device: AsyncSHRPiDevice,
+        poweroff: str = "/sbin/poweroff",
+        dry_run: bool = False,
+        hook_timeout: float = DEFAULT_SHUTDOWN_HOOK_TIMEOUT,
+        poweroff_timeout: float = DEFAULT_POWEROFF_TIMEOUT,
+        estimator: Optional[SupercapEstimator] = None,
+        reserve: float = DEFAULT_SHUTDOWN_RESERVE,
+        other_devices: Sequence[AsyncSHRPiDevice] = (),
+    ):
+        self.shrpi_device = shrpi_device
+        self.other_devices = other_devices
+        self.poweroff = poweroff
+        self.dry_run = dry_run
+        self.hook_timeout = hook_timeout
+        self.poweroff_timeout = poweroff_timeout
+        self.estimator = estimator
+        self.reserve = reserve
+        self.hooks: List[HookSpec] = []
+        self.hook_timings: List[HookTiming] = []
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def add_hook(
+        self,
+        name: str,
+        hook: ShutdownHook,
+        timeout: Optional[float] = None,
+        after: Sequence[str] = (),
+    ) -> None:
+        """Register a coroutine function to run before powering off.
+
+        The hook starts once all the hooks named in `after` have finished.
+        `timeout` overrides the default hook timeout.
+        """
+        names = {spec.name for spec in self.hooks}
+        if name in names:
+            raise ValueError(f"Duplicate shutdown hook '{name}'")
+        unknown = set(after) - names
+        if unknown:
+            raise ValueError(
+                f"Shutdown hook '{name}' is after unknown hooks: "
+                f"{', '.join(sorted(unknown))}"
+            )
+        self.hooks.append(HookSpec(name, hook, timeout, tuple(after)))
+
+    @property
+    def in_progress(self) -> bool:
+        return self._task is not None
+
+    def request(self, reason: str) -> "asyncio.Task[None]":
+        """Start the shutdown unless it's already running.
+
+        Returns the shutdown task; callers don't need to wait for it.
+        """
+        if self._task is None:
+            logger.warning(f"Shutting down: {reason}")
+            self._task = asyncio.ensure_future(self._run())
+        else:
+            logger.info(f"Shutdown already in progress, ignoring: {reason}")
+        return self._task
+
+    def _record(self, spec: HookSpec, outcome: str, start: float) -> None:
+        duration = time.monotonic() - start
+        self.hook_timings.append(HookTiming(spec.name, outcome, start, duration))
+        logger.info(f"Shutdown hook '{spec.name}': {outcome} in {duration:.3f} s")
+
+    async def _run_hook(self, spec: HookSpec) -> None:
+        timeout = self.hook_timeout if spec.timeout is None else spec.timeout
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(spec.hook(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Shutdown hook '{spec.name}' timed out")
+            self._record(spec, "timeout", start)
+        except asyncio.CancelledError:
+            self._record(spec, "aborted", start)
+            raise
+        except Exception as e:
+            logger.error(f"Shutdown hook '{spec.name}' failed: {e!s}")
+            self._record(spec, "failed", start)
+        else:
+            self._record(spec, "ok", start)
+
+    async def _time_budget(self) -> Optional[float]:
+        """Seconds left for the hooks, or None if there's no energy limit."""
+        if self.estimator is None:
+            return None
+        try:
+            cutoff = await self.shrpi_device.power_off_threshold()
+        except OSError:
+            return None
+        remaining = self.estimator.time_remaining(cutoff)
+        if remaining is None:
+            return None
+        return remaining - self.reserve
+
+    async def _run_hooks(self) -> None:
+        waiting = list(self.hooks)
+        finished: Set[str] = set()
+        running: Dict["asyncio.Future[Any]", HookSpec] = {}
+        while True:
+            for spec in [s for s in waiting if finished.issuperset(s.after)]:
+                waiting.remove(spec)
+                running[asyncio.ensure_future(self._run_hook(spec))] = spec
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(
+                running, timeout=BUDGET_CHECK_INTERVAL, return_when="FIRST_COMPLETED"
+            )
+            for task in done:
+                finished.add(running.pop(task).name)
+
+            budget = await self._time_budget()
+            if budget is not None and budget <= 0:
+                logger.error(
+                    "Supercap energy is running out, aborting shutdown hooks: "
+                    f"{', '.join(spec.name for spec in running.values())}"
+                )
+                for task in running:
+                    task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+                now = time.monotonic()
+                for spec in waiting:
+                    self._record(spec, "skipped", now)
+                break
+
+    async def _run(self) -> None:
+        await self._run_hooks()
+
+        if self.dry_run:
+            logger.warning(f"Would execute {self.poweroff}")
+            return
+
+        # inform the hats about this sad state of affairs
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(device.request_shutdown(), self.hook_timeout)
+                for device in (self.shrpi_device, *self.other_devices)
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, (asyncio.TimeoutError, OSError)):
+                logger.error(f"Failed to request shutdown from the device: {result!r}")
+            elif isinstance(result, BaseException):
+                raise result
+
+        args = poweroff_command(self.poweroff)
+        logger.info(f"Executing {shlex.join(args)}")
+        try:
+            proc = await asyncio.create_subprocess_exec(*args)
+            returncode = await asyncio.wait_for(proc.wait(), self.poweroff_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self.poweroff} is still running")
+            return
+        except OSError as e:
+            logger.error(f"Failed to execute {self.poweroff}: {e!s}")
+            return
+        if returncode != 0:
+            logger.error(f"{self.poweroff} exited with status {returncode}")
@@ -0,0 +1,309 @@
+"""Simulated SH-RPi device for testing and benchmarking without hardware.
+
+`SimulatedSHRPi` emulates the register map of the v1 and v2 firmware and
+`SimulatedSMBus` exposes it through the subset of the smbus2 API used by
+`shrpi.i2c`. Pass `SimulatedSHRPi.bus_factory` to `SHRPiDevice.factory`:
+
+    >>> from shrpi.i2c import SHRPiDevice
+    >>> sim = SimulatedSHRPi(version=2, dcin_voltage=12.0)
+    >>> device = SHRPiDevice.factory(1, 0x6D, bus_factory=sim.bus_factory)
+    >>> device.firmware_version()
+    '2.1.0'
+    >>> round(device.read_measurements().dcin_voltage, 2)
+    12.0
+"""
+
+import bisect
+import errno
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple, Union
+
+from smbus2 import SMBus
+
+from shrpi.const import I2C_ADDR
+from shrpi.i2c import States
+
+# Full scale values of the analog registers: (v1, v2)
+DCIN_MAX = (32.1, 32.1)
+VCAP_MAX = (2.75, 9.35)
+I_MAX = (0.0, 2.5)
+TEMP_MAX = (0.0, 512.0)
+
+# Default supercap voltage and power-on/off thresholds: (v1, v2)
+DEFAULT_SUPERCAP_VOLTAGE = (2.5, 8.0)
+DEFAULT_POWER_ON_THRESHOLD = (2.3, 8.0)
+DEFAULT_POWER_OFF_THRESHOLD = (2.0, 5.5)
+
+
+def piecewise_linear(points: Sequence[Tuple[float, float]]) -> Callable[[float], float]:
+    """Build a trace that interpolates linearly between (time, value) points.
+
+    Examples:
+        >>> trace = piecewise_linear([(0.0, 12.0), (1.0, 12.0), (2.0, 0.0)])
+        >>> trace(0.5), trace(1.5), trace(10.0)
+        (12.0, 6.0, 0.0)
+    """
+    times = [t for t, _ in points]
+    values = [v for _, v in points]
+
+    def trace(t: float) -> float:
+        i = bisect.bisect_right(times, t)
+        if i == 0:
+            return values[0]
+        if i == len(times):
+            return values[-1]
+        t0, t1 = times[i - 1], times[i]
+        v0, v1 = values[i - 1], values[i]
+        return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+    return trace
+
+
+class SimulatedSHRPi:
+    """Register map emulation of an SH-RPi device.
+
+    Args:
+        version: Emulated hardware and firmware major version, 1 or 2.
+        addr: I2C address the device responds to.
+        latency: Time in seconds each bus transaction takes.
+        error_rate: Probability of a transaction failing with EIO.
+        dcin_trace: Input voltage as a function of time since creation.
+            Overrides `dcin_voltage` if given.
+        supercap_trace: Supercap voltage as a function of time since creation.
+            Overrides `supercap_voltage` if given.
+    """
+
+    def __init__(
+        self,
+        version: int = 2,
+        addr: int = I2C_ADDR,
+        dcin_voltage: float = 12.0,
+        supercap_voltage: Optional[float] = None,
+        input_current: float = 0.5,
+        temperature: float = 310.0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        dcin_trace: Optional[Callable[[float], float]] = None,
+        supercap_trace: Optional[Callable[[float], float]] = None,
+        seed: Optional[int] = None,
+    ):
+        if version not in (1, 2):
+            raise ValueError("Simulated version must be 1 or 2")
+        self.version = version
+        self.addr = addr
+        self.dcin_voltage = dcin_voltage
+        self.supercap_voltage = (
+            DEFAULT_SUPERCAP_VOLTAGE[version - 1]
+            if supercap_voltage is None
+            else supercap_voltage
+        )
+        self.input_current = input_current
+        self.temperature = temperature
+        self.latency = latency
+        self.error_rate = error_rate
+        self.dcin_trace = dcin_trace
+        self.supercap_trace = supercap_trace
+
+        self.en5v = True
+        self.watchdog_timeout = 0.0
+        self.power_on_threshold = DEFAULT_POWER_ON_THRESHOLD[version - 1]
+        self.power_off_threshold = DEFAULT_POWER_OFF_THRESHOLD[version - 1]
+        self.led_brightness = 128
+        self.state = States.POWER_ON_5V_ON
+
+        self.transactions = 0
+        self.errors = 0
+        self._fail_next = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._last_transaction = self._t0
+        self._watchdog_elapsed = 0.0
+
+    def bus_factory(self, bus: int) -> "SimulatedSMBus":
+        return SimulatedSMBus(self, bus)
+
+    def fail_next(self, n: int = 1) -> None:
+        """Make the next `n` transactions fail with EIO."""
+        self._fail_next += n
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._t0
+
+    def _transaction(self, addr: int) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.transactions += 1
+            if addr != self.addr:
+                self.errors += 1
+                raise OSError(errno.ENXIO, "No such device or address")
+            if self._fail_next > 0 or (
+                self.error_rate and self._random.random() < self.error_rate
+            ):
+                self._fail_next = max(0, self._fail_next - 1)
+                self.errors += 1
+                raise OSError(errno.EIO, "Input/output error")
+            # any successful transaction feeds the watchdog
+            now = time.monotonic()
+            self._watchdog_elapsed = now - self._last_transaction
+            self._last_transaction = now
+
+    def _analog(self, value: float, full_scale: Tuple[float, float]) -> List[int]:
+        scale = full_scale[self.version - 1]
+        if self.version == 1:
+            return [min(255, max(0, int(256 * value / scale)))] if scale else [0]
+        raw = min(0xFFFF, max(0, int(65536 * value / scale))) if scale else 0
+        return [raw >> 8, raw & 0xFF]
+
+    def _from_analog(
+        self, vals: Sequence[int], full_scale: Tuple[float, float]
+    ) -> float:
+        scale = full_scale[self.version - 1]
+        if self.version == 1:
+            return scale * vals[0] / 256
+        return scale * (vals[0] << 8 | vals[1]) / 65536
+
+    def _register(self, reg: int) -> List[int]:
+        """Return the contents of a register as bytes."""
+        t = self.elapsed()
+        v1 = self.version == 1
+        if reg == 0x01:
+            return [0x03 if v1 else 0xFF]
+        if reg == 0x02:
+            return [0x05 if v1 else 0xFF]
+        if reg == 0x03:
+            return [0xFF] * 4 if v1 else [2, 0, 0, 0xFF]
+        if reg == 0x04:
+            return [0xFF] * 4 if v1 else [2, 1, 0, 0xFF]
+        if reg == 0x10:
+            return [int(self.en5v)]
+        if reg == 0x12:
+            if v1:
+                return [min(255, int(10 * self.watchdog_timeout))]
+            ms = int(1000 * self.watchdog_timeout)
+            return [ms >> 8, ms & 0xFF]
+        if reg == 0x13:
+            return self._analog(self.power_on_threshold, VCAP_MAX)
+        if reg == 0x14:
+            return self._analog(self.power_off_threshold, VCAP_MAX)
+        if reg == 0x15:
+            return [self.state.value]
+        if reg == 0x16:
+            return [min(255, int(10 * self._watchdog_elapsed))]
+        if reg == 0x17 and not v1:
+            return [self.led_brightness]
+        if reg == 0x20:
+            dcin = self.dcin_trace(t) if self.dcin_trace else self.dcin_voltage
+            return self._analog(dcin, DCIN_MAX)
+        if reg == 0x21:
+            vcap = (
+                self.supercap_trace(t) if self.supercap_trace else self.supercap_voltage
+            )
+            return self._analog(vcap, VCAP_MAX)
+        if reg == 0x22 and not v1:
+            return self._analog(self.input_current, I_MAX)
+        if reg == 0x23 and not v1:
+            return self._analog(self.temperature, TEMP_MAX)
+        return [0xFF]
+
+    def read(self, addr: int, reg: int, n: int) -> List[int]:
+        self._transaction(addr)
+        # multi-byte reads continue into the following registers
+        data: List[int] = []
+        while len(data) < n:
+            data += self._register(reg)
+            reg += 1
+        return data[:n]
+
+    def write(self, addr: int, reg: int, vals: Sequence[int]) -> None:
+        self._transaction(addr)
+        # like the bus, pass on the low byte of each value
+        vals = [val & 0xFF for val in vals]
+        v1 = self.version == 1
+        if reg == 0x12:
+            if v1:
+                self.watchdog_timeout = vals[0] / 10
+            else:
+                self.watchdog_timeout = (vals[0] << 8 | vals[1]) / 1000
+        elif reg == 0x13:
+            self.power_on_threshold = self._from_analog(vals, VCAP_MAX)
+        elif reg == 0x14:
+            self.power_off_threshold = self._from_analog(vals, VCAP_MAX)
+        elif reg == 0x17 and not v1:
+            self.led_brightness = vals[0]
+        elif reg == 0x30 and vals[0] == 0x01:
+            self.state = States.SHUTDOWN
+        elif reg == 0x31 and vals[0] == 0x01 and not v1:
+            self.state = States.SLEEP_SHUTDOWN
+
+
+class SimulatedBus:
+    """Several simulated devices sharing one bus.
+
+    Examples:
+        >>> bus = SimulatedBus([SimulatedSHRPi(addr=0x6D), SimulatedSHRPi(addr=0x6E)])
+        >>> bus.read(0x6E, 0x04, 1)
+        [2]
+    """
+
+    def __init__(self, devices: Sequence[SimulatedSHRPi]):
+        self.devices = {device.addr: device for device in devices}
+
+    def bus_factory(self, bus: int) -> "SimulatedSMBus":
+        return SimulatedSMBus(self, bus)
+
+    def _device(self, addr: int) -> SimulatedSHRPi:
+        try:
+            return self.devices[addr]
+        except KeyError:
+            raise OSError(errno.ENXIO, "No such device or address")
+
+    def read(self, addr: int, reg: int, n: int) -> List[int]:
+        return self._device(addr).read(addr, reg, n)
+
+    def write(self, addr: int, reg: int, vals: Sequence[int]) -> None:
+        self._device(addr).write(addr, reg, vals)
+
+
+class SimulatedSMBus(SMBus):
+    """Drop-in replacement for `smbus2.SMBus` backed by a simulated device."""
+
+    def __init__(self, device: Union[SimulatedSHRPi, SimulatedBus], bus: int = 1):
+        # don't open a real bus device
+        super().__init__()
+        self.device = device
+        self.bus = bus
+
+    def read_byte_data(
+        self, i2c_addr: int, register: int, force: Optional[bool] = None
+    ) -> int:
+        return self.device.read(i2c_addr, register, 1)[0]
+
+    def read_i2c_block_data(
+        self,
+        i2c_addr: int,
+        register: int,
+        length: int,
+        force: Optional[bool] = None,
+    ) -> List[int]:
+        return self.device.read(i2c_addr, register, length)
+
+    def write_byte_data(
+        self, i2c_addr: int, register: int, value: int, force: Optional[bool] = None
+    ) -> None:
+        self.device.write(i2c_addr, register, [value])
+
+    def write_i2c_block_data(
+        self,
+        i2c_addr: int,
+        register: int,
+        data: Sequence[int],
+        force: Optional[bool] = None,
+    ) -> None:
+        self.device.write(i2c_addr, register, data)
+
+    def close(self) -> None:
+        pass
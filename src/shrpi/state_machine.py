@@ -1,57 +1,269 @@
-import asyncio
 import time
-from subprocess import check_call
+from typing import Callable, Optional, Sequence
 
 from loguru import logger
 
-from shrpi.i2c import SHRPiDevice
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.const import (
+    DEFAULT_ADAPTIVE_MARGIN,
+    DEFAULT_BLACKOUT_ENTER_DWELL,
+    DEFAULT_BLACKOUT_EXIT_DWELL,
+    DEFAULT_BLACKOUT_FILTER,
+    DEFAULT_BLACKOUT_FILTER_WINDOW,
+    DEFAULT_BLACKOUT_HYSTERESIS,
+    DEFAULT_SAMPLE_INTERVAL,
+    DEFAULT_SLOW_SAMPLE_INTERVAL,
+    DEFAULT_WATCHDOG_TIMEOUT,
+)
+from shrpi.energy import SupercapEstimator
+from shrpi.sampler import Sampler, adaptive_interval
+from shrpi.shutdown import ShutdownOrchestrator
+from shrpi.voltage_filter import VoltageFilter
+
+STATES = ("START", "OK", "BLACKOUT", "SHUTDOWN", "DEAD")
+
+# States in which the supercap is assumed to discharge
+DISCHARGE_STATES = ("BLACKOUT", "SHUTDOWN", "DEAD")
+
+# With several devices, shut down after a blackout on any of them, or only
+# when all of them are blacked out (redundant supplies)
+BLACKOUT_POLICIES = ("any", "all")
+
+
+class StateMachineStatus:
+    """Current state of the state machine and counters of its transitions."""
+
+    def __init__(self) -> None:
+        self.state = "START"
+        self.blackouts = 0
+        self.power_resumed = 0
+        self.shutdowns = 0
+        # blackouts and power resumptions that didn't last the dwell time
+        self.suppressed_blackouts = 0
+        self.suppressed_resumes = 0
+        # time spent in blackouts that have ended, in seconds
+        self.blackout_seconds = 0.0
+        self.blackout_time = 0.0
+        self.filtered_voltage: Optional[float] = None
+
+    def current_blackout_seconds(self) -> float:
+        """Duration of the ongoing blackout, or 0 if the power is good."""
+        if self.state != "BLACKOUT":
+            return 0.0
+        return time.time() - self.blackout_time
+
+
+class StateMachineSettings:
+    """Blackout limits and polling intervals of the state machine.
+
+    The state machine reads the settings for every sample, so changes take
+    effect while it runs. If `shutdown_budget` is set, a blackout leads to a
+    shutdown once the projected supercap runtime drops below that many
+    seconds, instead of after `blackout_time_limit`. The time limit still
+    applies whenever there is no projection, e.g. early in the blackout or
+    when the supercap voltage doesn't fall.
+
+    The input voltage is filtered before it is compared with the limits. A
+    blackout starts when it stays below `blackout_voltage_limit` for
+    `enter_dwell` seconds and ends when it stays above the limit plus
+    `hysteresis` for `exit_dwell` seconds.
+
+    With the "all" `blackout_policy`, a device whose shutdown is due waits
+    in the blackout until the other devices have lost their power, too.
+    """
+
+    def __init__(
+        self,
+        blackout_time_limit: float,
+        blackout_voltage_limit: float,
+        fast_interval: float = DEFAULT_SAMPLE_INTERVAL,
+        slow_interval: float = DEFAULT_SLOW_SAMPLE_INTERVAL,
+        adaptive_margin: float = DEFAULT_ADAPTIVE_MARGIN,
+        shutdown_budget: Optional[float] = None,
+        filter_kind: str = DEFAULT_BLACKOUT_FILTER,
+        filter_window: int = DEFAULT_BLACKOUT_FILTER_WINDOW,
+        hysteresis: float = DEFAULT_BLACKOUT_HYSTERESIS,
+        enter_dwell: float = DEFAULT_BLACKOUT_ENTER_DWELL,
+        exit_dwell: float = DEFAULT_BLACKOUT_EXIT_DWELL,
+        blackout_policy: str = "any",
+    ):
+        self.blackout_time_limit = blackout_time_limit
+        self.blackout_voltage_limit = blackout_voltage_limit
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.adaptive_margin = adaptive_margin
+        self.shutdown_budget = shutdown_budget
+        self.filter_kind = filter_kind
+        self.filter_window = filter_window
+        self.hysteresis = hysteresis
+        self.enter_dwell = enter_dwell
+        self.exit_dwell = exit_dwell
+        self.blackout_policy = blackout_policy
 
 
 async def run_state_machine(
-    shrpi_device: SHRPiDevice,
+    shrpi_device: AsyncSHRPiDevice,
+    sampler: Sampler,
     blackout_time_limit: float,
     blackout_voltage_limit: float,
     dry_run: bool = False,
     poweroff: str = "/sbin/poweroff",
+    fast_interval: float = DEFAULT_SAMPLE_INTERVAL,
+    slow_interval: float = DEFAULT_SLOW_SAMPLE_INTERVAL,
+    adaptive_margin: float = DEFAULT_ADAPTIVE_MARGIN,
+    status: Optional[StateMachineStatus] = None,
+    shutdown: Optional[ShutdownOrchestrator] = None,
+    watchdog_timeout: float = DEFAULT_WATCHDOG_TIMEOUT,
+    name: str = "",
+    settings: Optional[StateMachineSettings] = None,
+    estimator: Optional[SupercapEstimator] = None,
+    heartbeat: Optional[Callable[[], None]] = None,
+    others: Sequence[StateMachineStatus] = (),
 ) -> None:
-    state = "START"
-    blackout_time = 0.0
+    """Follow the input power and shut down after a long enough blackout.
+
+    If `settings` is given, it overrides the limits and intervals passed as
+    arguments. The samples are also fed to the supercap `estimator`, which
+    the energy based shutdown decision needs. `heartbeat` is called for
+    every sample to show the watchdog feeder that the state machine runs.
+    `others` are the statuses of the other devices, which the "all" blackout
+    policy checks before shutting down.
+    """
+    # with several devices, tell in the log which one is affected
+    prefix = f"{name}: " if name else ""
+    if settings is None:
+        settings = StateMachineSettings(
+            blackout_time_limit,
+            blackout_voltage_limit,
+            fast_interval,
+            slow_interval,
+            adaptive_margin,
+        )
+    if status is None:
+        status = StateMachineStatus()
+    if shutdown is None:
+        shutdown = ShutdownOrchestrator(shrpi_device, poweroff, dry_run)
+    seq = 0
+    reason = ""
+    # the shutdown is due but held off by the blackout policy
+    holding = False
+    voltage_filter = VoltageFilter(settings.filter_kind, settings.filter_window)
+    # time when the filtered voltage crossed a limit, until the crossing has
+    # lasted the dwell time
+    crossed_at: Optional[float] = None
 
     while True:
-        # TODO: Provide facilities for reporting the states and voltages
-        # en5v_state = dev.en5v_state()
-        # dev_state = dev.state()
-        dcin_voltage = shrpi_device.dcin_voltage()
-        # supercap_voltage = dev.supercap_voltage()
+        # advance once per published sample
+        sample = await sampler.wait_for_sample(seq)
+        seq = sample.seq
+        if heartbeat is not None:
+            heartbeat()
+        now = sample.timestamp
+        dcin_voltage = sample.measurements.dcin_voltage
+        blackout_time_limit = settings.blackout_time_limit
+        blackout_voltage_limit = settings.blackout_voltage_limit
+        if (voltage_filter.kind, voltage_filter.window) != (
+            settings.filter_kind,
+            settings.filter_window,
+        ):
+            voltage_filter = VoltageFilter(settings.filter_kind, settings.filter_window)
+        filtered_voltage = voltage_filter.update(dcin_voltage)
+        status.filtered_voltage = filtered_voltage
+        if estimator is not None:
+            if status.state in DISCHARGE_STATES:
+                # the fit carries on through the hysteresis band and the
+                # pre-shutdown hooks, which need the runtime projection
+                estimator.observe(now, sample.measurements, blackout=True)
+            elif status.state == "OK" and filtered_voltage >= blackout_voltage_limit:
+                estimator.observe(now, sample.measurements, blackout=False)
 
+        state = status.state
         if state == "START":
-            shrpi_device.set_watchdog_timeout(10)
+            await shrpi_device.set_watchdog_timeout(watchdog_timeout)
             state = "OK"
         elif state == "OK":
-            if dcin_voltage < blackout_voltage_limit:
-                logger.warning("Detected blackout")
-                blackout_time = time.time()
-                state = "BLACKOUT"
+            if filtered_voltage < blackout_voltage_limit:
+                if crossed_at is None:
+                    crossed_at = now
+                if now - crossed_at >= settings.enter_dwell:
+                    logger.warning(f"{prefix}Detected blackout")
+                    # the blackout started when the voltage first dropped
+                    status.blackout_time = crossed_at
+                    status.blackouts += 1
+                    crossed_at = None
+                    state = "BLACKOUT"
+            elif crossed_at is not None:
+                logger.debug(f"{prefix}Ignoring a short dip below the blackout limit")
+                status.suppressed_blackouts += 1
+                crossed_at = None
         elif state == "BLACKOUT":
-            if dcin_voltage > blackout_voltage_limit:
-                logger.info("Power resumed")
-                state = "OK"
-            elif time.time() - blackout_time > blackout_time_limit:
-                # didn't get power back in time
-                logger.warning(
-                    f"Blacked out for {blackout_time_limit} s, shutting down"
-                )
-                state = "SHUTDOWN"
-        elif state == "SHUTDOWN":
-            if dry_run:
-                logger.warning(f"Would execute {poweroff}")
+            resuming = filtered_voltage > blackout_voltage_limit + settings.hysteresis
+            if not resuming and crossed_at is not None:
+                logger.debug(f"{prefix}Ignoring a short power resumption")
+                status.suppressed_resumes += 1
+                crossed_at = None
+            if resuming:
+                if crossed_at is None:
+                    crossed_at = now
+                if now - crossed_at >= settings.exit_dwell:
+                    logger.info(f"{prefix}Power resumed")
+                    holding = False
+                    status.blackout_seconds += now - status.blackout_time
+                    status.power_resumed += 1
+                    crossed_at = None
+                    state = "OK"
             else:
-                # inform the hat about this sad state of affairs
-                shrpi_device.request_shutdown()
-                logger.info(f"Executing {poweroff}")
-                check_call(["sudo", poweroff])
+                due = ""
+                remaining: Optional[float] = None
+                if settings.shutdown_budget is not None and estimator is not None:
+                    remaining = estimator.time_remaining(
+                        await shrpi_device.power_off_threshold()
+                    )
+                if remaining is not None and settings.shutdown_budget is not None:
+                    if remaining < settings.shutdown_budget:
+                        due = (
+                            f"supercap runtime projected at {remaining:.1f} s, "
+                            f"below {settings.shutdown_budget} s"
+                        )
+                elif time.time() - status.blackout_time > blackout_time_limit:
+                    # didn't get power back in time, or there is no runtime
+                    # projection to go by
+                    due = f"blackout longer than {blackout_time_limit} s"
+                powered = [
+                    other for other in others if other.state not in DISCHARGE_STATES
+                ]
+                if due and settings.blackout_policy == "all" and powered:
+                    if not holding:
+                        logger.warning(
+                            f"{prefix}{due.capitalize()}, but {len(powered)} other "
+                            "device(s) still have power; not shutting down"
+                        )
+                        holding = True
+                elif due:
+                    logger.warning(f"{prefix}{due.capitalize()}, shutting down")
+                    reason = due
+                    state = "SHUTDOWN"
+        elif state == "SHUTDOWN":
+            status.shutdowns += 1
+            # runs in the background so that the samples keep flowing
+            shutdown.request(f"{prefix}{reason}")
             state = "DEAD"
         elif state == "DEAD":
             # just wait for the inevitable
             pass
-        await asyncio.sleep(0.1)
+        status.state = state
+
+        # Poll slowly while the power is good and speed up when the input
+        # voltage approaches the blackout limit
+        if state == "OK":
+            sampler.set_interval(
+                adaptive_interval(
+                    dcin_voltage,
+                    blackout_voltage_limit,
+                    settings.adaptive_margin,
+                    settings.fast_interval,
+                    settings.slow_interval,
+                )
+            )
+        else:
+            sampler.set_interval(settings.fast_interval)
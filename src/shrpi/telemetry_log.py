@@ -0,0 +1,170 @@
+"""Persistent, append-only log of the measurements.
+
+The log is a directory of segment files. Each segment starts with a magic
+header followed by fixed-size little-endian records of a timestamp and the
+four measurement values (NaN if not available). Records are buffered in
+memory and written in batches to keep the SD card writes infrequent.
+
+This module only depends on the standard library so that the CLI can read
+the log without importing the daemon.
+"""
+
+import math
+import mmap
+import os
+import pathlib
+import struct
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+SEGMENT_MAGIC = b"SHRPTLM1"
+
+# timestamp, V_in, V_supercap, I_in, T_mcu
+RECORD_FORMAT = struct.Struct("<dffff")
+
+# Number of records in a segment before the log rotates to a new one
+DEFAULT_SEGMENT_RECORDS = 43200  # 12 hours at 1 Hz, about 1 MB
+
+# Number of segments kept on disk; the oldest ones are deleted
+DEFAULT_MAX_SEGMENTS = 14
+
+Record = Tuple[
+    float, Optional[float], Optional[float], Optional[float], Optional[float]
+]
+
+
+def _segment_name(index: int) -> str:
+    return f"segment-{index:08d}.tlm"
+
+
+def list_segments(directory: pathlib.Path) -> List[Tuple[int, pathlib.Path]]:
+    """Return the (index, path) pairs of the segments, oldest first."""
+    segments = []
+    for path in directory.glob("segment-*.tlm"):
+        try:
+            segments.append((int(path.stem.split("-")[1]), path))
+        except ValueError:
+            continue
+    return sorted(segments)
+
+
+class TelemetryLog:
+    """Writer for the segmented telemetry log."""
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        segment_records: int = DEFAULT_SEGMENT_RECORDS,
+        max_segments: int = DEFAULT_MAX_SEGMENTS,
+    ):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self._pending = bytearray()
+        # reentrant, since the SIGTERM handler flushes on the loop thread,
+        # possibly while it is in append
+        self._lock = threading.RLock()
+        # flushes can come from the periodic job and the shutdown paths at
+        # the same time; the segment files are written by one at a time
+        self._flush_lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = list_segments(self.directory)
+        self._segment_index = segments[-1][0] if segments else 0
+        self._segment_count = self._records_in(self._segment_path())
+
+    def _segment_path(self) -> pathlib.Path:
+        return self.directory / _segment_name(self._segment_index)
+
+    @staticmethod
+    def _records_in(path: pathlib.Path) -> int:
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return 0
+        return max(0, size - len(SEGMENT_MAGIC)) // RECORD_FORMAT.size
+
+    def append(self, timestamp: float, values: Sequence[Optional[float]]) -> None:
+        """Buffer a record. It is written to disk on the next flush."""
+        record = RECORD_FORMAT.pack(
+            timestamp, *(math.nan if v is None else v for v in values)
+        )
+        with self._lock:
+            self._pending += record
+
+    def flush(self) -> None:
+        """Write the buffered records to disk and fsync them.
+
+        This blocks on disk I/O, so call it from a worker thread.
+        """
+        with self._flush_lock:
+            with self._lock:
+                # emptied in place, so that an append interrupted by the
+                # signal handler still adds its record to the buffer
+                data = bytes(self._pending)
+                del self._pending[:]
+            self._write(data)
+
+    def _write(self, data: bytes) -> None:
+        while data:
+            if self._segment_count >= self.segment_records:
+                self._rotate()
+            path = self._segment_path()
+            room = (self.segment_records - self._segment_count) * RECORD_FORMAT.size
+            chunk, data = data[:room], data[room:]
+            with open(path, "ab") as f:
+                if f.tell() < len(SEGMENT_MAGIC):
+                    # a new segment, or one whose header write was interrupted
+                    f.truncate(0)
+                    f.write(SEGMENT_MAGIC)
+                else:
+                    # drop a partial record left by an interrupted write
+                    valid = (
+                        len(SEGMENT_MAGIC) + self._segment_count * RECORD_FORMAT.size
+                    )
+                    if f.tell() != valid:
+                        f.truncate(valid)
+                f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            self._segment_count += len(chunk) // RECORD_FORMAT.size
+
+    def _rotate(self) -> None:
+        self._segment_index += 1
+        self._segment_count = 0
+        segments = list_segments(self.directory)
+        # keep max_segments including the new one
+        for _, path in segments[: max(0, len(segments) + 1 - self.max_segments)]:
+            path.unlink()
+
+
+def _opt(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def read_segment(path: pathlib.Path) -> Iterator[Record]:
+    """Read the records of a segment file through a memory map."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(SEGMENT_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[: len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                raise ValueError(f"{path} is not a telemetry log segment")
+            n = (size - len(SEGMENT_MAGIC)) // RECORD_FORMAT.size
+            end = len(SEGMENT_MAGIC) + n * RECORD_FORMAT.size
+            for offset in range(len(SEGMENT_MAGIC), end, RECORD_FORMAT.size):
+                t, v_in, v_supercap, i_in, t_mcu = RECORD_FORMAT.unpack_from(mm, offset)
+                yield (t, _opt(v_in), _opt(v_supercap), _opt(i_in), _opt(t_mcu))
+
+
+def read_log(
+    directory: pathlib.Path,
+    since: float = -math.inf,
+    until: float = math.inf,
+) -> Iterator[Record]:
+    """Read the records with since <= timestamp <= until from all segments."""
+    for _, path in list_segments(directory):
+        for record in read_segment(path):
+            if since <= record[0] <= until:
+                yield record
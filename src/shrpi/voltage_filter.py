@@ -0,0 +1,53 @@
+"""Noise filtering of the input voltage for the blackout detection."""
+
+import math
+import statistics
+from array import array
+
+FILTER_KINDS = ("median", "ema")
+
+
+class VoltageFilter:
+    """Smooth the input voltage over the last `window` samples.
+
+    The samples are kept in a preallocated ring buffer. A median rejects
+    isolated spikes and dips outright, while an exponential moving average
+    (with the smoothing factor of a `window` sample simple average) damps
+    continuous ripple. A window of 1 passes the samples through.
+
+    Examples:
+        >>> median = VoltageFilter("median", 3)
+        >>> [median.update(v) for v in (12.0, 3.0, 12.0, 12.5, 3.0, 2.0)]
+        [12.0, 7.5, 12.0, 12.0, 12.0, 3.0]
+        >>> ema = VoltageFilter("ema", 3)
+        >>> [ema.update(v) for v in (12.0, 4.0, 4.0)]
+        [12.0, 8.0, 6.0]
+    """
+
+    def __init__(self, kind: str = "median", window: int = 1):
+        if kind not in FILTER_KINDS:
+            raise ValueError(f"Unknown voltage filter {kind!r}")
+        if window < 1:
+            raise ValueError("Voltage filter window must be positive")
+        self.kind = kind
+        self.window = window
+        self._buffer = array("d", bytes(8 * window))
+        self._next = 0
+        self._size = 0
+        self._ema = math.nan
+        self.value = math.nan
+
+    def update(self, voltage: float) -> float:
+        """Add a sample and return the filtered voltage."""
+        self._buffer[self._next] = voltage
+        self._next = (self._next + 1) % self.window
+        self._size = min(self._size + 1, self.window)
+        if self.kind == "median":
+            self.value = statistics.median(self._buffer[: self._size])
+        elif self._size == 1:
+            self._ema = voltage
+            self.value = voltage
+        else:
+            self._ema += 2.0 / (self.window + 1) * (voltage - self._ema)
+            self.value = self._ema
+        return self.value
@@ -0,0 +1,140 @@
+"""Explicit feeding and monitoring of the SH-RPi watchdog."""
+
+import os
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from shrpi.const import (
+    DEFAULT_WATCHDOG_FEED_INTERVAL,
+    DEFAULT_WATCHDOG_HEARTBEAT_TIMEOUT,
+    DEFAULT_WATCHDOG_WARN_SLACK,
+)
+from shrpi.i2c import SHRPiDevice
+from shrpi.metrics import Histogram
+
+# Bucket upper bounds (in seconds) for watchdog feed intervals and elapsed times
+WATCHDOG_BUCKETS = (0.5, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0)
+
+
+class WatchdogFeeder:
+    """Feed the device watchdog from a dedicated thread.
+
+    Any bus transaction resets the watchdog. The feeder reads the watchdog
+    elapsed register at a fixed interval, which both feeds the watchdog and
+    tells how long it had been since the previous transaction. The thread
+    only contends for the bus lock, so a busy event loop or a slow executor
+    job can't delay it.
+
+    The thread only feeds the watchdog while the event loop keeps calling
+    `heartbeat`. If the heartbeat is older than `heartbeat_timeout`, a
+    deadlocked loop or a dead state machine task is assumed and the feeding
+    stops, so that the device resets the system.
+    """
+
+    def __init__(
+        self,
+        device: SHRPiDevice,
+        interval: float = DEFAULT_WATCHDOG_FEED_INTERVAL,
+        warn_slack: float = DEFAULT_WATCHDOG_WARN_SLACK,
+        heartbeat_timeout: float = DEFAULT_WATCHDOG_HEARTBEAT_TIMEOUT,
+    ):
+        self.device = device
+        self.interval = interval
+        self.warn_slack = warn_slack
+        self.heartbeat_timeout = heartbeat_timeout
+        self.feed_intervals = Histogram(WATCHDOG_BUCKETS)
+        self.elapsed = Histogram(WATCHDOG_BUCKETS)
+        self.last_elapsed: Optional[float] = None
+        self.min_slack: Optional[float] = None
+        self.low_slack_events = 0
+        self.errors = 0
+        # feeds skipped because the heartbeat was stale
+        self.starved_feeds = 0
+        self.starving = False
+        self._last_heartbeat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def heartbeat(self) -> None:
+        """Tell the feeder that the event loop is alive."""
+        self._last_heartbeat = time.monotonic()
+
+    def heartbeat_age(self) -> float:
+        """Seconds since the last heartbeat."""
+        return time.monotonic() - self._last_heartbeat
+
+    def start(self) -> None:
+        # the first heartbeat is due a heartbeat timeout after the start
+        self.heartbeat()
+        self._thread = threading.Thread(
+            target=self._run, name="shrpi-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def feed(self) -> None:
+        """Feed the watchdog once and check how close it came to firing."""
+        with self.device.i2c.lock:
+            elapsed = self.device.watchdog_elapsed()
+            timeout = self.device.watchdog_timeout()  # cached, no bus traffic
+        self.last_elapsed = elapsed
+        self.elapsed.observe(elapsed)
+        if not timeout:
+            # the watchdog is disabled
+            return
+
+        slack = timeout - elapsed
+        if self.min_slack is None or slack < self.min_slack:
+            self.min_slack = slack
+        if slack < self.warn_slack:
+            self.low_slack_events += 1
+            logger.warning(
+                f"Watchdog was fed {elapsed:.1f} s after the previous bus "
+                f"transaction, only {slack:.1f} s before the {timeout:.1f} s timeout"
+            )
+
+    def _run(self) -> None:
+        try:
+            # a slightly higher priority keeps the feeder on time under load
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -5)
+        except (AttributeError, OSError):
+            pass
+
+        last_feed: Optional[float] = None
+        next_feed = time.monotonic()
+        while not self._stop.wait(max(0.0, next_feed - time.monotonic())):
+            age = self.heartbeat_age()
+            if age > self.heartbeat_timeout:
+                if not self.starving:
+                    logger.error(
+                        f"No heartbeat from the event loop in {age:.1f} s, "
+                        "no longer feeding the watchdog"
+                    )
+                    self.starving = True
+                self.starved_feeds += 1
+                next_feed = time.monotonic() + self.interval
+                continue
+            if self.starving:
+                logger.warning("Event loop heartbeat is back, feeding the watchdog")
+                self.starving = False
+            try:
+                self.feed()
+            except OSError as e:
+                self.errors += 1
+                logger.error(f"Failed to feed the watchdog: {e!s}")
+            else:
+                now = time.monotonic()
+                if last_feed is not None:
+                    self.feed_intervals.observe(now - last_feed)
+                last_feed = now
+            now = time.monotonic()
+            next_feed += self.interval
+            if next_feed < now:
+                next_feed = now + self.interval
@@ -0,0 +1,87 @@
+"""Tests for reloading the configuration on SIGHUP."""
+import asyncio
+import sys
+
+from loguru import logger
+
+from shrpi.daemon import reload_config, reparse_arguments
+from shrpi.devices import ManagedDevice, open_devices, parse_devices
+from shrpi.sampler import Sampler
+from shrpi.shutdown import ShutdownOrchestrator
+from shrpi.simulator import SimulatedSHRPi
+from shrpi.state_machine import StateMachineSettings
+from shrpi.watchdog import WatchdogFeeder
+
+
+def test_reload_applies_reloadable_settings(tmp_path, monkeypatch):
+    conf = tmp_path / "shrpid.conf"
+    conf.write_text("blackout-time-limit: 3\n")
+    monkeypatch.setattr(sys, "argv", ["shrpid", "--conf", str(conf)])
+    args = reparse_arguments()
+
+    sim = SimulatedSHRPi(version=2)
+    configs = parse_devices(["1:0x6d"])
+    (async_device,) = open_devices(configs, sim.bus_factory)
+    managed = ManagedDevice(
+        configs[0],
+        async_device,
+        Sampler(async_device),
+        WatchdogFeeder(async_device.device),
+    )
+    settings = StateMachineSettings(
+        args.blackout_time_limit, args.blackout_voltage_limit
+    )
+    shutdown = ShutdownOrchestrator(async_device)
+
+    conf.write_text(
+        "blackout-time-limit: 10\n"
+        "watchdog-timeout: 20\n"
+        "blackout-policy: all\n"
+        f"socket: {tmp_path / 'other.sock'}\n"
+    )
+    messages = []
+    handler = logger.add(messages.append, format="{level} {message}")
+    try:
+        new_args = asyncio.run(reload_config(args, settings, [managed], shutdown))
+    finally:
+        logger.remove(handler)
+        async_device.close()
+
+    # applied live
+    assert settings.blackout_time_limit == 10
+    assert new_args.blackout_time_limit == 10
+    assert sim.watchdog_timeout == 20
+    assert settings.blackout_policy == "all"
+    # only logged
+    assert new_args.socket is None
+    assert any(
+        m.startswith("WARNING Changing socket requires a restart") for m in messages
+    )
+
+
+def test_reload_keeps_settings_on_invalid_config(tmp_path, monkeypatch):
+    conf = tmp_path / "shrpid.conf"
+    conf.write_text("blackout-time-limit: 3\n")
+    monkeypatch.setattr(sys, "argv", ["shrpid", "--conf", str(conf)])
+    args = reparse_arguments()
+    settings = StateMachineSettings(3, args.blackout_voltage_limit)
+
+    conf.write_text("blackout-filter: invalid\nblackout-time-limit: 10\n")
+    new_args = asyncio.run(reload_config(args, settings, [], None))
+    assert new_args is args
+    assert settings.blackout_time_limit == 3
+
+
+def test_reload_rejects_sampling_slower_than_heartbeat(tmp_path, monkeypatch):
+    conf = tmp_path / "shrpid.conf"
+    conf.write_text("slow-sample-interval: 1\n")
+    monkeypatch.setattr(sys, "argv", ["shrpid", "--conf", str(conf)])
+    args = reparse_arguments()
+    settings = StateMachineSettings(
+        args.blackout_time_limit, args.blackout_voltage_limit, slow_interval=1
+    )
+
+    conf.write_text("slow-sample-interval: 5\nwatchdog-heartbeat-timeout: 5\n")
+    new_args = asyncio.run(reload_config(args, settings, [], None))
+    assert new_args is args
+    assert settings.slow_interval == 1
@@ -0,0 +1,26 @@
+"""Tests for managing several devices using the simulated bus."""
+import pytest
+
+from shrpi.devices import open_devices, parse_devices
+from shrpi.i2c import DeviceNotFoundError
+from shrpi.simulator import SimulatedBus, SimulatedSHRPi
+
+
+def test_devices_on_one_bus_share_the_bus():
+    sims = [SimulatedSHRPi(version=1, addr=0x6D), SimulatedSHRPi(version=2, addr=0x6E)]
+    configs = parse_devices(["1:0x6d", "aux=1:0x6e"])
+    main, aux = open_devices(configs, SimulatedBus(sims).bus_factory)
+    assert main.device.i2c is aux.device.i2c
+    assert main.device.hardware_version() == "1.0.3"
+    assert aux.device.hardware_version() == "2.0.0"
+    main.device.set_watchdog_timeout(5)
+    assert (sims[0].watchdog_timeout, sims[1].watchdog_timeout) == (5.0, 0.0)
+
+
+def test_invalid_devices():
+    with pytest.raises(ValueError):
+        parse_devices(["a=1:0x6d", "a=1:0x6e"])
+    with pytest.raises(ValueError):
+        parse_devices(["1:0x6d", "1:109"])
+    with pytest.raises(DeviceNotFoundError):
+        open_devices(parse_devices(["1:0x6e"]), SimulatedSHRPi().bus_factory)
@@ -0,0 +1,26 @@
+"""Tests for the supercap energy estimator."""
+import math
+
+from shrpi.energy import SupercapEstimator
+from shrpi.i2c import Measurements
+
+
+def test_estimate_follows_blackout():
+    estimator = SupercapEstimator()
+    # 12 V at 0.25 A before the blackout: a 3 W load
+    for t in range(3):
+        estimator.observe(float(t), Measurements(12.0, 8.0, 0.25, None), False)
+    assert estimator.time_remaining(5.0) is None
+
+    # a 1.5 F supercap feeding 3 W loses 4 V²/s
+    for t in range(3, 8):
+        voltage = math.sqrt(64.0 - 4.0 * (t - 3))
+        estimator.observe(float(t), Measurements(0.0, voltage, 0.0, None), True)
+    assert math.isclose(estimator.discharge_rate(), -4.0)
+    assert math.isclose(estimator.time_remaining(5.0), (48.0 - 25.0) / 4.0)
+    assert math.isclose(estimator.energy_remaining(5.0), 3.0 * 23.0 / 4.0)
+    assert math.isclose(estimator.capacitance(), 1.5)
+
+    # the fit starts over when the power comes back
+    estimator.observe(8.0, Measurements(12.0, 7.0, 0.25, None), False)
+    assert estimator.discharge_rate() is None
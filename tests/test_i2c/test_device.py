@@ -0,0 +1,124 @@
+"""Tests for the SH-RPi device interface using the simulated bus."""
+import pytest
+
+from shrpi.i2c import DeviceNotFoundError, SHRPiDevice, SHRPiV1Device, SHRPiV2Device
+from shrpi.simulator import SimulatedSHRPi
+
+
+@pytest.mark.parametrize(
+    ("version", "device_cls", "hw_version", "fw_version"),
+    [
+        (1, SHRPiV1Device, "1.0.3", "1.0.5"),
+        (2, SHRPiV2Device, "2.0.0", "2.1.0"),
+    ],
+)
+def test_factory_detects_version(version, device_cls, hw_version, fw_version):
+    sim = SimulatedSHRPi(version=version)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    assert isinstance(device, device_cls)
+    assert device.hardware_version() == hw_version
+    assert device.firmware_version() == fw_version
+
+
+def test_factory_probes_once():
+    sim = SimulatedSHRPi(version=2)
+    SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    # legacy and current registers for both the hardware and firmware versions
+    assert sim.transactions == 4
+
+
+def test_factory_device_not_found():
+    sim = SimulatedSHRPi(version=2, addr=0x6D)
+    with pytest.raises(DeviceNotFoundError):
+        SHRPiDevice.factory(1, 0x6E, bus_factory=sim.bus_factory)
+
+
+def test_v2_measurements_in_one_transaction():
+    sim = SimulatedSHRPi(
+        version=2,
+        dcin_voltage=12.5,
+        supercap_voltage=7.5,
+        input_current=1.2,
+        temperature=300.0,
+    )
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    before = sim.transactions
+    m = device.read_measurements()
+    assert sim.transactions == before + 1
+    assert m.dcin_voltage == pytest.approx(12.5, abs=1e-3)
+    assert m.supercap_voltage == pytest.approx(7.5, abs=1e-3)
+    assert m.input_current == pytest.approx(1.2, abs=1e-3)
+    assert m.temperature == pytest.approx(300.0, abs=1e-2)
+    assert m == (
+        device.dcin_voltage(),
+        device.supercap_voltage(),
+        device.input_current(),
+        device.temperature(),
+    )
+
+
+def test_v1_measurements():
+    sim = SimulatedSHRPi(version=1, dcin_voltage=12.0, supercap_voltage=2.5)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    m = device.read_measurements()
+    assert m.dcin_voltage == pytest.approx(12.0, abs=0.2)
+    assert m.supercap_voltage == pytest.approx(2.5, abs=0.02)
+    assert m.input_current is None
+    assert m.temperature is None
+
+
+def test_config_registers_are_write_through_cached():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    device.set_watchdog_timeout(12.5)
+    device.set_led_brightness(42)
+    before = sim.transactions
+    assert device.watchdog_timeout() == 12.5
+    assert device.led_brightness() == 42
+    assert sim.transactions == before
+    assert sim.watchdog_timeout == 12.5
+
+
+def test_state_cache_is_invalidated_by_commands():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    assert device.state() == "POWER_ON_5V_ON"
+    device.request_shutdown()
+    assert device.state() == "SHUTDOWN"
+
+
+def test_bus_recovers_from_transient_error():
+    sim = SimulatedSHRPi(version=2, dcin_voltage=12.0)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    sim.fail_next(1)
+    assert device.dcin_voltage() == pytest.approx(12.0, abs=1e-3)
+    assert sim.errors == 1
+    sim.fail_next(2)
+    with pytest.raises(OSError):
+        device.dcin_voltage()
+    assert device.i2c.errors == 3
+    assert device.i2c.reopens == 2
+    assert device.i2c.latency.count == device.i2c.transactions
+
+
+def test_write_config_applies_all_keys():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    device.write_config({"watchdog_timeout": 15, "led_brightness": 7.0})
+    before = sim.transactions
+    config = device.read_config()
+    assert config["watchdog_timeout"] == 15.0
+    assert config["led_brightness"] == 7
+    assert sim.transactions - before == 2  # only the thresholds are read
+
+
+def test_write_through_cache_matches_device_after_truncation():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    device.set_led_brightness(300)
+    # beyond the full scale of 9.35 V
+    device.set_power_on_threshold(10.0)
+    before = sim.transactions
+    assert device.led_brightness() == sim.led_brightness == 300 & 0xFF
+    assert device.power_on_threshold() == pytest.approx(sim.power_on_threshold)
+    assert sim.transactions == before
@@ -0,0 +1,69 @@
+"""Tests for the shared measurement sampler."""
+import asyncio
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.i2c import SHRPiDevice
+from shrpi.sampler import Sampler
+from shrpi.simulator import SimulatedSHRPi
+
+
+def make_sampler(sim, interval=0.01):
+    device = AsyncSHRPiDevice(
+        SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    )
+    return Sampler(device, interval=interval)
+
+
+def test_consumers_share_samples():
+    sim = SimulatedSHRPi(version=2)
+
+    async def main():
+        sampler = make_sampler(sim)
+        task = asyncio.ensure_future(sampler.run())
+        first = await sampler.wait_for_sample()
+        transactions = sim.transactions
+        # many consumers waiting for the next sample cost one bus read
+        samples = await asyncio.gather(
+            *(sampler.wait_for_sample(first.seq) for _ in range(10))
+        )
+        assert sim.transactions - transactions == 1
+        assert len({sample.seq for sample in samples}) == 1
+        assert samples[0].seq == first.seq + 1
+        # the values didn't change, so neither does the ETag base
+        assert samples[0].changed_seq == first.changed_seq
+        task.cancel()
+        sampler.shrpi_device.close()
+
+    asyncio.run(main())
+
+
+def test_changed_values_start_a_new_run():
+    sim = SimulatedSHRPi(version=2, dcin_voltage=12.0)
+
+    async def main():
+        sampler = make_sampler(sim)
+        first = await sampler.latest_sample()
+        assert await sampler.latest_sample() is first
+        sim.dcin_voltage = 11.0
+        second = await sampler.read_fresh()
+        assert second.seq == first.seq + 1
+        assert second.changed_seq == second.seq
+        sampler.shrpi_device.close()
+
+    asyncio.run(main())
+
+
+def test_trigger_samples_immediately():
+    sim = SimulatedSHRPi(version=2)
+
+    async def main():
+        sampler = make_sampler(sim, interval=60.0)
+        task = asyncio.ensure_future(sampler.run())
+        first = await sampler.wait_for_sample()
+        sampler.trigger()
+        second = await asyncio.wait_for(sampler.wait_for_sample(first.seq), 5.0)
+        assert second.seq == first.seq + 1
+        task.cancel()
+        sampler.shrpi_device.close()
+
+    asyncio.run(main())
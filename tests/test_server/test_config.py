@@ -0,0 +1,98 @@
+"""Tests for validating and writing the configuration over the API."""
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.i2c import SHRPiDevice
+from shrpi.sampler import Sampler
+from shrpi.server import RouteHandlers, routes
+from shrpi.simulator import SimulatedSHRPi
+
+
+def serve(sim, check, device=None):
+    """Run `check(client)` against an API serving the simulated device."""
+
+    async def main():
+        async_device = AsyncSHRPiDevice(
+            device or SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+        )
+        handlers = RouteHandlers(async_device, Sampler(async_device), "true")
+        app = web.Application()
+        app.add_routes(routes(handlers))
+        async with TestClient(TestServer(app)) as client:
+            await check(client)
+        async_device.close()
+
+    asyncio.run(main())
+
+
+def test_patch_validates_all_values_first():
+    sim = SimulatedSHRPi(version=2)
+
+    async def check(client):
+        for body in (
+            {"watchdog_timeout": 12, "led_brightness": 300},
+            {"watchdog_timeout": 12, "led_brightness": True},
+            {"watchdog_timeout": 70},
+            {"power_off_threshold": -1.0},
+            {"led_brightness": 6.5},
+        ):
+            response = await client.patch("/config", json=body)
+            assert response.status == 400, body
+        assert sim.watchdog_timeout == 0.0
+        assert sim.led_brightness == 128
+
+        response = await client.patch(
+            "/config", json={"watchdog_timeout": 12, "led_brightness": 255}
+        )
+        assert response.status == 204
+        config = await (await client.get("/config")).json()
+        assert config["watchdog_timeout"] == 12
+        assert config["led_brightness"] == 255
+
+    serve(sim, check)
+
+
+def test_put_validates_range():
+    sim = SimulatedSHRPi(version=1)
+
+    async def check(client):
+        # the v1 watchdog register holds tenths of a second in a byte
+        response = await client.put("/config/watchdog_timeout", json=30)
+        assert response.status == 400
+        response = await client.put("/config/watchdog_timeout", json=False)
+        assert response.status == 400
+        response = await client.put("/config/watchdog_timeout", data="{")
+        assert response.status == 400
+        assert await response.text() == "Invalid JSON"
+        response = await client.put("/config/watchdog_timeout", json=25)
+        assert response.status == 204
+        assert sim.watchdog_timeout == 25
+        response = await client.put("/config/unknown", json=1)
+        assert response.status == 404
+
+    serve(sim, check)
+
+
+def test_patch_reports_applied_values_on_failure():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+
+    def set_led_brightness(brightness):
+        raise OSError(5, "Input/output error")
+
+    device.set_led_brightness = set_led_brightness
+
+    async def check(client):
+        response = await client.patch(
+            "/config", json={"watchdog_timeout": 12, "led_brightness": 64}
+        )
+        assert response.status == 500
+        result = await response.json()
+        assert result["applied"] == ["watchdog_timeout"]
+        assert result["failed"] == "led_brightness"
+        assert sim.watchdog_timeout == 12
+
+    serve(sim, check, device)
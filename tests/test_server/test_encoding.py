@@ -0,0 +1,33 @@
+"""Tests for conditional and compact responses."""
+import json
+
+from aiohttp.test_utils import make_mocked_request
+
+from shrpi.server import encoded_response
+
+
+def test_conditional_get():
+    data = {"V_in": 12.0}
+    response = encoded_response(make_mocked_request("GET", "/values"), data, "x-1")
+    assert response.status == 200
+    assert response.etag.value == "x-1"
+    assert json.loads(response.body) == data
+
+    request = make_mocked_request(
+        "GET", "/values", headers={"If-None-Match": '"x-0", "x-1"'}
+    )
+    response = encoded_response(request, data, "x-1")
+    assert response.status == 304
+    assert response.body is None
+
+    request = make_mocked_request("GET", "/values", headers={"If-None-Match": '"x-0"'})
+    assert encoded_response(request, data, "x-1").status == 200
+
+
+def test_unknown_encoding_falls_back_to_json():
+    request = make_mocked_request(
+        "GET", "/values", headers={"Accept": "application/x-unknown"}
+    )
+    response = encoded_response(request, [1, 2], "x-1")
+    assert response.content_type == "application/json"
+    assert response.etag.value == "x-1"
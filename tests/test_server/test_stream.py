@@ -0,0 +1,76 @@
+"""Tests for the streaming telemetry endpoint."""
+import asyncio
+import json
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.i2c import SHRPiDevice
+from shrpi.sampler import Sampler
+from shrpi.server import RouteHandlers, routes
+from shrpi.simulator import SimulatedSHRPi
+
+
+def stream_lines(query, n, timeout):
+    """Read up to `n` NDJSON lines from /stream within `timeout` seconds."""
+
+    async def main():
+        sim = SimulatedSHRPi(version=2, dcin_voltage=12.0)
+        device = AsyncSHRPiDevice(
+            SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+        )
+        sampler = Sampler(device, interval=0.01)
+        sampler_task = asyncio.ensure_future(sampler.run())
+        app = web.Application()
+        app.add_routes(routes(RouteHandlers(device, sampler, "true")))
+        lines = []
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/stream", params=query)
+            assert response.status == 200
+            assert response.content_type == "application/x-ndjson"
+
+            async def read():
+                while len(lines) < n:
+                    lines.append(json.loads(await response.content.readline()))
+
+            try:
+                await asyncio.wait_for(read(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            response.close()
+        sampler_task.cancel()
+        device.close()
+        return lines
+
+    return asyncio.run(main())
+
+
+def test_unchanged_samples_are_pushed_at_interval():
+    lines = stream_lines({"format": "ndjson", "interval": "0.02"}, 3, timeout=5.0)
+    assert len(lines) == 3
+    assert [line["V_in"] for line in lines] == [lines[0]["V_in"]] * 3
+    assert lines[0]["timestamp"] < lines[1]["timestamp"] < lines[2]["timestamp"]
+
+
+def test_deadband_suppresses_unchanged_samples():
+    query = {"format": "ndjson", "interval": "0.02", "deadband": "0.1"}
+    lines = stream_lines(query, 3, timeout=0.5)
+    assert len(lines) == 1
+
+
+def test_invalid_parameters():
+    async def main():
+        sim = SimulatedSHRPi(version=2)
+        device = AsyncSHRPiDevice(
+            SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+        )
+        app = web.Application()
+        app.add_routes(routes(RouteHandlers(device, Sampler(device), "true")))
+        async with TestClient(TestServer(app)) as client:
+            for query in ({"deadband": "-1"}, {"interval": "x"}, {"format": "xml"}):
+                response = await client.get("/stream", params=query)
+                assert response.status == 400, query
+        device.close()
+
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""Tests for the connection cap and rate limiting of the TCP listener."""
+import asyncio
+import warnings
+
+import aiohttp
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.energy import SupercapEstimator
+from shrpi.i2c import SHRPiDevice
+from shrpi.sampler import Sampler
+from shrpi.server import run_tcp_server
+from shrpi.simulator import SimulatedSHRPi
+
+
+def serve_tcp(check, **kwargs):
+    """Run `check(sim, url)` against a TCP listener serving a simulated device.
+
+    The keyword arguments are passed on to `run_tcp_server`.
+    """
+
+    async def main():
+        sim = SimulatedSHRPi(version=2)
+        device = AsyncSHRPiDevice(
+            SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+        )
+        runner = await run_tcp_server(
+            device, Sampler(device), "127.0.0.1", 0, **kwargs
+        )
+        host, port = runner.addresses[0][:2]
+        try:
+            await check(sim, f"http://{host}:{port}")
+        finally:
+            await runner.cleanup()
+            device.close()
+
+    asyncio.run(main())
+
+
+def test_burst_limit():
+    async def check(sim, url):
+        async with aiohttp.ClientSession() as session:
+            for _ in range(3):
+                async with session.get(f"{url}/state") as response:
+                    assert response.status == 200
+            async with session.get(f"{url}/state") as response:
+                assert response.status == 429
+                assert int(response.headers["Retry-After"]) >= 1
+            # cached routes are still served
+            for route in ("/values", "/energy"):
+                async with session.get(f"{url}{route}") as response:
+                    assert response.status == 200
+
+    serve_tcp(check, rate_limit=0.01, rate_burst=3, estimator=SupercapEstimator())
+
+
+def test_fresh_read_is_downgraded_when_rate_limited():
+    async def check(sim, url):
+        async with aiohttp.ClientSession() as session:
+            transactions = sim.transactions
+            async with session.get(f"{url}/values?fresh=1") as response:
+                assert response.status == 200
+            assert sim.transactions == transactions + 1
+
+            transactions = sim.transactions
+            async with session.get(f"{url}/values?fresh=1") as response:
+                assert response.status == 200
+                assert "V_in" in await response.json()
+            # served from the shared sample without touching the bus
+            assert sim.transactions == transactions
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        serve_tcp(check, rate_limit=0.01, rate_burst=1)
+    assert not [w for w in caught if "request" in str(w.message).lower()]
+
+
+def test_connection_cap():
+    async def check(sim, url):
+        async with aiohttp.ClientSession() as first, aiohttp.ClientSession() as second:
+            # keep the first connection open
+            async with first.get(f"{url}/version") as response:
+                assert response.status == 200
+            async with second.get(f"{url}/version") as response:
+                assert response.status == 503
+            async with first.get(f"{url}/version") as response:
+                assert response.status == 200
+
+            # an idle connection over the cap doesn't lock out the first one
+            host, port = url[len("http://") :].split(":")
+            reader, writer = await asyncio.open_connection(host, int(port))
+            await asyncio.sleep(0.1)
+            async with first.get(f"{url}/version") as response:
+                assert response.status == 200
+            writer.write(b"GET /version HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            status_line = await reader.readline()
+            assert b" 503 " in status_line
+            writer.close()
+            await writer.wait_closed()
+
+    serve_tcp(check, max_connections=1, rate_limit=0)
@@ -0,0 +1,105 @@
+"""Tests for the shutdown orchestrator using the simulated bus."""
+import asyncio
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.energy import SupercapEstimator
+from shrpi.i2c import SHRPiDevice, States
+from shrpi.shutdown import ShutdownOrchestrator
+from shrpi.simulator import SimulatedSHRPi
+
+
+def make_device():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    return sim, AsyncSHRPiDevice(device)
+
+
+def test_shutdown_runs_once(tmp_path, monkeypatch):
+    # run the poweroff command without sudo
+    monkeypatch.setattr("shrpi.shutdown.os.geteuid", lambda: 0)
+    sim, device = make_device()
+    marker = tmp_path / "poweroff"
+    calls = []
+
+    async def hook():
+        calls.append("hook")
+
+    async def slow_hook():
+        await asyncio.sleep(10)
+
+    async def main():
+        shutdown = ShutdownOrchestrator(
+            device, f"touch {marker}", hook_timeout=0.05, poweroff_timeout=5
+        )
+        shutdown.add_hook("slow", slow_hook)
+        shutdown.add_hook("fast", hook)
+        first = shutdown.request("test")
+        second = shutdown.request("test again")
+        assert first is second
+        await first
+
+    asyncio.run(main())
+    assert calls == ["hook"]  # the slow hook timed out without blocking the rest
+    assert sim.state == States.SHUTDOWN
+    assert marker.exists()
+
+
+def test_dry_run_doesnt_power_off():
+    sim, device = make_device()
+
+    async def main():
+        await ShutdownOrchestrator(device, "false", dry_run=True).request("test")
+
+    asyncio.run(main())
+    assert sim.state == States.POWER_ON_5V_ON
+
+
+def test_hooks_run_concurrently_in_order():
+    sim, device = make_device()
+    calls = []
+
+    def sleeper(name):
+        async def hook():
+            await asyncio.sleep(0.2)
+            calls.append(name)
+
+        return hook
+
+    async def main():
+        shutdown = ShutdownOrchestrator(device, "false", dry_run=True)
+        shutdown.add_hook("a", sleeper("a"))
+        shutdown.add_hook("b", sleeper("b"))
+        shutdown.add_hook("c", sleeper("c"), after=["a"])
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        await shutdown.request("test")
+        return shutdown, loop.time() - t0
+
+    shutdown, duration = asyncio.run(main())
+    assert sorted(calls[:2]) == ["a", "b"] and calls[2] == "c"
+    assert duration < 0.55
+    assert [t.outcome for t in shutdown.hook_timings] == ["ok", "ok", "ok"]
+
+
+def test_hooks_abort_when_energy_runs_out():
+    sim, device = make_device()
+    estimator = SupercapEstimator()
+    # discharging at 0.1 V/s and already at the power-off threshold
+    estimator.observe_discharge(0.0, sim.power_off_threshold + 0.1)
+    estimator.observe_discharge(1.0, sim.power_off_threshold)
+
+    async def slow_hook():
+        await asyncio.sleep(10)
+
+    async def main():
+        shutdown = ShutdownOrchestrator(
+            device, "false", dry_run=True, hook_timeout=20, estimator=estimator
+        )
+        shutdown.add_hook("slow", slow_hook)
+        shutdown.add_hook("later", slow_hook, after=["slow"])
+        await asyncio.wait_for(shutdown.request("test"), 2)
+        return shutdown
+
+    shutdown = asyncio.run(main())
+    outcomes = {t.name: t.outcome for t in shutdown.hook_timings}
+    assert outcomes == {"slow": "aborted", "later": "skipped"}
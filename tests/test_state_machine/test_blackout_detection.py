@@ -0,0 +1,194 @@
+"""Tests for the filtered blackout detection of the state machine."""
+import asyncio
+import time
+
+import pytest
+
+from shrpi.async_device import AsyncSHRPiDevice
+from shrpi.energy import SupercapEstimator
+from shrpi.i2c import Measurements, SHRPiDevice
+from shrpi.sampler import Sample, Sampler
+from shrpi.shutdown import ShutdownOrchestrator
+from shrpi.simulator import SimulatedSHRPi, piecewise_linear
+from shrpi.state_machine import (
+    StateMachineSettings,
+    StateMachineStatus,
+    run_state_machine,
+)
+
+
+class ScriptedSampler:
+    """Publish the given input voltages 0.1 s apart, then stop."""
+
+    def __init__(self, voltages, start=None):
+        if start is None:
+            start = time.time()
+        self.samples = [
+            Sample(i + 1, start + 0.1 * i, Measurements(v, 8.0, None, None))
+            for i, v in enumerate(voltages)
+        ]
+
+    async def wait_for_sample(self, after_seq=0):
+        if after_seq >= len(self.samples):
+            raise EOFError
+        return self.samples[after_seq]
+
+    def set_interval(self, interval):
+        pass
+
+
+def run(voltages, settings, estimator=None, start=None, others=()):
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    status = StateMachineStatus()
+    with pytest.raises(EOFError):
+        asyncio.run(
+            run_state_machine(
+                AsyncSHRPiDevice(device),
+                ScriptedSampler(voltages, start),
+                settings.blackout_time_limit,
+                settings.blackout_voltage_limit,
+                dry_run=True,
+                status=status,
+                settings=settings,
+                estimator=estimator,
+                others=others,
+            )
+        )
+    return status
+
+
+def test_spikes_are_filtered():
+    settings = StateMachineSettings(60.0, 9.0, filter_window=3, exit_dwell=0.0)
+    status = run([12.0, 12.0, 3.0, 12.0, 12.0, 3.0, 12.0], settings)
+    assert status.state == "OK"
+    assert status.blackouts == 0
+
+
+def test_hysteresis_and_dwell():
+    settings = StateMachineSettings(
+        60.0, 9.0, filter_window=1, hysteresis=1.0, enter_dwell=0.15, exit_dwell=0.25
+    )
+    voltages = [
+        12.0,
+        # too short to count as a blackout
+        8.0,
+        12.0,
+        # a blackout
+        8.0,
+        8.0,
+        8.0,
+        # within the hysteresis band, then too short to count as resumed
+        9.5,
+        12.0,
+        8.0,
+        # back for good
+        12.0,
+        12.0,
+        12.0,
+        12.0,
+    ]
+    status = run(voltages, settings)
+    assert status.state == "OK"
+    assert (status.blackouts, status.power_resumed) == (1, 1)
+    assert (status.suppressed_blackouts, status.suppressed_resumes) == (1, 1)
+
+
+def test_time_limit_applies_without_runtime_projection():
+    settings = StateMachineSettings(
+        3.0, 9.0, filter_window=1, enter_dwell=0.0, shutdown_budget=5.0
+    )
+    estimator = SupercapEstimator()
+    # 20 s of blackout with a constant supercap voltage: no projection
+    voltages = [12.0] + [8.0] * 200
+    status = run(voltages, settings, estimator, start=time.time() - 20.0)
+    assert estimator.time_remaining(5.5) is None
+    assert status.blackouts == 1
+    assert status.shutdowns == 1
+    assert status.state == "DEAD"
+
+
+def test_all_policy_waits_for_the_other_devices():
+    settings = StateMachineSettings(
+        3.0, 9.0, filter_window=1, enter_dwell=0.0, blackout_policy="all"
+    )
+    voltages = [12.0] + [8.0] * 200
+    other = StateMachineStatus()
+    other.state = "OK"
+    status = run(voltages, settings, start=time.time() - 20.0, others=[other])
+    assert status.state == "BLACKOUT"
+    assert status.shutdowns == 0
+
+    other.state = "BLACKOUT"
+    status = run(voltages, settings, start=time.time() - 20.0, others=[other])
+    assert status.state == "DEAD"
+    assert status.shutdowns == 1
+
+    settings.blackout_policy = "any"
+    other.state = "OK"
+    status = run(voltages, settings, start=time.time() - 20.0, others=[other])
+    assert status.state == "DEAD"
+
+
+def test_shutdown_hooks_abort_when_supercap_drains():
+    # the input power fails at 0.2 s, and the supercap then drains from 8 V to
+    # the 5.5 V power off threshold in 1.5 s
+    sim = SimulatedSHRPi(
+        version=2,
+        dcin_trace=piecewise_linear([(0.0, 12.0), (0.2, 12.0), (0.21, 0.0)]),
+        supercap_trace=piecewise_linear([(0.0, 8.0), (0.2, 8.0), (1.7, 5.5)]),
+    )
+    device = AsyncSHRPiDevice(
+        SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    )
+    settings = StateMachineSettings(
+        0.2, 9.0, fast_interval=0.02, slow_interval=0.02, filter_window=1
+    )
+    estimator = SupercapEstimator(time_constant=0.5)
+    status = StateMachineStatus()
+
+    async def slow_hook():
+        await asyncio.sleep(10)
+
+    async def main():
+        sampler = Sampler(device, interval=0.02)
+        shutdown = ShutdownOrchestrator(
+            device,
+            "false",
+            dry_run=True,
+            hook_timeout=20,
+            estimator=estimator,
+            reserve=0.5,
+        )
+        shutdown.add_hook("slow", slow_hook)
+        shutdown.add_hook("later", slow_hook, after=["slow"])
+        tasks = [
+            asyncio.ensure_future(sampler.run()),
+            asyncio.ensure_future(
+                run_state_machine(
+                    device,
+                    sampler,
+                    settings.blackout_time_limit,
+                    settings.blackout_voltage_limit,
+                    status=status,
+                    shutdown=shutdown,
+                    settings=settings,
+                    estimator=estimator,
+                )
+            ),
+        ]
+        while not shutdown.in_progress:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(shutdown.request("test"), 5)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return shutdown
+
+    shutdown = asyncio.run(main())
+    device.close()
+    assert status.state == "DEAD"
+    outcomes = {t.name: t.outcome for t in shutdown.hook_timings}
+    assert outcomes == {"slow": "aborted", "later": "skipped"}
+    # the load wasn't averaged from the dead input
+    assert estimator.load_power is not None and estimator.load_power > 1.0
@@ -0,0 +1,112 @@
+"""Tests for the segmented telemetry log."""
+import threading
+
+from shrpi.telemetry_log import (
+    RECORD_FORMAT,
+    SEGMENT_MAGIC,
+    TelemetryLog,
+    list_segments,
+    read_log,
+)
+
+
+def values(i):
+    return (12.0 + i, 8.0, None if i % 2 else 0.5, 40.0)
+
+
+def test_round_trip(tmp_path):
+    log = TelemetryLog(tmp_path)
+    for i in range(5):
+        log.append(1000.0 + i, values(i))
+    log.flush()
+    log.flush()  # nothing pending
+
+    records = list(read_log(tmp_path))
+    assert [r[0] for r in records] == [1000.0 + i for i in range(5)]
+    assert records[1] == (1001.0, 13.0, 8.0, None, 40.0)
+    assert records[2][3] == 0.5
+    assert [r[0] for r in read_log(tmp_path, since=1001.0, until=1003.0)] == [
+        1001.0,
+        1002.0,
+        1003.0,
+    ]
+
+    # a new writer carries on in the same segment
+    log = TelemetryLog(tmp_path)
+    log.append(1005.0, values(5))
+    log.flush()
+    assert len(list(read_log(tmp_path))) == 6
+    assert len(list_segments(tmp_path)) == 1
+
+
+def test_rotation(tmp_path):
+    log = TelemetryLog(tmp_path, segment_records=3, max_segments=2)
+    for i in range(10):
+        log.append(float(i), values(i))
+    log.flush()
+
+    # 10 records in segments of 3; only the two newest segments are kept
+    assert [index for index, _ in list_segments(tmp_path)] == [2, 3]
+    assert [r[0] for r in read_log(tmp_path)] == [6.0, 7.0, 8.0, 9.0]
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    log = TelemetryLog(tmp_path)
+    log.append(1.0, values(1))
+    log.flush()
+    (_, path), = list_segments(tmp_path)
+    with open(path, "ab") as f:
+        f.write(RECORD_FORMAT.pack(2.0, 1.0, 2.0, 3.0, 4.0)[:7])
+
+    log = TelemetryLog(tmp_path)
+    log.append(3.0, values(3))
+    log.flush()
+    assert [r[0] for r in read_log(tmp_path)] == [1.0, 3.0]
+
+
+def test_torn_header_is_rewritten(tmp_path):
+    path = tmp_path / "segment-00000000.tlm"
+    path.write_bytes(SEGMENT_MAGIC[:3])
+
+    log = TelemetryLog(tmp_path)
+    log.append(1.0, values(1))
+    log.flush()
+    assert path.read_bytes().startswith(SEGMENT_MAGIC)
+    assert [r[0] for r in read_log(tmp_path)] == [1.0]
+
+
+def test_concurrent_flushes(tmp_path):
+    log = TelemetryLog(tmp_path, segment_records=100)
+    n_threads, n_records = 4, 200
+    start = threading.Barrier(n_threads)
+
+    def writer(k):
+        start.wait()
+        for i in range(n_records):
+            log.append(float(k * n_records + i), values(i))
+            log.flush()
+
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    timestamps = sorted(r[0] for r in read_log(tmp_path))
+    assert timestamps == [float(i) for i in range(n_threads * n_records)]
+
+
+def test_flush_from_within_append(tmp_path):
+    # the SIGTERM handler may flush while the interrupted thread is appending
+    log = TelemetryLog(tmp_path)
+    log.append(1.0, values(1))
+
+    def interrupted_append():
+        with log._lock:
+            log.flush()
+
+    thread = threading.Thread(target=interrupted_append, daemon=True)
+    thread.start()
+    thread.join(timeout=5.0)
+    assert not thread.is_alive()
+    assert [r[0] for r in read_log(tmp_path)] == [1.0]
@@ -0,0 +1,71 @@
+"""Tests for the watchdog feeder using the simulated bus."""
+import time
+
+from shrpi.i2c import SHRPiDevice
+from shrpi.simulator import SimulatedSHRPi
+from shrpi.watchdog import WatchdogFeeder
+
+
+def test_feed_records_slack():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    device.set_watchdog_timeout(10)
+    device.watchdog_timeout()
+    transactions = sim.transactions
+
+    feeder = WatchdogFeeder(device, warn_slack=20)
+    feeder.feed()
+    feeder.feed()
+    # only the elapsed register is read; the timeout comes from the cache
+    assert sim.transactions == transactions + 2
+    assert feeder.elapsed.count == 2
+    assert feeder.min_slack is not None and 9 < feeder.min_slack <= 10
+    assert feeder.low_slack_events == 2
+
+
+def test_feeder_thread_feeds():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    feeder = WatchdogFeeder(device, interval=0.01)
+    feeder.start()
+    assert wait_until(lambda: feeder.feed_intervals.count >= 3)
+    feeder.stop()
+    assert feeder.errors == 0
+    assert feeder.low_slack_events == 0
+
+
+def test_stale_heartbeat_stops_feeding():
+    sim = SimulatedSHRPi(version=2)
+    device = SHRPiDevice.factory(1, sim.addr, bus_factory=sim.bus_factory)
+    feeder = WatchdogFeeder(device, interval=0.01, heartbeat_timeout=0.1)
+    feeder.start()
+    try:
+        # the event loop keeps beating
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            feeder.heartbeat()
+            time.sleep(0.01)
+        assert not feeder.starving
+        assert feeder.starved_feeds == 0
+
+        # and then stalls
+        assert wait_until(lambda: feeder.starving)
+        transactions = sim.transactions
+        time.sleep(0.1)
+        assert sim.transactions == transactions
+        assert feeder.starved_feeds > 0
+
+        feeder.heartbeat()
+        assert wait_until(lambda: sim.transactions > transactions)
+        assert not feeder.starving
+    finally:
+        feeder.stop()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True